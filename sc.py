@@ -1,22 +1,107 @@
-import pyautogui
 import time
 import json
 import os
 import argparse
+import importlib
+import importlib.util
 from datetime import datetime
-import pytesseract
 from PIL import Image, ImageGrab
-import cv2
-import numpy as np
 import logging
 import sys
 import csv
 import threading
-from pytesseract import Output
-import win32gui
-import win32ui
-import win32con
-import win32api
+import contextvars
+import ctypes
+import sqlite3
+import queue
+import atexit
+import hashlib
+import difflib
+import itertools
+import string
+import shutil
+import subprocess
+import tempfile
+import tracemalloc
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_lazy_lock = threading.RLock()
+
+class _LazyModule:
+    """Stand-in for a heavy module, imported on first attribute access
+
+    Loading replaces the stand-in in this module's globals, so later
+    lookups reach the real module directly. An optional module that fails
+    to import becomes None and its stand-in is falsy; test availability
+    with truthiness rather than "is None".
+    """
+
+    def __init__(self, name, alias=None, on_load=None, optional=False):
+        self._name = name
+        self._alias = alias or name
+        self._on_load = on_load
+        self._optional = optional
+
+    def _load(self):
+        with _lazy_lock:
+            module = globals().get(self._alias)
+            if module is not self:
+                return module
+            try:
+                module = importlib.import_module(self._name)
+            except Exception:
+                if not self._optional:
+                    raise
+                module = None
+            else:
+                if self._on_load is not None:
+                    self._on_load(module)
+            globals()[self._alias] = module
+            return module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        if module is None:
+            raise AttributeError(f"{self._name} is not available on this system")
+        return getattr(module, attr)
+
+    def __bool__(self):
+        return self._load() is not None
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+def _optional_module(name, on_load=None):
+    """A lazy stand-in for an optional module, or None when it is not installed"""
+    if importlib.util.find_spec(name) is None:
+        return None
+    return _LazyModule(name, on_load=on_load, optional=True)
+
+def _configure_pyautogui(module):
+    # Screens are synchronised with wait_for polling, so the per-call pause
+    # only needs to cover input delivery
+    module.FAILSAFE = True
+    module.PAUSE = INPUT_PAUSE
+
+def _configure_pytesseract(module):
+    module.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+# OpenCV, numpy, Tesseract and asyncio load on first use, so validating a
+# sequence or starting a worker does not pay for them. pyautogui and the
+# win32 modules need a desktop session; the replay backend runs without them
+# (e.g. on headless Linux CI)
+asyncio = _LazyModule("asyncio")
+cv2 = _LazyModule("cv2")
+np = _LazyModule("numpy", alias="np")
+pytesseract = _LazyModule("pytesseract", on_load=_configure_pytesseract)
+pyautogui = _optional_module("pyautogui", on_load=_configure_pyautogui)
+mss = _optional_module("mss")
+win32gui = _optional_module("win32gui")
+win32ui = _optional_module("win32ui")
+win32con = _optional_module("win32con")
+win32api = _optional_module("win32api")
 
 # Configure logging
 logging.basicConfig(
@@ -28,203 +113,3484 @@ logging.basicConfig(
     ]
 )
 
-# Configure PyAutoGUI settings
-pyautogui.FAILSAFE = True
-pyautogui.PAUSE = 0.5
+# Pause pyautogui adds after each input call
+INPUT_PAUSE = float(os.environ.get("INPUT_PAUSE", "0.05"))
+
+class ScreenBackend:
+    """Interface for screen capture and input used by the automation code"""
+
+    def capture(self, region=None):
+        """Return a PIL image of the screen, or of the (x1, y1, x2, y2) region"""
+        raise NotImplementedError
+
+    def grab(self, region=None):
+        """Return a frame for comparison only (frame_signature); may be a reused buffer"""
+        return self.capture(region)
+
+    def move_to(self, x, y, duration=0.0):
+        """Move the mouse to a screen position"""
+        raise NotImplementedError
+
+    def click(self, x=None, y=None, click_type="single", duration=0.0):
+        """Click at a position (or the current one); 'move' only moves the mouse"""
+        raise NotImplementedError
+
+    def type_text(self, text):
+        """Type a string"""
+        raise NotImplementedError
+
+    def press(self, key):
+        """Press a single key"""
+        raise NotImplementedError
+
+    def hotkey(self, *keys):
+        """Press a key combination"""
+        raise NotImplementedError
+
+    def position(self):
+        """Return the current mouse position as (x, y)"""
+        raise NotImplementedError
+
+    def screen_size(self):
+        """Return the screen's (width, height), used to clip capture regions"""
+        return self.capture(None).size
+
+    def close(self):
+        """Release capture handles; the backend is not used afterwards"""
+
+
+class PyAutoGUIBackend(ScreenBackend):
+    """Live desktop backend using ImageGrab for capture and pyautogui for input"""
+
+    def __init__(self):
+        if not pyautogui:
+            raise RuntimeError("pyautogui is not available on this system")
+
+    def capture(self, region=None):
+        try:
+            # Use PIL's ImageGrab directly - works on both Mac and Windows
+            screenshot = ImageGrab.grab(bbox=region) if region else ImageGrab.grab()
+        except Exception as e:
+            logging.warning(f"ImageGrab failed, falling back to pyautogui: {str(e)}")
+            # pyautogui takes (left, top, width, height), not a bbox
+            screenshot = pyautogui.screenshot(region=Region.from_bbox(region).xywh) if region \
+                else pyautogui.screenshot()
+        return screenshot.convert('RGB')
+
+    def move_to(self, x, y, duration=0.0):
+        pyautogui.moveTo(x, y, duration=duration)
+
+    def click(self, x=None, y=None, click_type="single", duration=0.0):
+        if x is not None and y is not None:
+            pyautogui.moveTo(x, y, duration=duration)
+        if click_type == "single":
+            pyautogui.click()
+        elif click_type == "double":
+            pyautogui.doubleClick()
+        elif click_type == "right":
+            pyautogui.rightClick()
+
+    def type_text(self, text):
+        pyautogui.write(text)
+
+    def press(self, key):
+        pyautogui.press(key)
+
+    def hotkey(self, *keys):
+        pyautogui.hotkey(*keys)
+
+    def position(self):
+        x, y = pyautogui.position()
+        return x, y
+
+    def screen_size(self):
+        width, height = pyautogui.size()
+        return width, height
+
+
+class ReplayBackend(ScreenBackend):
+    """Offline backend that replays recorded PNG frames and logs input events
+
+    Frames are served in order; the current frame advances after every input
+    event (click, type, key press) so a recorded session plays back in step
+    with the sequence driving it. The last frame is held once frames run out.
+    """
+
+    def __init__(self, frames, advance_on_input=True, loop=False, event_log=None):
+        if isinstance(frames, str):
+            frames = sorted(
+                os.path.join(frames, f) for f in os.listdir(frames)
+                if f.lower().endswith('.png')
+            )
+        self.frames = [Image.open(f).convert('RGB') if isinstance(f, str) else f.convert('RGB')
+                       for f in frames]
+        if not self.frames:
+            raise ValueError("ReplayBackend needs at least one frame")
+        self.advance_on_input = advance_on_input
+        self.loop = loop
+        self.event_log = event_log
+        self.frame_index = 0
+        self.events = []
+        self.captures = 0
+        self._position = (0, 0)
+        self._lock = threading.Lock()
+
+    def _log(self, action, **details):
+        event = {"time": time.time(), "action": action, "frame": self.frame_index}
+        event.update(details)
+        with self._lock:
+            self.events.append(event)
+            if self.event_log:
+                with open(self.event_log, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event) + "\n")
+        logging.debug(f"Replay input: {event}")
+
+    def _advance(self):
+        if not self.advance_on_input:
+            return
+        if self.frame_index + 1 < len(self.frames):
+            self.frame_index += 1
+        elif self.loop:
+            self.frame_index = 0
+
+    def advance(self, count=1):
+        """Move the replay forward by count frames regardless of input"""
+        for _ in range(count):
+            if self.frame_index + 1 < len(self.frames):
+                self.frame_index += 1
+            elif self.loop:
+                self.frame_index = 0
+
+    def capture(self, region=None):
+        self.captures += 1
+        frame = self.frames[self.frame_index]
+        if region:
+            return frame.crop(tuple(region))
+        return frame.copy()
+
+    def move_to(self, x, y, duration=0.0):
+        self._position = (x, y)
+        self._log("move", x=x, y=y)
+
+    def click(self, x=None, y=None, click_type="single", duration=0.0):
+        if x is not None and y is not None:
+            self._position = (x, y)
+        x, y = self._position
+        if click_type == "move":
+            self._log("move", x=x, y=y)
+            return
+        self._log("click", x=x, y=y, click_type=click_type)
+        self._advance()
+
+    def type_text(self, text):
+        self._log("type", text=text)
+        self._advance()
+
+    def press(self, key):
+        self._log("press", key=key)
+        self._advance()
+
+    def hotkey(self, *keys):
+        self._log("hotkey", keys=list(keys))
+        self._advance()
+
+    def position(self):
+        return self._position
+
+    def screen_size(self):
+        return self.frames[self.frame_index].size
+
+
+class SessionCancelled(RuntimeError):
+    """Raised by a cancelled session's backend on the next input call"""
+
+
+class CancellableBackend(ScreenBackend):
+    """Wrap a backend so an async session can stop its worker thread's input
+
+    asyncio cannot interrupt a thread, so when an awaiting task is cancelled
+    (or times out) run_in_session calls cancel() and every later mouse or
+    keyboard call from the session's thread raises SessionCancelled instead
+    of acting on the screen. Captures pass straight through.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def reset(self):
+        self.cancelled.clear()
+
+    def _check(self):
+        if self.cancelled.is_set():
+            raise SessionCancelled("session was cancelled")
+
+    def capture(self, region=None):
+        return self.backend.capture(region)
+
+    def grab(self, region=None):
+        return self.backend.grab(region)
+
+    def move_to(self, x, y, duration=0.0):
+        self._check()
+        self.backend.move_to(x, y, duration)
+
+    def click(self, x=None, y=None, click_type="single", duration=0.0):
+        self._check()
+        self.backend.click(x, y, click_type, duration)
+
+    def type_text(self, text):
+        self._check()
+        self.backend.type_text(text)
+
+    def press(self, key):
+        self._check()
+        self.backend.press(key)
+
+    def hotkey(self, *keys):
+        self._check()
+        self.backend.hotkey(*keys)
+
+    def position(self):
+        return self.backend.position()
+
+    def screen_size(self):
+        return self.backend.screen_size()
+
+    def close(self):
+        self.backend.close()
+
+
+async def run_in_session(backend, fn, *args):
+    """Run blocking screen work for an async session on a worker thread
+
+    If the awaiting task is cancelled meanwhile, the session's
+    CancellableBackend is cancelled and the cancellation only propagates
+    once the thread has returned, so nothing touches the screen after a
+    timeout has been reported.
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if isinstance(backend, CancellableBackend):
+            backend.cancel()
+        while not future.done():
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                continue
+            except Exception:
+                break
+        if not future.cancelled():
+            future.exception()
+        raise
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads (rate <= 0 disables it)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class FastCaptureBackend(ScreenBackend):
+    """Live desktop backend that grabs into reusable numpy buffers
+
+    engine picks the grabber: "mss" (X11, macOS and Windows; uses XShm on
+    X11 when the installed mss supports it), "win32" (GDI BitBlt through
+    pywin32) or "imagegrab" (PIL, no speed-up); "auto" takes the first one
+    available. Each thread keeps one RGB buffer per capture size and the
+    grabber's handles; grab() converts into that buffer and returns it,
+    valid until the same thread's next grab of the same size, while
+    capture() returns an image the caller owns. The win32 engine BitBlts
+    into a reused DIB section, so its polls allocate nothing; mss hands
+    back a new raw buffer per grab, which is converted into the reused one.
+    max_fps caps the capture rate across all threads. close() releases
+    every thread's grabber handles. Input goes to input_backend (a PyAutoGUIBackend by default, when
+    pyautogui is available). On Linux, display selects an X display, e.g.
+    ":99" for an Xvfb server in CI.
+    """
+
+    def __init__(self, engine="auto", max_fps=0, input_backend=None, display=None):
+        if engine == "auto":
+            engine = "win32" if win32gui else "mss" if mss else "imagegrab"
+        if engine == "mss" and not mss:
+            raise RuntimeError("the mss capture engine needs the mss package")
+        if engine == "win32" and not win32gui:
+            raise RuntimeError("the win32 capture engine needs pywin32")
+        if engine not in ("mss", "win32", "imagegrab"):
+            raise ValueError(f"Unknown capture engine: {engine}")
+        self.engine = engine
+        self.display = display
+        self.limiter = RateLimiter(max_fps)
+        if input_backend is None and pyautogui:
+            input_backend = PyAutoGUIBackend()
+        self.input = input_backend
+        self._local = threading.local()
+        self._size = None
+        # Grabber handles created by any thread, in creation order, for close()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+
+    def _keep(self, *handle):
+        with self._handles_lock:
+            self._handles.append(handle)
+
+    def _mss(self):
+        local = self._local
+        if not hasattr(local, "sct"):
+            local.sct = mss.mss(display=self.display) if self.display else mss.mss()
+            self._keep("mss", local.sct)
+        return local.sct
+
+    def close(self):
+        """Release the handles every thread's grabber holds (mss sessions, GDI DCs and DIB sections)
+
+        Call it once no thread is grabbing; a later grab opens new handles.
+        """
+        with self._handles_lock:
+            handles, self._handles = self._handles, []
+            self._local = threading.local()
+        # Newest first, so DIB sections go before the window DC they were made from
+        for kind, *handle in reversed(handles):
+            try:
+                if kind == "mss":
+                    handle[0].close()
+                elif kind == "section":
+                    memory, bitmap = handle
+                    memory.DeleteDC()
+                    ctypes.windll.gdi32.DeleteObject(ctypes.c_void_p(bitmap))
+                else:
+                    hwnd, hdc = handle
+                    win32gui.ReleaseDC(hwnd, hdc)
+            except Exception as e:
+                logging.warning(f"Error releasing {kind} capture handle: {str(e)}")
+
+    def _buffers(self):
+        local = self._local
+        if not hasattr(local, "buffers"):
+            local.buffers = {}
+        return local.buffers
+
+    def _grab_bgra(self, left, top, width, height):
+        """Grab a screen rectangle as an (height, width, 4) BGRA array"""
+        local = self._local
+        if self.engine == "mss":
+            shot = self._mss().grab({"left": left, "top": top, "width": width, "height": height})
+            return np.frombuffer(shot.raw, np.uint8).reshape(height, width, 4)
+
+        # GDI: the desktop DC and one DIB section per capture size are kept per thread
+        if not hasattr(local, "gdi"):
+            hwnd = win32gui.GetDesktopWindow()
+            hdc = win32gui.GetWindowDC(hwnd)
+            self._keep("window", hwnd, hdc)
+            local.gdi = (win32ui.CreateDCFromHandle(hdc), {})
+        source, sections = local.gdi
+        entry = sections.get((width, height))
+        if entry is None:
+            entry = sections[(width, height)] = self._dib_section(source, width, height)
+            self._keep("section", entry[0], entry[1])
+        memory, _, pixels = entry
+        memory.BitBlt((0, 0), (width, height), source, (left, top), win32con.SRCCOPY)
+        ctypes.windll.gdi32.GdiFlush()
+        return pixels
+
+    @staticmethod
+    def _dib_section(source, width, height):
+        """Return (memory DC, bitmap handle, BGRA array) for a top-down 32-bit DIB section
+
+        The array wraps the section's own pixel memory, so a BitBlt into the
+        memory DC fills it in place.
+        """
+        class BITMAPINFOHEADER(ctypes.Structure):
+            _fields_ = [("biSize", ctypes.c_uint32), ("biWidth", ctypes.c_int32),
+                        ("biHeight", ctypes.c_int32), ("biPlanes", ctypes.c_uint16),
+                        ("biBitCount", ctypes.c_uint16), ("biCompression", ctypes.c_uint32),
+                        ("biSizeImage", ctypes.c_uint32), ("biXPelsPerMeter", ctypes.c_int32),
+                        ("biYPelsPerMeter", ctypes.c_int32), ("biClrUsed", ctypes.c_uint32),
+                        ("biClrImportant", ctypes.c_uint32)]
+
+        gdi32 = ctypes.windll.gdi32
+        gdi32.CreateDIBSection.restype = ctypes.c_void_p
+        gdi32.CreateDIBSection.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint,
+                                           ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p,
+                                           ctypes.c_uint32]
+        # A negative height makes rows run top to bottom; 0 is BI_RGB and DIB_RGB_COLORS
+        header = BITMAPINFOHEADER(ctypes.sizeof(BITMAPINFOHEADER), width, -height, 1, 32, 0)
+        bits = ctypes.c_void_p()
+        bitmap = gdi32.CreateDIBSection(source.GetSafeHdc(), ctypes.byref(header), 0,
+                                        ctypes.byref(bits), None, 0)
+        if not bitmap or not bits.value:
+            raise RuntimeError(f"CreateDIBSection failed for a {width}x{height} capture")
+        memory = source.CreateCompatibleDC()
+        win32gui.SelectObject(memory.GetSafeHdc(), bitmap)
+        buffer = (ctypes.c_uint8 * (width * height * 4)).from_address(bits.value)
+        return memory, bitmap, np.frombuffer(buffer, np.uint8).reshape(height, width, 4)
+
+    def grab(self, region=None):
+        """Grab the screen or an (x1, y1, x2, y2) region as an RGB array view (see class doc)"""
+        if region:
+            left, top, right, bottom = region
+        else:
+            left, top = 0, 0
+            right, bottom = self.screen_size()
+        width, height = right - left, bottom - top
+        self.limiter.wait()
+        buffers = self._buffers()
+        buffer = buffers.get((width, height))
+        if buffer is None:
+            buffer = buffers[(width, height)] = np.empty((height, width, 3), np.uint8)
+        if self.engine == "imagegrab":
+            image = ImageGrab.grab(bbox=(left, top, right, bottom)).convert('RGB')
+            np.copyto(buffer, np.asarray(image))
+        else:
+            cv2.cvtColor(self._grab_bgra(left, top, width, height), cv2.COLOR_BGRA2RGB, dst=buffer)
+        return buffer
+
+    def capture(self, region=None):
+        # Image.fromarray copies RGB data, so the image outlives the buffer
+        return Image.fromarray(self.grab(region))
+
+    def screen_size(self):
+        if self._size is None:
+            if self.engine == "mss":
+                monitor = self._mss().monitors[1]
+                self._size = (monitor["width"], monitor["height"])
+            elif self.engine == "win32":
+                self._size = (win32api.GetSystemMetrics(win32con.SM_CXSCREEN),
+                              win32api.GetSystemMetrics(win32con.SM_CYSCREEN))
+            else:
+                self._size = ImageGrab.grab().size
+        return self._size
+
+    def _input_backend(self):
+        if self.input is None:
+            raise RuntimeError("FastCaptureBackend has no input backend (pyautogui is not available)")
+        return self.input
+
+    def move_to(self, x, y, duration=0.0):
+        self._input_backend().move_to(x, y, duration)
+
+    def click(self, x=None, y=None, click_type="single", duration=0.0):
+        self._input_backend().click(x, y, click_type, duration)
+
+    def type_text(self, text):
+        self._input_backend().type_text(text)
+
+    def press(self, key):
+        self._input_backend().press(key)
+
+    def hotkey(self, *keys):
+        self._input_backend().hotkey(*keys)
+
+    def position(self):
+        return self._input_backend().position()
+
+
+# Capture engine for the live desktop backend: "auto" uses FastCaptureBackend
+# when mss or pywin32 is installed, "pyautogui" keeps the plain ImageGrab backend
+CAPTURE_ENGINE = os.environ.get("CAPTURE_ENGINE", "auto")
+CAPTURE_MAX_FPS = float(os.environ.get("CAPTURE_MAX_FPS", "0"))
+
+# Active screen/input backend, created on first use
+_backend = None
+
+def get_backend():
+    """Return the active screen backend, defaulting to the live desktop"""
+    global _backend
+    if _backend is None:
+        if CAPTURE_ENGINE == "pyautogui" or (CAPTURE_ENGINE == "auto" and not mss
+                                             and not win32gui):
+            _backend = PyAutoGUIBackend()
+        else:
+            _backend = FastCaptureBackend(CAPTURE_ENGINE, max_fps=CAPTURE_MAX_FPS)
+        atexit.register(_backend.close)
+    return _backend
+
+def set_backend(backend):
+    """Replace the active screen backend (e.g. with a ReplayBackend)"""
+    global _backend
+    _backend = backend
+    return backend
+
+class Region:
+    """A screen rectangle: left/top/width/height in pixels
+
+    Three layouts are in use, so conversions are explicit:
+    Region.from_bbox((x1, y1, x2, y2)) - what captures (ImageGrab bbox) take,
+    Region.from_xywh((x, y, width, height)) - what pyautogui takes, and
+    Region.from_dict({"left", "top", "width", "height"}) - EpicAutomation's
+    screen_regions. A region with an anchor (see find_anchor) is relative
+    to a window or landmark and is moved onto it with offset() at run time.
+    """
+    __slots__ = ("left", "top", "width", "height", "anchor")
+
+    def __init__(self, left, top, width, height, anchor=None):
+        values = (left, top, width, height)
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            raise ValueError(f"region coordinates must be integers, got {values!r}")
+        if width <= 0 or height <= 0:
+            raise ValueError(f"region must have a positive width and height, got {values!r}")
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.anchor = anchor
+
+    @classmethod
+    def from_bbox(cls, bbox, anchor=None):
+        x1, y1, x2, y2 = bbox
+        return cls(x1, y1, x2 - x1, y2 - y1, anchor)
+
+    @classmethod
+    def from_xywh(cls, xywh, anchor=None):
+        x, y, width, height = xywh
+        return cls(x, y, width, height, anchor)
+
+    @classmethod
+    def from_dict(cls, value, anchor=None):
+        return cls(value['left'], value['top'], value['width'], value['height'], anchor)
+
+    @classmethod
+    def coerce(cls, value, layout="bbox"):
+        """Build a Region from a Region, a left/top/width/height dict or a 4-item list
+
+        Lists are read as (x1, y1, x2, y2), or (x, y, width, height) with
+        layout="xywh".
+        """
+        if isinstance(value, Region):
+            return value
+        if isinstance(value, dict):
+            return cls.from_dict(value)
+        if isinstance(value, (list, tuple)) and len(value) == 4:
+            return cls.from_xywh(value) if layout == "xywh" else cls.from_bbox(value)
+        raise ValueError(f"expected a region, got {value!r}")
+
+    @property
+    def right(self):
+        return self.left + self.width
+
+    @property
+    def bottom(self):
+        return self.top + self.height
+
+    @property
+    def bbox(self):
+        return (self.left, self.top, self.right, self.bottom)
+
+    @property
+    def xywh(self):
+        return (self.left, self.top, self.width, self.height)
+
+    def to_dict(self):
+        return {'left': self.left, 'top': self.top, 'width': self.width, 'height': self.height}
+
+    @property
+    def area(self):
+        return self.width * self.height
+
+    def offset(self, dx, dy):
+        """The same rectangle moved by (dx, dy), e.g. onto its anchor's position"""
+        return Region(self.left + dx, self.top + dy, self.width, self.height)
+
+    def intersects(self, other):
+        return boxes_overlap(self.bbox, other.bbox)
+
+    def union(self, other):
+        return Region.from_bbox(box_union(self.bbox, other.bbox))
+
+    def clip(self, size):
+        """Clip to a (width, height) screen; raises ValueError if nothing is left"""
+        x1, y1 = max(0, self.left), max(0, self.top)
+        x2, y2 = min(size[0], self.right), min(size[1], self.bottom)
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"region {self.bbox} lies outside the {size[0]}x{size[1]} screen")
+        if (x1, y1, x2, y2) == self.bbox:
+            return self
+        return Region(x1, y1, x2 - x1, y2 - y1, self.anchor)
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and self.xywh == other.xywh and self.anchor == other.anchor
+
+    def __hash__(self):
+        return hash(self.xywh)
+
+    def __repr__(self):
+        anchor = f", anchor={self.anchor!r}" if self.anchor else ""
+        return f"Region(left={self.left}, top={self.top}, width={self.width}, height={self.height}{anchor})"
+
+def as_bbox(region):
+    """Return a capture box for a Region, an (x1, y1, x2, y2) sequence or None"""
+    if region is None:
+        return None
+    if isinstance(region, Region):
+        return region.bbox
+    return tuple(region)
+
+def find_anchor(anchor, backend=None, ocr_engine=None):
+    """Return the screen (x, y) an anchored region's coordinates are relative to
+
+    anchor is {"window": title} for the top-left corner of a window (needs
+    pywin32), or {"template": path} / {"text": label} for the top-left of a
+    landmark found on the full screen. Raises LookupError if it is missing.
+    """
+    if "window" in anchor:
+        if not win32gui:
+            raise LookupError("window anchors need pywin32")
+        hwnd = win32gui.FindWindow(None, anchor["window"])
+        if not hwnd:
+            raise LookupError(f"window '{anchor['window']}' not found")
+        left, top, _, _ = win32gui.GetWindowRect(hwnd)
+        return left, top
+    if "template" in anchor:
+        box = image_find(anchor["template"], fallback_text=anchor.get("text"), backend=backend,
+                         ocr_engine=ocr_engine)
+    else:
+        img = (backend or get_backend()).capture(None)
+        match = find_text_in_image(img, anchor["text"], ocr_engine=ocr_engine)
+        box = match["box"] if match else None
+    if box is None:
+        raise LookupError(f"anchor {anchor} not found on screen")
+    return box[0], box[1]
+
+
+class OCRCache:
+    """LRU cache of OCR results keyed by the captured pixels and OCR settings
+
+    Sizes are measured as the JSON-encoded result, and entries are evicted
+    least-recently-used first once max_bytes is exceeded. If path is given
+    the cache is loaded from and saved to that JSON file.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def make_key(img, method, config=''):
+        """Hash an image's pixel buffer together with the OCR call settings"""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{method}|{config}|{img.mode}|{img.size}".encode('utf-8'))
+        h.update(img.tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return a cached result or None, updating the hit/miss counters"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        """Store a result, evicting old entries to stay under max_bytes"""
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+    def load(self):
+        """Load entries from the cache file"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for key, result in json.load(f):
+                    self.put(key, result)
+            logging.info(f"Loaded {len(self.entries)} OCR cache entries from {self.path}")
+        except Exception as e:
+            logging.error(f"Error loading OCR cache: {str(e)}")
+
+    def save(self):
+        """Write entries to the cache file, oldest first"""
+        if not self.path:
+            return
+        try:
+            with self._lock:
+                items = [[key, entry[0]] for key, entry in self.entries.items()]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(items, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Error saving OCR cache: {str(e)}")
+
+
+# OCRCache used in place of the engine's own by OCR calls made in this
+# context; PipelinedExecutor scopes its private prefetch cache to its run
+_scoped_ocr_cache = contextvars.ContextVar("scoped_ocr_cache", default=None)
+
+
+class OCREngine:
+    """Long-lived OCR engine shared by the sequence runner and EpicAutomation
+
+    When tesserocr is installed a pool of warm Tesseract API handles is kept
+    loaded, so each call skips process startup and model loading. Otherwise
+    it falls back to pytesseract with the same concurrency limit. Results
+    are looked up in the optional OCRCache before Tesseract is called.
+    """
+
+    def __init__(self, workers=2, lang='eng', cache=None, config=''):
+        self.workers = max(1, int(workers))
+        self.lang = lang
+        self.config = config
+        self.cache = cache
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.timings = deque(maxlen=1000)
+        self._stats_lock = threading.Lock()
+        self._inflight = {}
+        self._handles = None
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._executor = None
+        try:
+            import tesserocr
+            self._tesserocr = tesserocr
+            self._handles = queue.Queue()
+            for _ in range(self.workers):
+                self._handles.put(tesserocr.PyTessBaseAPI(lang=lang))
+            logging.info(f"OCR engine started with {self.workers} tesserocr handles")
+        except ImportError:
+            self._tesserocr = None
+            logging.info(f"tesserocr not installed, using pytesseract with {self.workers} workers")
+
+    def _record(self, method, elapsed):
+        with self._stats_lock:
+            self.calls += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            self.timings.append((method, elapsed))
+        trace_add("ocr_time", elapsed)
+        trace_add("ocr_calls")
+        logging.debug(f"OCR {method} took {elapsed * 1000:.1f}ms")
+
+    def _run(self, method, img, config, use_cache=True):
+        if config is None:
+            config = self.config
+        cache = None
+        if use_cache:
+            cache = _scoped_ocr_cache.get()
+            if cache is None:
+                cache = self.cache
+        if cache is None:
+            return self._recognize(method, img, config)
+
+        key = OCRCache.make_key(img, method, f"{self.lang}|{config}")
+        result = cache.get(key)
+        if result is not None:
+            trace_add("cache_hits")
+            return result
+        trace_add("cache_misses")
+        with self._stats_lock:
+            running = self._inflight.get(key)
+            if running is None:
+                self._inflight[key] = threading.Event()
+        if running is not None:
+            # The same pixels are already being OCR'd (e.g. by a prefetch)
+            running.wait()
+            result = cache.get(key)
+            if result is not None:
+                return result
+            return self._recognize(method, img, config)
+        try:
+            result = self._recognize(method, img, config)
+            cache.put(key, result)
+            return result
+        finally:
+            with self._stats_lock:
+                self._inflight.pop(key).set()
+
+    def _recognize(self, method, img, config):
+        start = time.perf_counter()
+        if self._handles is not None:
+            api = self._handles.get()
+            previous = {}
+            try:
+                previous = self._apply_config(api, config)
+                api.SetImage(img)
+                if method == "image_to_string":
+                    result = api.GetUTF8Text()
+                else:
+                    result = self._tesserocr_data(api)
+            finally:
+                # Handles are pooled; the next call must not inherit this one's -c variables
+                for name, value in previous.items():
+                    api.SetVariable(name, value)
+                self._handles.put(api)
+        else:
+            with self._slots:
+                if method == "image_to_string":
+                    result = pytesseract.image_to_string(img, lang=self.lang, config=config)
+                else:
+                    result = pytesseract.image_to_data(img, lang=self.lang, config=config,
+                                                       output_type=pytesseract.Output.DICT)
+        self._record(method, time.perf_counter() - start)
+        return result
+
+    def _apply_config(self, api, config):
+        """Apply the --psm and -c parts of a pytesseract config string to a handle
+
+        Returns the previous values of the -c variables that were set, so
+        the caller can restore them before the handle goes back to the pool.
+        """
+        parts = config.split() if config else []
+        psm = self._tesserocr.PSM.AUTO
+        previous = {}
+        for i, part in enumerate(parts):
+            if part == '--psm' and i + 1 < len(parts):
+                psm = int(parts[i + 1])
+            elif part == '-c' and i + 1 < len(parts) and '=' in parts[i + 1]:
+                name, value = parts[i + 1].split('=', 1)
+                old = api.GetVariableAsString(name)
+                if api.SetVariable(name, value) and name not in previous and old is not None:
+                    previous[name] = old
+        api.SetPageSegMode(psm)
+        return previous
+
+    def _tesserocr_data(self, api):
+        """Build a pytesseract-style image_to_data dict from a tesserocr handle"""
+        RIL = self._tesserocr.RIL
+        data = {key: [] for key in ('level', 'page_num', 'block_num', 'par_num', 'line_num',
+                                    'word_num', 'left', 'top', 'width', 'height', 'conf', 'text')}
+        api.Recognize()
+        block = par = line = word = 0
+        for r in self._tesserocr.iterate_level(api.GetIterator(), RIL.WORD):
+            if r.IsAtBeginningOf(RIL.BLOCK):
+                block += 1
+                par = line = 0
+            if r.IsAtBeginningOf(RIL.PARA):
+                par += 1
+                line = 0
+            if r.IsAtBeginningOf(RIL.TEXTLINE):
+                line += 1
+                word = 0
+            word += 1
+            box = r.BoundingBox(RIL.WORD)
+            if box is None:
+                continue
+            x1, y1, x2, y2 = box
+            values = (5, 1, block, par, line, word, x1, y1, x2 - x1, y2 - y1,
+                      r.Confidence(RIL.WORD), r.GetUTF8Text(RIL.WORD) or '')
+            for key, value in zip(data, values):
+                data[key].append(value)
+        return data
+
+    def image_to_string(self, img, config=None, use_cache=True):
+        """Return the text in an image; use_cache=False skips the result cache"""
+        return self._run("image_to_string", img, config, use_cache)
+
+    def image_to_data(self, img, config=None, use_cache=True):
+        """Return word boxes for an image in pytesseract's Output.DICT layout"""
+        return self._run("image_to_data", img, config, use_cache)
+
+    def submit(self, method, img, config=None):
+        """Run an OCR call on the engine's worker threads and return a Future"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix="ocr")
+        # Run in the caller's context so OCR time is traced to the caller's span
+        return self._executor.submit(contextvars.copy_context().run, getattr(self, method), img, config)
+
+    def stats(self):
+        """Return call count and timing totals in seconds"""
+        with self._stats_lock:
+            stats = {
+                "calls": self.calls,
+                "total_time": self.total_time,
+                "mean_time": self.total_time / self.calls if self.calls else 0.0,
+                "max_time": self.max_time,
+                "workers": self.workers,
+                "backend": "tesserocr" if self._handles is not None else "pytesseract",
+            }
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+    def close(self):
+        """Release worker threads and Tesseract handles and persist the cache"""
+        if self.cache is not None:
+            self.cache.save()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._handles is not None:
+            while not self._handles.empty():
+                self._handles.get().End()
+
+
+# Shared OCR engine, created on first use. OCR_CACHE_MB=0 disables the
+# result cache; OCR_CACHE_PATH persists it between runs
+_ocr_engine = None
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "2"))
+OCR_CACHE_MB = float(os.environ.get("OCR_CACHE_MB", "64"))
+OCR_CACHE_PATH = os.environ.get("OCR_CACHE_PATH")
+OCR_CONFIG = os.environ.get("OCR_CONFIG", "")
+
+def get_ocr_engine():
+    """Return the shared OCR engine"""
+    global _ocr_engine
+    if _ocr_engine is None:
+        cache = None
+        if OCR_CACHE_MB > 0:
+            cache = OCRCache(max_bytes=int(OCR_CACHE_MB * 1024 * 1024), path=OCR_CACHE_PATH)
+        _ocr_engine = OCREngine(workers=OCR_WORKERS, cache=cache, config=OCR_CONFIG)
+        atexit.register(_ocr_engine.close)
+    return _ocr_engine
+
+def set_ocr_engine(engine):
+    """Replace the shared OCR engine"""
+    global _ocr_engine
+    _ocr_engine = engine
+    return engine
+
+# Tracing: set OCR_TRACE to a .jsonl path (one span per line, written as
+# spans finish) or a .json path (Chrome trace format, for chrome://tracing or
+# Perfetto; keeps the last TRACE_MAX_SPANS spans in memory) to record spans
+TRACE_PATH = os.environ.get("OCR_TRACE")
+TRACE_MAX_SPANS = int(os.environ.get("OCR_TRACE_MAX_SPANS", "100000"))
+# Durations per span name kept for the summary's percentiles
+TRACE_SUMMARY_SAMPLES = 1000
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed operation, with counters added by the work done inside it
+
+    Counters (ocr_time, ocr_calls, cache_hits, cache_misses, ocr_skipped,
+    wait_time) include everything done in nested spans.
+    """
+    __slots__ = ("id", "parent", "name", "category", "start", "wall_start", "duration", "thread",
+                 "attrs", "counters", "child_time")
+
+    def __init__(self, span_id, parent, name, category, attrs):
+        self.id = span_id
+        self.parent = parent
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.counters = {}
+        self.thread = threading.get_ident()
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        # Time spent in finished child spans, for self time
+        self.child_time = 0.0
+
+    def to_dict(self, origin=0.0):
+        return {
+            "id": self.id,
+            "parent": self.parent.id if self.parent else None,
+            "name": self.name,
+            "category": self.category,
+            "start": self.wall_start,
+            "offset": self.start - origin,
+            "duration": self.duration,
+            "thread": self.thread,
+            "attrs": self.attrs,
+            "counters": self.counters,
+        }
+
+
+class Tracer:
+    """Collects finished spans and exports them as JSONL or Chrome trace events
+
+    Per-name totals for summary() are updated as spans finish, so spans
+    need not be kept for it. With a .jsonl path each finished span is
+    written straight to that file and none are held in memory; otherwise
+    the most recent max_spans are kept for export.
+    """
+
+    def __init__(self, path=None, max_spans=TRACE_MAX_SPANS):
+        self.path = path
+        self.stream = bool(path) and not path.lower().endswith('.json')
+        self.spans = deque(maxlen=0 if self.stream else max_spans)
+        self.dropped = 0
+        self.origin = time.perf_counter()
+        self._rows = {}
+        self._sink = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def span(self, name, category="step", **attrs):
+        """Context manager timing a span nested under the current one"""
+        return _SpanScope(self, name, category, attrs)
+
+    def add(self, counter, amount=1):
+        """Add to a counter on the current span and every span enclosing it"""
+        span = _current_span.get()
+        if span is None:
+            return
+        with self._lock:
+            while span is not None:
+                span.counters[counter] = span.counters.get(counter, 0) + amount
+                span = span.parent
+
+    def finish(self, span):
+        """Record a finished span: update the summary and stream or buffer it"""
+        with self._lock:
+            if span.parent is not None:
+                span.parent.child_time += span.duration
+            key = (span.category, span.name)
+            row = self._rows.get(key)
+            if row is None:
+                row = self._rows[key] = {"name": span.name, "category": span.category, "count": 0,
+                                         "total": 0.0, "self": 0.0, "counters": {},
+                                         "durations": deque(maxlen=TRACE_SUMMARY_SAMPLES)}
+            row["count"] += 1
+            row["total"] += span.duration
+            row["self"] += max(0.0, span.duration - span.child_time)
+            row["durations"].append(span.duration)
+            for counter, value in span.counters.items():
+                row["counters"][counter] = row["counters"].get(counter, 0) + value
+
+            if self.stream:
+                if self._sink is None:
+                    self._sink = open(self.path, 'w', encoding='utf-8')
+                self._sink.write(json.dumps(span.to_dict(self.origin), default=str) + "\n")
+                return
+            if len(self.spans) == self.spans.maxlen:
+                if not self.dropped:
+                    logging.warning(f"Trace buffer full; keeping the last {self.spans.maxlen} spans")
+                self.dropped += 1
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self._rows = {}
+            self.dropped = 0
+
+    def export_jsonl(self, path):
+        with self._lock:
+            if self._sink is not None and path == self.path:
+                # Already streamed; make sure it is on disk
+                self._sink.flush()
+                return path
+            spans = list(self.spans)
+        with open(path, 'w', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(self.origin), default=str) + "\n")
+        return path
+
+    def export_chrome(self, path):
+        """Write complete ("X") events loadable in chrome://tracing or Perfetto"""
+        with self._lock:
+            spans = list(self.spans)
+        events = [{
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": (span.start - self.origin) * 1e6,
+            "dur": span.duration * 1e6,
+            "pid": os.getpid(),
+            "tid": span.thread,
+            "args": dict(span.attrs, **span.counters),
+        } for span in spans]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+        return path
+
+    def export(self, path=None):
+        """Export to path (or the tracer's path); .json means Chrome trace format"""
+        path = path or self.path
+        if not path:
+            return None
+        if path.lower().endswith('.json'):
+            return self.export_chrome(path)
+        return self.export_jsonl(path)
+
+    def close(self):
+        """Export to the tracer's path and close the streamed JSONL file"""
+        self.export()
+        with self._lock:
+            if self._sink is not None:
+                self._sink.close()
+                self._sink = None
+
+    def summary(self, top=10, category=None):
+        """Aggregate spans by name, largest self time (excluding child spans) first
+
+        Percentiles cover the last TRACE_SUMMARY_SAMPLES spans of each name.
+        """
+        with self._lock:
+            rows = [dict(row, durations=list(row["durations"]), counters=dict(row["counters"]))
+                    for row in self._rows.values() if category is None or row["category"] == category]
+        for row in rows:
+            durations = row.pop("durations")
+            row["p50"] = percentile(durations, 50)
+            row["p95"] = percentile(durations, 95)
+        return sorted(rows, key=lambda r: r["self"], reverse=True)[:top]
+
+    def format_summary(self, top=10, category=None):
+        """Return the summary as printable lines"""
+        lines = [f"{'span':<32} {'count':>5} {'total s':>8} {'self s':>8} {'p95 ms':>8} "
+                 f"{'ocr s':>7} {'wait s':>7} {'cache h/m':>9}"]
+        for row in self.summary(top, category):
+            c = row["counters"]
+            lines.append(f"{row['name'][:32]:<32} {row['count']:>5} {row['total']:>8.2f} "
+                         f"{row['self']:>8.2f} {row['p95'] * 1000:>8.1f} "
+                         f"{c.get('ocr_time', 0):>7.2f} {c.get('wait_time', 0):>7.2f} "
+                         f"{c.get('cache_hits', 0):>4}/{c.get('cache_misses', 0):<4}")
+        return lines
+
+    def log_summary(self, top=10, category=None):
+        if self._rows:
+            logging.info("Top time sinks:\n" + "\n".join(self.format_summary(top, category)))
+
+
+class _SpanScope:
+    __slots__ = ("tracer", "name", "category", "attrs", "span", "token")
+
+    def __init__(self, tracer, name, category, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.span = Span(next(self.tracer._ids), _current_span.get(), self.name, self.category,
+                         self.attrs)
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.duration = time.perf_counter() - span.start
+        if exc_type is not None:
+            span.attrs["error"] = exc_type.__name__
+        _current_span.reset(self.token)
+        self.tracer.finish(span)
+        return False
+
+
+class _NullScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+_tracer = None
+
+def get_tracer():
+    """Return the active tracer, or None when tracing is off"""
+    global _tracer
+    if _tracer is None and TRACE_PATH:
+        _tracer = Tracer(TRACE_PATH)
+        atexit.register(_tracer.close)
+    return _tracer
+
+def set_tracer(tracer):
+    """Install a tracer (None turns tracing off)"""
+    global _tracer
+    _tracer = tracer
+    return tracer
+
+def trace_span(name, category="step", **attrs):
+    """Time a block as a span if tracing is on; yields the Span or None"""
+    tracer = get_tracer()
+    return tracer.span(name, category, **attrs) if tracer is not None else _NULL_SCOPE
+
+def trace_add(counter, amount=1):
+    """Add to a counter on the current span, if tracing is on"""
+    if _tracer is not None:
+        _tracer.add(counter, amount)
+
+def trace_attrs(**attrs):
+    """Attach attributes (e.g. an outcome) to the current span, if tracing is on"""
+    span = _current_span.get()
+    if span is not None:
+        span.attrs.update(attrs)
+
+class CheckpointJournal:
+    """Append-only JSONL journal with one fsync'd record per processed patient
+
+    Each record is flushed and fsync'd before the next patient starts, so a
+    crash loses at most the patient in progress. completed_ids() lets a
+    resumed run skip patients whose latest record is a success; a run
+    that does not resume calls start() to set the previous journal aside.
+    """
+
+    def __init__(self, path='insurance_claim_journal.jsonl'):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start(self, resume=False):
+        """Begin a run: a resumed run appends, a fresh one rotates the old journal aside
+
+        The old journal is renamed with a timestamp suffix rather than
+        deleted, so earlier runs' records are kept.
+        """
+        self.close()
+        if resume:
+            self._drop_torn_tail()
+            return
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        stem, ext = os.path.splitext(self.path)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        rotated = f"{stem}_{stamp}{ext}"
+        suffix = 1
+        while os.path.exists(rotated):
+            suffix += 1
+            rotated = f"{stem}_{stamp}_{suffix}{ext}"
+        os.replace(self.path, rotated)
+        logging.info(f"Moved the previous run's journal to {rotated}")
+
+    def _drop_torn_tail(self):
+        """Cut a record left half-written by a crash off the end of the journal
+
+        Otherwise the next record would be appended onto the same line and
+        neither would parse, losing a completed patient.
+        """
+        try:
+            f = open(self.path, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            f.seek(end - 1)
+            if f.read(1) == b"\n":
+                return
+            # Find the last complete line, reading back a block at a time
+            keep = 0
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    keep = start + newline + 1
+                    break
+                end = start
+            f.truncate(keep)
+            f.flush()
+            os.fsync(f.fileno())
+        logging.warning(f"Dropped an incomplete final record from {self.path}")
+
+    def record(self, patient_id, status, notes=''):
+        """Append one durable record"""
+        entry = {"patient_id": patient_id, "status": status, "notes": notes,
+                 "timestamp": datetime.now().isoformat()}
+        with self._lock:
+            if self._file is None:
+                self._drop_torn_tail()
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def entries(self):
+        """Yield journal records in order, skipping a torn final line"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.warning(f"Skipping incomplete journal record in {self.path}")
+
+    def completed_ids(self):
+        """Return the IDs whose most recent record is a success"""
+        latest = {}
+        for entry in self.entries():
+            latest[entry["patient_id"]] = entry["status"]
+        return {pid for pid, status in latest.items() if status == "Success"}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class EpicAutomation:
+    def __init__(self, backend=None, ocr_engine=None, results_file='insurance_claim_results.csv',
+                 journal=None):
+        # Input goes through a CancellableBackend so an async timeout can stop it
+        self.backend = CancellableBackend(backend or get_backend())
+        self.ocr = ocr_engine or get_ocr_engine()
+        # Regions may also be given as left/top/width/height dicts
+        self.screen_regions = {
+            'patient_search': Region(left=200, top=100, width=400, height=200),
+            'insurance_tab': Region(left=300, top=150, width=200, height=50),
+            'claim_button': Region(left=400, top=300, width=150, height=50),
+            'confirmation': Region(left=350, top=250, width=300, height=100)
+        }
+        self.screen_size = None
+        # Results are written as they happen; only the most recent are kept here
+        self.results = deque(maxlen=1000)
+        self.results_file = results_file
+        self.journal = journal or CheckpointJournal()
+        self._results_handle = None
+        self._results_writer = None
+        # (patient_id, status) of the latest record_result call
+        self.last_recorded = None
+        self.wait_timeout = WAIT_TIMEOUT
+        self.poll_interval = WAIT_INTERVAL
+        # 'template' tries reference crops of fixed UI elements before OCR
+        self.lookup_mode = 'ocr'
+        self.template_dir = 'templates'
+        self.templates = {}
+        # OCR preprocessing preset (or options dict) per region, see PREPROCESS_PRESETS
+        self.preprocess = None
+        self.region_preprocess = {}
+        # Region lookups and text checks skip OCR while a region's pixels have not moved
+        self.watcher = RegionWatcher(self.backend)
+        
+    def region_bbox(self, region_name):
+        """Return a named screen region as an (x1, y1, x2, y2) capture box clipped to the screen"""
+        region = Region.coerce(self.screen_regions[region_name])
+        if region.anchor is not None:
+            region = region.offset(*find_anchor(region.anchor, self.backend, self.ocr))
+        if self.screen_size is None:
+            self.screen_size = self.backend.screen_size()
+        return region.clip(self.screen_size).bbox
+
+    def template_for(self, text):
+        """Return the reference crop for a fixed UI label, if one exists"""
+        if text in self.templates:
+            return self.templates[text]
+        path = os.path.join(self.template_dir, f"{text.lower().replace(' ', '_')}.png")
+        return path if os.path.exists(path) else None
+
+    def preprocess_for(self, region_name):
+        """Return the OCR preprocessing settings for a named region"""
+        return self.region_preprocess.get(region_name, self.preprocess)
+
+    def find_text_in_region(self, region_name, text, fuzzy=True):
+        """Find text in a named screen region
+
+        Returns the match's (x1, y1, x2, y2) box in screen coordinates so the
+        caller can click the text itself, or None if it was not found. In
+        template lookup mode a matching reference crop is tried first and
+        OCR only runs when the match confidence is too low.
+        """
+        region = self.region_bbox(region_name)
+        if self.lookup_mode == 'template':
+            template = self.template_for(text)
+            if template:
+                return image_find(template, region, fallback_text=text, fuzzy=fuzzy,
+                                  preprocess=self.preprocess_for(region_name),
+                                  backend=self.backend, ocr_engine=self.ocr)
+        img = self.backend.capture(region)
+        preprocess = self.preprocess_for(region_name)
+        index = self.watcher.reuse(
+            region, img, ("word_index", repr(preprocess)),
+            lambda: WordIndex.from_image(img, preprocess, ocr_engine=self.ocr))
+        match = index.find(text, fuzzy)
+        if match is None:
+            logging.debug(f"'{text}' not found in region {region_name}")
+            return None
+        x1, y1, x2, y2 = match["box"]
+        logging.debug(f"Found '{match['text']}' ({match['score']:.2f}) in region {region_name}")
+        return (region[0] + x1, region[1] + y1, region[0] + x2, region[1] + y2)
+
+    def click_position(self, x, y, click_type="single"):
+        """Click at a screen position"""
+        self.backend.click(x, y, click_type)
+
+    def click_box(self, box):
+        """Click the centre of an (x1, y1, x2, y2) screen box"""
+        self.click_position((box[0] + box[2]) // 2, (box[1] + box[3]) // 2)
+
+    def wait_for(self, condition, region_name=None, text=None, **kwargs):
+        """Poll a named screen region (or the full screen) until a condition holds"""
+        region = self.region_bbox(region_name) if region_name else None
+        kwargs.setdefault("preprocess", self.preprocess_for(region_name))
+        kwargs.setdefault("timeout", self.wait_timeout)
+        kwargs.setdefault("interval", self.poll_interval)
+        return wait_for(condition, region, text=text, backend=self.backend,
+                        ocr_engine=self.ocr, watcher=self.watcher, **kwargs)
+
+    async def wait_for_async(self, condition, region_name=None, text=None, **kwargs):
+        """Awaitable wait_for on a named screen region (or the full screen)"""
+        region = self.region_bbox(region_name) if region_name else None
+        kwargs.setdefault("preprocess", self.preprocess_for(region_name))
+        kwargs.setdefault("timeout", self.wait_timeout)
+        kwargs.setdefault("interval", self.poll_interval)
+        return await wait_for_async(condition, region, text=text, backend=self.backend,
+                                    ocr_engine=self.ocr, watcher=self.watcher, **kwargs)
+
+    @staticmethod
+    def load_patient_ids(file_path):
+        """Load patient IDs from a CSV file"""
+        try:
+            with open(file_path, 'r') as f:
+                reader = csv.reader(f)
+                next(reader)  # Skip header row
+                return [row[0] for row in reader]
+        except Exception as e:
+            logging.error(f"Error loading patient IDs: {str(e)}")
+            return []
+
+    def open_results(self, append=False):
+        """Open the results CSV, appending to it when resuming a run"""
+        self.save_results()
+        write_header = not append or not os.path.exists(self.results_file) \
+            or os.path.getsize(self.results_file) == 0
+        self._results_handle = open(self.results_file, 'a' if append else 'w', newline='')
+        self._results_writer = csv.writer(self._results_handle)
+        if write_header:
+            self._results_writer.writerow(['Patient ID', 'Status', 'Timestamp', 'Notes'])
+            self._results_handle.flush()
+
+    def process_task(self, patient_id):
+        """Process one patient leased by run_queue_worker; returns (success, notes)"""
+        success = self.process_insurance_claim(patient_id)
+        return success, self.results[-1][3] if self.results else ''
+
+    def record_result(self, patient_id, status, notes):
+        """Write a patient's outcome to the results CSV and the checkpoint journal"""
+        row = [patient_id, status, datetime.now(), notes]
+        self.last_recorded = (patient_id, status)
+        self.results.append(row)
+        trace_attrs(status=status, notes=notes)
+        try:
+            if self._results_writer is None:
+                self.open_results(append=True)
+            self._results_writer.writerow(row)
+            self._results_handle.flush()
+        except Exception as e:
+            logging.error(f"Error writing result for {patient_id}: {str(e)}")
+        self.journal.record(patient_id, status, notes)
+
+    def save_results(self):
+        """Flush and close the results CSV; results are written as they happen"""
+        try:
+            if self._results_handle is not None:
+                self._results_handle.close()
+                logging.info(f"Results saved to {self.results_file}")
+        except Exception as e:
+            logging.error(f"Error saving results: {str(e)}")
+        finally:
+            self._results_handle = None
+            self._results_writer = None
+            self.journal.close()
+
+    # The claim flow is written once, as generators that yield the blocking
+    # work they need: ("call", fn, *args) for input, OCR and result writes,
+    # and ("wait", condition, region_name, kwargs) for wait_for polls. Each
+    # yield evaluates to the request's result (or raises its exception).
+    # _run_flow runs requests inline; _run_flow_async runs calls on a worker
+    # thread through run_in_session and waits as awaitable polls.
+
+    def _run_flow(self, flow):
+        """Drive a claim flow generator synchronously and return its result"""
+        result = error = None
+        while True:
+            try:
+                request = flow.throw(error) if error is not None else flow.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                if request[0] == "wait":
+                    _, condition, region_name, kwargs = request
+                    result = self.wait_for(condition, region_name, **kwargs)
+                else:
+                    result = request[1](*request[2:])
+            except Exception as e:
+                error = e
+
+    async def _run_flow_async(self, flow):
+        """Drive a claim flow generator from the event loop and return its result"""
+        result = error = None
+        try:
+            while True:
+                try:
+                    request = flow.throw(error) if error is not None else flow.send(result)
+                except StopIteration as stop:
+                    return stop.value
+                result = error = None
+                try:
+                    if request[0] == "wait":
+                        _, condition, region_name, kwargs = request
+                        result = await self.wait_for_async(condition, region_name, **kwargs)
+                    else:
+                        result = await run_in_session(self.backend, request[1], *request[2:])
+                except Exception as e:
+                    error = e
+        finally:
+            flow.close()
+
+    def _enter_patient_id(self, patient_id):
+        """Type a patient ID into the search field and submit it"""
+        # Click patient search field
+        self.click_position(250, 100)  # Adjust coordinates
+
+        # Clear existing text
+        self.backend.hotkey('ctrl', 'a')
+        self.backend.press('backspace')
+
+        # Type patient ID
+        self.backend.type_text(patient_id)
+        self.backend.press('enter')
+
+    def _search_patient_flow(self, patient_id):
+        with trace_span("search_patient", "step"):
+            try:
+                yield "call", self._enter_patient_id, patient_id
+
+                # Wait for search results and verify patient found
+                if (yield "wait", "text", "patient_search", {"text": patient_id}):
+                    logging.info(f"Patient {patient_id} found")
+                    return True
+                else:
+                    logging.warning(f"Patient {patient_id} not found")
+                    return False
+            except Exception as e:
+                logging.error(f"Error searching patient {patient_id}: {str(e)}")
+                return False
+
+    def _navigate_to_insurance_flow(self):
+        with trace_span("navigate_to_insurance", "step"):
+            try:
+                # Look for insurance tab and click where it was found
+                tab = yield "call", self.find_text_in_region, "insurance_tab", "Insurance"
+                if tab:
+                    yield "call", self.click_box, tab
+                    yield "wait", "stable", None, {}
+                    return True
+                return False
+            except Exception as e:
+                logging.error(f"Error navigating to insurance: {str(e)}")
+                return False
+
+    def _process_claim_flow(self, patient_id):
+        with trace_span("process_insurance_claim", "patient", patient_id=patient_id):
+            try:
+                # Search for patient
+                if not (yield from self._search_patient_flow(patient_id)):
+                    yield "call", self.record_result, patient_id, "Failed", "Patient not found"
+                    return False
+
+                # Navigate to insurance section
+                if not (yield from self._navigate_to_insurance_flow()):
+                    yield "call", self.record_result, patient_id, "Failed", "Insurance section not found"
+                    return False
+
+                # Look for claim button and click where it was found
+                button = yield "call", self.find_text_in_region, "claim_button", "Submit Claim"
+                if button:
+                    yield "call", self.click_box, button
+
+                    # Wait for and verify confirmation
+                    if (yield "wait", "text", "confirmation", {"text": "Claim Submitted"}):
+                        yield "call", self.record_result, patient_id, "Success", "Claim submitted"
+                        return True
+                    else:
+                        yield "call", self.record_result, patient_id, "Failed", "No confirmation received"
+                        return False
+                else:
+                    yield "call", self.record_result, patient_id, "Failed", "Claim button not found"
+                    return False
+
+            except Exception as e:
+                logging.error(f"Error processing claim for patient {patient_id}: {str(e)}")
+                yield "call", self.record_result, patient_id, "Error", str(e)
+                return False
+
+    def search_patient(self, patient_id):
+        """Search for a patient in Epic"""
+        return self._run_flow(self._search_patient_flow(patient_id))
+
+    def navigate_to_insurance(self):
+        """Navigate to insurance section"""
+        return self._run_flow(self._navigate_to_insurance_flow())
+
+    def process_insurance_claim(self, patient_id):
+        """Process insurance claim for a patient"""
+        return self._run_flow(self._process_claim_flow(patient_id))
+
+    async def search_patient_async(self, patient_id):
+        """Awaitable search_patient"""
+        return await self._run_flow_async(self._search_patient_flow(patient_id))
+
+    async def navigate_to_insurance_async(self):
+        """Awaitable navigate_to_insurance"""
+        return await self._run_flow_async(self._navigate_to_insurance_flow())
+
+    async def process_insurance_claim_async(self, patient_id):
+        """Awaitable process_insurance_claim"""
+        return await self._run_flow_async(self._process_claim_flow(patient_id))
+
+    def process_batch(self, patient_ids, resume=False):
+        """Process a batch of patient IDs
+
+        With resume, patients the checkpoint journal already records as
+        successful are skipped (and counted as successful) and results are
+        appended to the existing results file. Without it the previous
+        journal is rotated aside (see CheckpointJournal.start).
+        """
+        total = len(patient_ids)
+        successful = 0
+
+        if resume:
+            completed = self.journal.completed_ids()
+            remaining = [pid for pid in patient_ids if pid not in completed]
+            successful = total - len(remaining)
+            logging.info(f"Resuming: skipping {successful} patients already completed")
+            patient_ids = remaining
+        self.journal.start(resume)
+        self.open_results(append=resume)
+
+        for i, patient_id in enumerate(patient_ids, successful + 1):
+            logging.info(f"Processing patient {i}/{total}: {patient_id}")
+            
+            if self.process_insurance_claim(patient_id):
+                successful += 1
+            
+            # Let the screen settle before the next patient
+            self.wait_for("stable")
+
+        if get_tracer() is not None:
+            get_tracer().log_summary()
+        return successful, total
+
+    async def process_batch_async(self, patient_ids, resume=False, patient_timeout=None):
+        """Awaitable process_batch for running many sessions in one event loop
+
+        Each automation should drive its own screen (backend); sessions share
+        the OCR engine's worker threads. A patient that takes longer than
+        patient_timeout seconds is recorded as an error once its in-flight
+        worker thread has returned (its remaining input is refused), unless
+        that thread had already recorded its outcome, and the batch moves on. Cancelling the task stops the batch the same way;
+        patients already finished stay in the journal, so the batch can be
+        resumed.
+        """
+        total = len(patient_ids)
+        successful = 0
+
+        if resume:
+            completed = self.journal.completed_ids()
+            remaining = [pid for pid in patient_ids if pid not in completed]
+            successful = total - len(remaining)
+            logging.info(f"Resuming: skipping {successful} patients already completed")
+            patient_ids = remaining
+        self.journal.start(resume)
+        self.open_results(append=resume)
+
+        for i, patient_id in enumerate(patient_ids, successful + 1):
+            logging.info(f"Processing patient {i}/{total}: {patient_id}")
+            self.backend.reset()
+            self.last_recorded = None
+
+            try:
+                if await asyncio.wait_for(self.process_insurance_claim_async(patient_id),
+                                          patient_timeout):
+                    successful += 1
+            except asyncio.TimeoutError:
+                recorded = self.last_recorded
+                if recorded is not None and recorded[0] == patient_id:
+                    # The outcome was journaled before the timeout; keep it
+                    logging.warning(f"Timed out after recording {recorded[1]} "
+                                    f"for patient {patient_id}")
+                    if recorded[1] == "Success":
+                        successful += 1
+                else:
+                    logging.error(f"Timed out processing claim for patient {patient_id}")
+                    await asyncio.to_thread(self.record_result, patient_id, "Error",
+                                            f"Timed out after {patient_timeout}s")
+
+            await self.wait_for_async("stable")
+
+        if get_tracer() is not None:
+            get_tracer().log_summary()
+        return successful, total
+
+class WorkQueue:
+    """SQLite-backed patient work queue shared by batch workers
+
+    Patient IDs are de-duplicated on insert. A worker leases one task at a
+    time; a lease that is not completed before it expires (e.g. the worker
+    crashed) makes the task available again. Failed tasks are retried
+    until max_attempts is reached. Each call opens its own connection so
+    threads and separate worker processes can share the file.
+    """
+
+    def __init__(self, path='work_queue.db', lease_seconds=300, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    patient_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_expires REAL,
+                    notes TEXT,
+                    updated REAL
+                )""")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def add(self, patient_ids):
+        """Queue patient IDs, ignoring any already queued; returns how many were added"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO tasks (patient_id, updated) VALUES (?, ?)",
+                             ((pid, time.time()) for pid in patient_ids))
+            conn.execute("COMMIT")
+            return conn.total_changes - before
+        finally:
+            conn.close()
+
+    def lease(self, worker):
+        """Lease the next available patient ID to a worker, or return None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Expired leases that have used up their attempts will not be retried
+            conn.execute("""
+                UPDATE tasks SET status = 'failed', notes = 'Lease expired', updated = ?
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                         (now, now, self.max_attempts))
+            row = conn.execute("""
+                SELECT patient_id FROM tasks
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                  AND attempts < ?
+                ORDER BY rowid LIMIT 1""", (now, self.max_attempts)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("""
+                UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?,
+                                 attempts = attempts + 1, updated = ?
+                WHERE patient_id = ?""", (worker, now + self.lease_seconds, now, row[0]))
+            conn.execute("COMMIT")
+            return row[0]
+        finally:
+            conn.close()
+
+    def complete(self, patient_id, worker, success, notes=''):
+        """Record a leased task's outcome; failures are requeued until max_attempts
+
+        Returns the task's new status ('done', 'pending' to retry, or
+        'failed'), or None if the lease was lost.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT attempts, worker FROM tasks WHERE patient_id = ?",
+                               (patient_id,)).fetchone()
+            if row is None or row[1] != worker:
+                # The lease expired and another worker took the task over
+                conn.execute("COMMIT")
+                return None
+            if success:
+                status = 'done'
+            elif row[0] < self.max_attempts:
+                status = 'pending'
+            else:
+                status = 'failed'
+            conn.execute("""
+                UPDATE tasks SET status = ?, notes = ?, lease_expires = NULL, updated = ?
+                WHERE patient_id = ?""", (status, notes, time.time(), patient_id))
+            conn.execute("COMMIT")
+            return status
+        finally:
+            conn.close()
+
+    def counts(self):
+        """Return the number of tasks in each status"""
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        finally:
+            conn.close()
+
+    def remaining(self):
+        """Return how many tasks can still be leased or are in progress"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')").fetchone()[0]
+        finally:
+            conn.close()
+
+
+def run_queue_worker(work_queue, automation, worker, idle_timeout=None, poll_interval=0.5):
+    """Process patients leased from a WorkQueue until it is drained
+
+    automation is an EpicAutomation or a SequenceWorker; each worker drives
+    its own (and so its own display or session). While other workers hold
+    leases this one keeps polling, so a crashed worker's task is picked up
+    once its lease expires; idle_timeout, if given, gives up sooner.
+    Returns this worker's counts: attempts, done, retried, failed and lost
+    (leases that expired before the task finished).
+    """
+    counts = {"attempts": 0, "done": 0, "retried": 0, "failed": 0, "lost": 0}
+    idle_since = None
+    while True:
+        patient_id = work_queue.lease(worker)
+        if patient_id is None:
+            if not work_queue.remaining():
+                break
+            # Other workers still hold leases that may expire and come back
+            idle_since = idle_since or time.monotonic()
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                break
+            time.sleep(poll_interval)
+            continue
+        idle_since = None
+
+        logging.info(f"[{worker}] Processing patient {patient_id}")
+        success, notes = automation.process_task(patient_id)
+        status = work_queue.complete(patient_id, worker, success, notes)
+        counts["attempts"] += 1
+        counts[{"done": "done", "pending": "retried", "failed": "failed", None: "lost"}[status]] += 1
+        automation.wait_for("stable")
+    automation.save_results()
+    return counts
+
+
+class SequenceWorker:
+    """Queue worker that runs a sequence once per leased patient ID
+
+    The patient ID is the row value the sequence's csv_input steps type, so
+    sequences that reference named CSV columns cannot be queued. Give each
+    worker its own backend. Rows of one worker share a run ID in the
+    screenshot archive and OCR results store.
+    """
+
+    def __init__(self, sequence, backend=None, ocr_engine=None, debug=False):
+        self.plan = sequence if isinstance(sequence, SequencePlan) else compile_sequence(sequence)
+        if self.plan.csv_columns:
+            raise SequenceError("Queued sequences get one value per task and cannot use named "
+                                "CSV columns")
+        self.backend = backend or get_backend()
+        self.ocr_engine = ocr_engine or get_ocr_engine()
+        self.debug = debug
+        self.run_id = new_run_id()
+
+    def process_task(self, patient_id):
+        """Run the sequence for one patient; returns (success, notes)"""
+        if self.plan.run(self.backend, self.ocr_engine, self.debug, patient_id, run_id=self.run_id):
+            return True, ''
+        return False, 'Sequence did not complete'
+
+    def wait_for(self, condition, **kwargs):
+        return wait_for(condition, backend=self.backend, ocr_engine=self.ocr_engine, **kwargs)
+
+    def save_results(self):
+        pass
+
+
+class BatchCoordinator:
+    """Shard a patient list across several workers via a WorkQueue
+
+    Workers are EpicAutomations or SequenceWorkers. Each should have its
+    own backend (display, VM or Citrix session); automations also need
+    their own results file and journal. Workers run on threads here;
+    separate worker processes can call run_queue_worker against the same
+    queue file instead.
+    """
+
+    def __init__(self, automations, queue_path='work_queue.db', lease_seconds=300, max_attempts=3):
+        self.automations = automations
+        self.queue = WorkQueue(queue_path, lease_seconds, max_attempts)
+        claims = [a for a in automations if isinstance(a, EpicAutomation)]
+        if len({a.results_file for a in claims}) < len(claims) or \
+                len({a.journal.path for a in claims}) < len(claims):
+            logging.warning("Workers share a results file or journal; give each its own")
+        backends = {id(getattr(a.backend, "backend", a.backend)) for a in automations}
+        if len(backends) < len(automations):
+            logging.warning("Workers share a backend; they will drive the same screen")
+
+    def run(self, patient_ids):
+        """Queue the patients, run all workers to completion and return a summary"""
+        added = self.queue.add(patient_ids)
+        logging.info(f"Queued {added} new patients ({len(patient_ids) - added} already queued)")
+
+        start = time.perf_counter()
+        processed = {}
+        threads = []
+        for i, automation in enumerate(self.automations, 1):
+            worker = f"worker-{i}"
+
+            def work(worker=worker, automation=automation):
+                try:
+                    processed[worker] = run_queue_worker(self.queue, automation, worker)
+                except Exception as e:
+                    logging.error(f"[{worker}] stopped: {str(e)}")
+
+            thread = threading.Thread(target=work, name=worker)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        # Count this run's outcomes only; the queue file may hold earlier runs' tasks
+        done = sum(c["done"] for c in processed.values())
+        failed = sum(c["failed"] for c in processed.values())
+        summary = {
+            "workers": len(self.automations),
+            "elapsed": elapsed,
+            "attempts": sum(c["attempts"] for c in processed.values()),
+            "done": done,
+            "failed": failed,
+            "pending": self.queue.remaining(),
+            "per_worker": processed,
+            "patients_per_minute": (done + failed) / elapsed * 60 if elapsed else 0.0,
+        }
+        logging.info(f"Batch finished in {elapsed:.1f}s: {summary['done']} done, {summary['failed']} failed, "
+                     f"{summary['patients_per_minute']:.1f} patients/min across {summary['workers']} workers")
+        return summary
+
+def load_sequence(json_file):
+    """Load automation sequence from JSON file"""
+    try:
+        with open(json_file, 'r') as f:
+            sequence = json.load(f)
+        return sequence
+    except Exception as e:
+        print(f"Error loading sequence file: {str(e)}")
+        return None
+
+def save_sequence(sequence, json_file):
+    """Save automation sequence to JSON file"""
+    try:
+        with open(json_file, 'w') as f:
+            json.dump(sequence, f, indent=2)
+        print(f"Sequence saved to {json_file}")
+        return True
+    except Exception as e:
+        print(f"Error saving sequence file: {str(e)}")
+        return False
+
+class ScreenshotWriter:
+    """Background thread that writes captured images to disk
+
+    Images are queued in memory and encoded on the writer thread, so saving
+    a screenshot never blocks the automation. The queue is bounded so a
+    slow disk applies back-pressure instead of growing memory.
+    """
+
+    def __init__(self, max_pending=32):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, name="screenshot-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            img, filename = self.queue.get()
+            try:
+                img.save(filename)
+                self.written += 1
+                logging.debug(f"Screenshot saved to {filename}")
+            except Exception as e:
+                logging.error(f"Error saving screenshot {filename}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def save(self, img, filename):
+        """Queue an image to be written to filename"""
+        self.queue.put((img, filename))
+        return filename
+
+    def flush(self):
+        """Block until all queued images are written"""
+        self.queue.join()
+
+
+# Shared screenshot writer, created on first use
+_screenshot_writer = None
+
+def get_screenshot_writer():
+    """Return the shared background screenshot writer"""
+    global _screenshot_writer
+    if _screenshot_writer is None:
+        _screenshot_writer = ScreenshotWriter()
+        atexit.register(_screenshot_writer.flush)
+    return _screenshot_writer
+
+# Screenshot archive settings
+SCREENSHOT_DIR = os.environ.get("SCREENSHOT_DIR", "screenshots")
+SCREENSHOT_FORMAT = os.environ.get("SCREENSHOT_FORMAT", "png")
+SCREENSHOT_MAX_MB = float(os.environ.get("SCREENSHOT_MAX_MB", "1024"))
+SCREENSHOT_MAX_DAYS = float(os.environ.get("SCREENSHOT_MAX_DAYS", "30"))
+
+class ScreenshotArchive:
+    """Content-addressed screenshot store with a background writer
+
+    Frames are queued in memory; the writer thread hashes the pixels,
+    encodes each distinct frame once (PNG at compression level 1, or
+    lossless WebP with fmt="webp") under blobs/<hash[:2]>/<hash>, and
+    records every shot in an SQLite index (index.db) mapping run, patient,
+    sequence step and timestamp to its blob. Identical frames, common
+    across patients, share one blob. Shots older than max_days are
+    dropped, then the least recently used blobs until the archive fits in
+    max_bytes (0 disables either limit).
+
+    Several processes may share one archive: whether a blob is already
+    stored is decided in the index, inside the write transaction, and a
+    blob whose file has gone is written again.
+    """
+
+    def __init__(self, root=SCREENSHOT_DIR, fmt=SCREENSHOT_FORMAT,
+                 max_bytes=int(SCREENSHOT_MAX_MB * 1024 * 1024), max_days=SCREENSHOT_MAX_DAYS,
+                 max_pending=32, prune_every=100):
+        if fmt not in ("png", "webp"):
+            raise ValueError(f"Unsupported screenshot format: {fmt}")
+        self.root = root
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.max_days = max_days
+        self.prune_every = prune_every
+        self.path = os.path.join(root, "index.db")
+        self.stored = 0
+        self.deduplicated = 0
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    width INTEGER,
+                    height INTEGER,
+                    created REAL,
+                    last_used REAL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS shots (
+                    id INTEGER PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    taken REAL NOT NULL,
+                    run TEXT,
+                    patient TEXT,
+                    sequence TEXT,
+                    step INTEGER,
+                    region TEXT
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS shots_patient ON shots (patient, taken)")
+            conn.execute("CREATE INDEX IF NOT EXISTS shots_hash ON shots (hash)")
+        self.prune()
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name="screenshot-archive")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def save(self, img, patient=None, step=None, run=None, sequence=None, region=None):
+        """Queue a frame for the archive; returns immediately"""
+        self.queue.put((img, {"taken": time.time(), "patient": patient, "step": step, "run": run,
+                              "sequence": sequence,
+                              "region": json.dumps(list(region)) if region else None}))
+
+    def flush(self):
+        """Block until all queued frames are archived"""
+        self.queue.join()
+
+    def close(self):
+        """Archive the queued frames and stop the writer; the archive is not used afterwards"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def prune(self):
+        """Apply the age and size limits now"""
+        conn = self._connect()
+        try:
+            self._prune(conn)
+        finally:
+            conn.close()
+
+    def _run(self):
+        conn = self._connect()
+        since_prune = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                conn.close()
+                self.queue.task_done()
+                return
+            img, meta = item
+            try:
+                self._store(conn, img, meta)
+                since_prune += 1
+                if since_prune >= self.prune_every:
+                    self._prune(conn)
+                    since_prune = 0
+            except Exception as e:
+                logging.error(f"Error archiving screenshot: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def _store(self, conn, img, meta):
+        key = frame_digest(img).hex()
+        now = time.time()
+        # Holding the write lock, so another process cannot prune the blob in between
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT path FROM blobs WHERE hash = ?", (key,)).fetchone()
+            if row is not None and os.path.exists(row[0]):
+                self.deduplicated += 1
+                conn.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (now, key))
+            else:
+                path = os.path.join(self.root, "blobs", key[:2], f"{key}.{self.fmt}")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.fmt == "webp":
+                    img.save(path, "WEBP", lossless=True, method=0)
+                else:
+                    img.save(path, "PNG", compress_level=1)
+                conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (key, path, os.path.getsize(path), img.width, img.height, now, now))
+                self.stored += 1
+            conn.execute("INSERT INTO shots (hash, taken, run, patient, sequence, step, region) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (key, meta["taken"], meta["run"], meta["patient"], meta["sequence"],
+                          meta["step"], meta["region"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _prune(self, conn):
+        """Apply the age and size limits, deleting blobs no shot refers to
+
+        Files are removed before the transaction commits, so a concurrent
+        writer never sees a blob row whose file is about to disappear.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.max_days:
+                conn.execute("DELETE FROM shots WHERE taken < ?",
+                             (time.time() - self.max_days * 86400,))
+            doomed = conn.execute("SELECT hash, path FROM blobs WHERE hash NOT IN "
+                                  "(SELECT hash FROM shots)").fetchall()
+            if self.max_bytes:
+                total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM blobs").fetchone()[0]
+                total -= sum(size for (size,) in conn.execute(
+                    "SELECT bytes FROM blobs WHERE hash NOT IN (SELECT hash FROM shots)"))
+                if total > self.max_bytes:
+                    for key, path, size in conn.execute(
+                            "SELECT hash, path, bytes FROM blobs WHERE hash IN (SELECT hash FROM shots) "
+                            "ORDER BY last_used").fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        doomed.append((key, path))
+                        total -= size
+            for key, path in doomed:
+                conn.execute("DELETE FROM shots WHERE hash = ?", (key,))
+                conn.execute("DELETE FROM blobs WHERE hash = ?", (key,))
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if doomed:
+            logging.info(f"Screenshot archive pruned {len(doomed)} blobs")
+
+    def shots(self, patient=None, run=None, step=None, since=None, until=None, limit=None):
+        """Return archived shots (newest first) with their blob paths, filtered by any of the arguments"""
+        clauses, params = [], []
+        for column, value in (("patient", patient), ("run", run), ("step", step)):
+            if value is not None:
+                clauses.append(f"shots.{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("shots.taken >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("shots.taken < ?")
+            params.append(until)
+        sql = ("SELECT shots.id, shots.taken, shots.run, shots.patient, shots.sequence, shots.step, "
+               "shots.region, blobs.hash, blobs.path FROM shots JOIN blobs USING (hash)")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY shots.taken DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        conn = self._connect()
+        try:
+            columns = ("id", "taken", "run", "patient", "sequence", "step", "region", "hash", "path")
+            return [dict(zip(columns, row)) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM blobs").fetchone()
+            shots = conn.execute("SELECT COUNT(*) FROM shots").fetchone()[0]
+        finally:
+            conn.close()
+        return {"shots": shots, "blobs": blobs, "bytes": size, "stored": self.stored,
+                "deduplicated": self.deduplicated}
+
+
+# Shared screenshot archive, created on first use
+_screenshot_archive = None
+
+def get_screenshot_archive():
+    """Return the shared screenshot archive"""
+    global _screenshot_archive
+    if _screenshot_archive is None:
+        _screenshot_archive = ScreenshotArchive()
+        atexit.register(_screenshot_archive.flush)
+    return _screenshot_archive
+
+# OCR results store settings
+OCR_RESULTS_DB = os.environ.get("OCR_RESULTS_DB", "ocr_results.db")
+OCR_RESULTS_BATCH = int(os.environ.get("OCR_RESULTS_BATCH", "200"))
+
+class OCRResultStore:
+    """SQLite store of OCR output keyed by run, CSV row, step and patient
+
+    One row per OCR'd capture holds the extracted text; the words table
+    keeps each word's box (screen coordinates) and confidence. record()
+    only queues; a background thread writes whatever has queued up, up to
+    batch_size results, in one transaction. Query with search() or the
+    ocr-search command line.
+    """
+
+    def __init__(self, path=OCR_RESULTS_DB, batch_size=OCR_RESULTS_BATCH, max_pending=1000):
+        self.path = path
+        self.batch_size = batch_size
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    id INTEGER PRIMARY KEY,
+                    run TEXT,
+                    row INTEGER,
+                    step INTEGER,
+                    patient TEXT,
+                    sequence TEXT,
+                    taken REAL NOT NULL,
+                    region TEXT,
+                    text TEXT NOT NULL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS words (
+                    result INTEGER NOT NULL,
+                    word TEXT NOT NULL,
+                    left INTEGER,
+                    top INTEGER,
+                    width INTEGER,
+                    height INTEGER,
+                    conf REAL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_key ON results (run, row, step)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_patient ON results (patient, taken)")
+            conn.execute("CREATE INDEX IF NOT EXISTS words_result ON words (result)")
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name="ocr-results")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def record(self, text, data=None, run=None, row=None, step=None, patient=None, sequence=None,
+               region=None):
+        """Queue one OCR result; data is an image_to_data dict whose words are kept"""
+        words = []
+        if data:
+            for i, word in enumerate(data['text']):
+                word = str(word).strip()
+                if not word:
+                    continue
+                try:
+                    conf = float(data['conf'][i])
+                except (KeyError, IndexError, TypeError, ValueError):
+                    conf = -1.0
+                words.append((word, data['left'][i], data['top'][i], data['width'][i],
+                              data['height'][i], conf))
+        self.queue.put(((run, row, step, patient, sequence, time.time(),
+                         json.dumps(list(region)) if region else None, text), words))
+
+    def flush(self):
+        """Block until all queued results are written"""
+        self.queue.join()
+
+    def close(self):
+        """Write the queued results and stop the writer; the store is not used afterwards"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            try:
+                if batch:
+                    self._write(conn, batch)
+            except Exception as e:
+                logging.error(f"Error storing {len(batch)} OCR results: {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                conn.close()
+                self.queue.task_done()
+                return
+
+    def _write(self, conn, batch):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for result, words in batch:
+                cursor = conn.execute(
+                    "INSERT INTO results (run, row, step, patient, sequence, taken, region, text) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", result)
+                if words:
+                    conn.executemany("INSERT INTO words VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     ((cursor.lastrowid,) + word for word in words))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def search(self, text=None, patient=None, run=None, row=None, step=None, since=None,
+               until=None, limit=100, words=False):
+        """Return stored results (newest first) matching all the given filters
+
+        text matches case-insensitively anywhere in the extracted text. With
+        words=True each result also lists its words as (word, box, conf).
+        """
+        clauses, params = [], []
+        for column, value in (("patient", patient), ("run", run), ("row", row), ("step", step)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if text:
+            clauses.append("text LIKE ? ESCAPE '\\'")
+            escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if since is not None:
+            clauses.append("taken >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("taken < ?")
+            params.append(until)
+        sql = "SELECT id, run, row, step, patient, sequence, taken, region, text FROM results"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY taken DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        columns = ("id", "run", "row", "step", "patient", "sequence", "taken", "region", "text")
+        conn = self._connect()
+        try:
+            results = [dict(zip(columns, r)) for r in conn.execute(sql, params)]
+            if words:
+                for result in results:
+                    result["words"] = [
+                        (word, (left, top, left + width, top + height), conf)
+                        for word, left, top, width, height, conf in conn.execute(
+                            "SELECT word, left, top, width, height, conf FROM words "
+                            "WHERE result = ? ORDER BY rowid", (result["id"],))]
+            return results
+        finally:
+            conn.close()
+
+    def runs(self):
+        """Summarise each stored run: (run, sequence, rows, results, first, last)"""
+        conn = self._connect()
+        try:
+            return conn.execute("""
+                SELECT run, sequence, COUNT(DISTINCT row), COUNT(*), MIN(taken), MAX(taken)
+                FROM results GROUP BY run ORDER BY MIN(taken)""").fetchall()
+        finally:
+            conn.close()
+
+
+# Shared OCR results store, created on first use
+_ocr_store = None
+
+def get_ocr_store():
+    """Return the shared OCR results store"""
+    global _ocr_store
+    if _ocr_store is None:
+        _ocr_store = OCRResultStore()
+        atexit.register(_ocr_store.flush)
+    return _ocr_store
+
+def capture_screen(region=None, backend=None):
+    """Capture the screen or a region (Region or (x1, y1, x2, y2)) as an in-memory RGB image"""
+    try:
+        return (backend or get_backend()).capture(as_bbox(region))
+    except Exception as e:
+        print(f"Error taking screenshot: {str(e)}")
+        return None
+
+def take_screenshot(filename=None, region=None, backend=None, background=False):
+    """Take a screenshot and save it to file if filename is provided"""
+    with trace_span("take_screenshot", "capture", region=region):
+        if filename is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"screenshot_{timestamp}.png"
+    
+        screenshot = capture_screen(region, backend)
+        if screenshot is None:
+            return None
+    
+        try:
+            if background:
+                get_screenshot_writer().save(screenshot, filename)
+            else:
+                screenshot.save(filename)
+                print(f"Screenshot saved to {filename}")
+            return filename
+        
+        except Exception as e:
+            print(f"Error taking screenshot: {str(e)}")
+            return None
+
+def extract_text_from_screenshot(screenshot, ocr_engine=None, preprocess=None, detect_text=False):
+    """Extract text from a screenshot image, or the path of one, using OCR
+
+    With detect_text only the detected text areas are sent to Tesseract.
+    """
+    try:
+        img = screenshot if isinstance(screenshot, Image.Image) else Image.open(screenshot)
+        if detect_text:
+            text = ocr_detected_text(img, preprocess, ocr_engine=ocr_engine)
+        else:
+            text = ocr_text(img, preprocess, ocr_engine=ocr_engine)
+        return text.strip()
+    except Exception as e:
+        print(f"Error extracting text: {str(e)}")
+        return ""
+
+# Preprocessing presets applied before OCR. Options:
+#   grayscale     - convert to a single channel
+#   crop, pad     - crop to the bounding box of non-background pixels plus padding
+#   min_height    - upscale images shorter than this many pixels...
+#   max_scale     - ...by at most this factor
+#   threshold     - None, "otsu" or "adaptive" binarisation
+#   block_size, c - adaptive threshold parameters
+PREPROCESS_PRESETS = {
+    "none": {},
+    "gray": {"grayscale": True},
+    "fast": {"grayscale": True, "crop": True, "threshold": "otsu"},
+    "small_text": {"grayscale": True, "crop": True, "min_height": 60, "max_scale": 3.0,
+                   "threshold": "otsu"},
+    "accurate": {"grayscale": True, "crop": True, "min_height": 80, "max_scale": 4.0,
+                 "threshold": "adaptive", "block_size": 31, "c": 10},
+}
+
+def resolve_preprocess(preprocess):
+    """Return preprocessing options for a preset name, an options dict or None"""
+    if not preprocess:
+        return {}
+    if isinstance(preprocess, dict):
+        return preprocess
+    if preprocess not in PREPROCESS_PRESETS:
+        raise ValueError(f"Unknown preprocessing preset: {preprocess}")
+    return PREPROCESS_PRESETS[preprocess]
+
+def preprocess_image(img, preprocess=None):
+    """Prepare an image for Tesseract
+
+    Returns (image, (scale, offset_x, offset_y)); a point (x, y) in the
+    processed image maps back to (offset_x + x / scale, offset_y + y / scale)
+    in the original.
+    """
+    options = resolve_preprocess(preprocess)
+    if not options:
+        return img, (1.0, 0, 0)
+
+    arr = np.asarray(img.convert('RGB'))
+    if options.get("grayscale", True):
+        arr = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+    offset_x = offset_y = 0
+    scale = 1.0
+
+    if options.get("crop"):
+        gray = arr if arr.ndim == 2 else cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+        background = int(np.median(gray))
+        points = cv2.findNonZero((np.abs(gray.astype(np.int16) - background) > 25).astype(np.uint8))
+        if points is not None:
+            x, y, w, h = cv2.boundingRect(points)
+            pad = options.get("pad", 10)
+            offset_x, offset_y = max(0, x - pad), max(0, y - pad)
+            arr = arr[offset_y:y + h + pad, offset_x:x + w + pad]
+
+    min_height = options.get("min_height")
+    if min_height and 0 < arr.shape[0] < min_height:
+        scale = min(options.get("max_scale", 3.0), min_height / arr.shape[0])
+        arr = cv2.resize(arr, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+    method = options.get("threshold")
+    if method and arr.ndim == 2:
+        if method == "otsu":
+            _, arr = cv2.threshold(arr, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        elif method == "adaptive":
+            arr = cv2.adaptiveThreshold(arr, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                        options.get("block_size", 31), options.get("c", 10))
+        else:
+            raise ValueError(f"Unknown threshold method: {method}")
+        # Tesseract expects dark text on a light background
+        if np.count_nonzero(arr) < arr.size / 2:
+            arr = cv2.bitwise_not(arr)
+
+    return Image.fromarray(arr), (scale, offset_x, offset_y)
+
+def ocr_text(img, preprocess=None, config=None, ocr_engine=None):
+    """Preprocess an image and return its text"""
+    processed, _ = preprocess_image(img, preprocess)
+    return (ocr_engine or get_ocr_engine()).image_to_string(processed, config)
+
+def ocr_data(img, preprocess=None, config=None, ocr_engine=None):
+    """Preprocess an image and return word boxes in the original image's coordinates"""
+    processed, (scale, offset_x, offset_y) = preprocess_image(img, preprocess)
+    data = (ocr_engine or get_ocr_engine()).image_to_data(processed, config)
+    return map_ocr_boxes(data, scale, offset_x, offset_y)
+
+def data_text(data):
+    """Join image_to_data words into text, one line per Tesseract line"""
+    lines = {}
+    count = len(data['text'])
+    keys = zip(data.get('block_num') or [0] * count, data.get('par_num') or [0] * count,
+               data.get('line_num') or [0] * count)
+    for key, word in zip(keys, data['text']):
+        word = str(word).strip()
+        if word:
+            lines.setdefault(key, []).append(word)
+    return '\n'.join(' '.join(words) for words in lines.values())
+
+def load_ocr_samples(directory):
+    """Load (image, expected text) pairs from PNGs with matching .txt files"""
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith('.png'):
+            continue
+        text_path = os.path.join(directory, os.path.splitext(name)[0] + '.txt')
+        if os.path.exists(text_path):
+            with open(text_path, 'r', encoding='utf-8') as f:
+                samples.append((Image.open(os.path.join(directory, name)).convert('RGB'), f.read()))
+    return samples
+
+def evaluate_preprocessing(samples, presets=None, config=None, ocr_engine=None):
+    """Time and score preprocessing presets against samples with known text
+
+    Returns one result per preset, fastest first, with mean seconds per
+    sample (preprocessing plus OCR), mean text similarity to the expected
+    text and the share of exact matches. These calls bypass the OCR cache
+    so every preset pays for its own Tesseract calls.
+    """
+    engine = ocr_engine or get_ocr_engine()
+    presets = presets or list(PREPROCESS_PRESETS)
+    results = []
+    for preset in presets:
+        elapsed = 0.0
+        similarity = 0.0
+        exact = 0
+        for img, expected in samples:
+            start = time.perf_counter()
+            processed, _ = preprocess_image(img, preset)
+            text = engine.image_to_string(processed, config, use_cache=False)
+            elapsed += time.perf_counter() - start
+            got, want = normalize_text(text), normalize_text(expected)
+            similarity += difflib.SequenceMatcher(None, got, want).ratio()
+            exact += got == want
+        count = max(1, len(samples))
+        results.append({
+            "preset": preset if isinstance(preset, str) else json.dumps(preset, sort_keys=True),
+            "mean_time": elapsed / count,
+            "accuracy": similarity / count,
+            "exact": exact / count,
+        })
+    results.sort(key=lambda r: r["mean_time"])
+    for r in results:
+        logging.info(f"Preprocess {r['preset']}: {r['mean_time'] * 1000:.1f}ms/sample, "
+                     f"accuracy {r['accuracy']:.3f}, exact {r['exact']:.2%}")
+    return results
+
+def choose_preprocess(results, target_accuracy=0.95):
+    """Return the fastest preset from evaluate_preprocessing that reaches the target"""
+    for r in results:
+        if r["accuracy"] >= target_accuracy:
+            return r["preset"]
+    return None
+
+# Minimum similarity (0-1) for a fuzzy text match
+FUZZY_MIN_SCORE = 0.8
+# Fraction of a fuzzy match's score lost at zero Tesseract confidence
+FUZZY_CONF_WEIGHT = 0.1
+# Most candidate word runs scored per fuzzy lookup
+FUZZY_MAX_CANDIDATES = 50
+# Minimum share of a word a fuzzy target must cover when it starts the word
+# ("OK" in "[OK]"); targets inside a word ("ID" in "Invalid") need min_score
+FUZZY_CONTAIN_MIN_SCORE = 0.3
+
+def normalize_text(text):
+    """Lower-case text and collapse whitespace for matching"""
+    return ' '.join(text.lower().split())
+
+def find_text_in_image(img, target, fuzzy=True, min_score=FUZZY_MIN_SCORE, preprocess=None,
+                       ocr_engine=None):
+    """Find text in an image with a single image_to_data pass
+
+    Multi-word targets are matched against runs of consecutive words on the
+    same line. Matching is case-insensitive; fuzzy matching scores candidates
+    (see WordIndex.fuzzy_candidates) and accepts the best one at or above
+    min_score. Returns {"text", "score", "conf", "box"} with box as
+    (x1, y1, x2, y2) in image coordinates, or None if nothing matched.
+    """
+    return WordIndex.from_image(img, preprocess, ocr_engine=ocr_engine).find(target, fuzzy, min_score)
+
+def box_center(box):
+    """Centre (x, y) of an (x1, y1, x2, y2) box"""
+    return (box[0] + box[2]) // 2, (box[1] + box[3]) // 2
+
+def boxes_overlap(a, b):
+    """True if two (x1, y1, x2, y2) boxes intersect"""
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def box_union(a, b):
+    """Smallest (x1, y1, x2, y2) box containing both boxes"""
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class WordIndex:
+    """Inverted index of the words on one OCR'd screen
+
+    Built from a single image_to_data result. Each normalised token maps to
+    the positions it occurs at, and words are grouped by Tesseract
+    block/paragraph/line so phrases only match within one line. Boxes are
+    (x1, y1, x2, y2) in the OCR'd image's coordinates. Build one per screen
+    and look up any number of words or phrases in it.
+    """
+    __slots__ = ("words", "boxes", "confs", "lines", "line_of", "tokens", "_grams")
+
+    def __init__(self, data):
+        self._grams = None
+        self.words = []
+        self.boxes = []
+        self.confs = []
+        self.lines = []
+        # (line number, position within the line) of each word
+        self.line_of = []
+        self.tokens = {}
+        count = len(data['text'])
+        blocks = data.get('block_num') or [0] * count
+        pars = data.get('par_num') or [0] * count
+        line_nums = data.get('line_num') or [0] * count
+        line_numbers = {}
+        for i, text in enumerate(data['text']):
+            token = normalize_text(str(text))
+            if not token:
+                continue
+            key = (blocks[i], pars[i], line_nums[i])
+            line = line_numbers.get(key)
+            if line is None:
+                line = line_numbers[key] = len(self.lines)
+                self.lines.append([])
+            position = len(self.words)
+            self.words.append(token)
+            left, top = data['left'][i], data['top'][i]
+            self.boxes.append((left, top, left + data['width'][i], top + data['height'][i]))
+            try:
+                self.confs.append(float(data['conf'][i]))
+            except (KeyError, IndexError, TypeError, ValueError):
+                self.confs.append(-1.0)
+            self.line_of.append((line, len(self.lines[line])))
+            self.lines[line].append(position)
+            self.tokens.setdefault(token, []).append(position)
+
+    @classmethod
+    def from_image(cls, img, preprocess=None, ocr_engine=None):
+        """OCR an image once and index its words"""
+        return cls(ocr_data(img, preprocess, ocr_engine=ocr_engine))
+
+    def __len__(self):
+        return len(self.words)
+
+    def box(self, positions):
+        """Box enclosing the words at the given positions"""
+        boxes = [self.boxes[p] for p in positions]
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def find_all(self, phrase):
+        """Return every exact (case-insensitive) occurrence of a word or phrase, in reading order
+
+        Lookups go straight to the positions of the phrase's first token.
+        Matches are {"text", "score", "conf", "box"} dicts.
+        """
+        needle = normalize_text(phrase).split()
+        if not needle:
+            return []
+        matches = []
+        for start in self.tokens.get(needle[0], []):
+            line, at = self.line_of[start]
+            window = self.lines[line][at:at + len(needle)]
+            if [self.words[p] for p in window] == needle:
+                matches.append(self._match(window, 1.0))
+        return matches
+
+    def find(self, phrase, fuzzy=False, min_score=FUZZY_MIN_SCORE, within=None):
+        """Return the best occurrence of a word or phrase, or None
+
+        An exact occurrence wins (the first in reading order). Otherwise,
+        with fuzzy, the best run of words containing the phrase is returned
+        ("ID" finds "ID:", "Save" finds "Save/Close"; see find_containing),
+        and only when there is none are runs scored against the phrase (see
+        fuzzy_candidates), the best scoring at least min_score being
+        returned. within, an
+        (x1, y1, x2, y2) box, limits the search to matches whose centre lies
+        inside it.
+        """
+        for match in self.find_all(phrase):
+            if within is None or _box_centre_in(match["box"], within):
+                return match
+        if not fuzzy:
+            return None
+        for match in self.find_containing(phrase, min_score):
+            if within is None or _box_centre_in(match["box"], within):
+                return match
+        for match in self.fuzzy_candidates(phrase, min_score, within):
+            return match
+        return None
+
+    def find_containing(self, phrase, min_score=FUZZY_MIN_SCORE):
+        """Return the runs of words on one line whose text contains the phrase, best first
+
+        A run has as many words as the phrase; its score is the share of its
+        characters the phrase covers. Runs where the phrase starts a word
+        need a score of FUZZY_CONTAIN_MIN_SCORE (or min_score if lower) and
+        come first; runs where it only occurs inside a word need min_score.
+        Ties keep reading order.
+        """
+        needle = normalize_text(phrase)
+        parts = needle.split()
+        if not parts:
+            return []
+        matches = []
+        for start, word in enumerate(self.words):
+            if parts[0] not in word:
+                continue
+            line, at = self.line_of[start]
+            window = self.lines[line][at:at + len(parts)]
+            if len(window) < len(parts):
+                continue
+            text = ' '.join(self.words[p] for p in window)
+            if needle not in text:
+                continue
+            score = len(needle) / len(text)
+            word_start = _at_word_start(text, needle)
+            if score >= (min(min_score, FUZZY_CONTAIN_MIN_SCORE) if word_start else min_score):
+                match = self._match(window, score)
+                matches.append((not word_start, -score, match))
+        matches.sort(key=lambda m: m[:2])
+        return [match for _, _, match in matches]
 
-# Set Tesseract path
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+    def fuzzy_candidates(self, phrase, min_score=FUZZY_MIN_SCORE, within=None,
+                         limit=FUZZY_MAX_CANDIDATES):
+        """Score runs of words against a phrase, best first
 
-class EpicAutomation:
-    def __init__(self):
-        self.screen_regions = {
-            'patient_search': {'top': 100, 'left': 200, 'width': 400, 'height': 200},
-            'insurance_tab': {'top': 150, 'left': 300, 'width': 200, 'height': 50},
-            'claim_button': {'top': 300, 'left': 400, 'width': 150, 'height': 50},
-            'confirmation': {'top': 250, 'left': 350, 'width': 300, 'height': 100}
-        }
-        self.results = []
-        
-    def load_patient_ids(self, file_path):
-        """Load patient IDs from a CSV file"""
-        try:
-            with open(file_path, 'r') as f:
-                reader = csv.reader(f)
-                next(reader)  # Skip header row
-                return [row[0] for row in reader]
-        except Exception as e:
-            logging.error(f"Error loading patient IDs: {str(e)}")
+        Candidate runs start where a word shares a character trigram with
+        the matching phrase token, so only a handful of runs are scored even
+        on screens with thousands of words. Runs one word shorter or longer
+        than the phrase are tried too, as OCR often splits or merges words.
+        A run's score is its difflib similarity to the phrase, weighted down
+        slightly by low Tesseract confidence (FUZZY_CONF_WEIGHT).
+        """
+        needle = normalize_text(phrase)
+        parts = needle.split()
+        if not parts:
             return []
+        grams = self._gram_index()
+        shared = {}
+        for k, part in enumerate(parts):
+            for gram in set(_trigrams(part)):
+                for p in grams.get(gram, ()):
+                    line, at = self.line_of[p]
+                    if at >= k:
+                        start = (line, at - k)
+                        shared[start] = shared.get(start, 0) + 1
 
-    def save_results(self, file_path='insurance_claim_results.csv'):
-        """Save processing results to CSV"""
-        try:
-            with open(file_path, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['Patient ID', 'Status', 'Timestamp', 'Notes'])
-                writer.writerows(self.results)
-            logging.info(f"Results saved to {file_path}")
-        except Exception as e:
-            logging.error(f"Error saving results: {str(e)}")
+        # Score the runs sharing the most trigrams first
+        starts = sorted(shared, key=lambda s: (-shared[s], s))[:limit]
+        scored = []
+        for line, at in starts:
+            positions = self.lines[line]
+            for size in {max(1, len(parts) - 1), len(parts), len(parts) + 1}:
+                window = positions[at:at + size]
+                if len(window) < size:
+                    continue
+                text = ' '.join(self.words[p] for p in window)
+                matcher = difflib.SequenceMatcher(None, text, needle)
+                if matcher.real_quick_ratio() < min_score or matcher.quick_ratio() < min_score:
+                    continue
+                score = matcher.ratio() * self._conf_weight(window)
+                if score >= min_score:
+                    match = self._match(window, score)
+                    if within is None or _box_centre_in(match["box"], within):
+                        scored.append(match)
+        scored.sort(key=lambda m: -m["score"])
+        return scored
 
-    def search_patient(self, patient_id):
-        """Search for a patient in Epic"""
+    def _gram_index(self):
+        """Character trigram -> word positions, built on the first fuzzy lookup"""
+        if self._grams is None:
+            grams = {}
+            for position, word in enumerate(self.words):
+                for gram in set(_trigrams(word)):
+                    grams.setdefault(gram, []).append(position)
+            self._grams = grams
+        return self._grams
+
+    def _conf_weight(self, window):
+        confs = [self.confs[p] for p in window if self.confs[p] >= 0]
+        if not confs:
+            return 1.0
+        return 1.0 - FUZZY_CONF_WEIGHT * (1.0 - min(100.0, sum(confs) / len(confs)) / 100.0)
+
+    def _match(self, window, score):
+        confs = [self.confs[p] for p in window]
+        return {"text": ' '.join(self.words[p] for p in window), "score": score,
+                "conf": sum(confs) / len(confs), "box": self.box(window)}
+
+def _trigrams(word):
+    padded = f" {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+def _at_word_start(text, needle):
+    """True if needle occurs in text without a letter or digit just before it"""
+    at = text.find(needle)
+    while at >= 0:
+        if at == 0 or not text[at - 1].isalnum():
+            return True
+        at = text.find(needle, at + 1)
+    return False
+
+def _box_centre_in(box, within):
+    x, y = box_center(box)
+    return within[0] <= x < within[2] and within[1] <= y < within[3]
+
+# Minimum normalised correlation for a template match to be trusted
+TEMPLATE_THRESHOLD = 0.85
+
+def to_gray_array(img):
+    """Convert a PIL image to a grayscale numpy array"""
+    return cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2GRAY)
+
+class TemplateMatcher:
+    """Locate reference crops of fixed UI elements with OpenCV template matching
+
+    Templates are loaded once per set of scales and kept as grayscale
+    pyramids, so repeated lookups only pay for cv2.matchTemplate.
+    """
+
+    def __init__(self, threshold=TEMPLATE_THRESHOLD, scales=(1.0,)):
+        self.threshold = threshold
+        self.scales = tuple(scales)
+        self._pyramids = {}
+        self._lock = threading.Lock()
+
+    def pyramid(self, template_path, scales=None):
+        """Return [(scale, gray template)] for a template file, loading it once"""
+        scales = tuple(scales or self.scales)
+        key = (template_path, scales)
+        with self._lock:
+            if key not in self._pyramids:
+                template = None
+                if os.path.exists(template_path):
+                    template = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
+                if template is None:
+                    raise FileNotFoundError(f"Template not found: {template_path}")
+                levels = []
+                for scale in scales:
+                    if scale == 1.0:
+                        levels.append((scale, template))
+                    else:
+                        size = (max(1, round(template.shape[1] * scale)),
+                                max(1, round(template.shape[0] * scale)))
+                        levels.append((scale, cv2.resize(template, size, interpolation=cv2.INTER_AREA)))
+                self._pyramids[key] = levels
+            return self._pyramids[key]
+
+    def find(self, img, template_path, threshold=None, scales=None):
+        """Find a template in an image
+
+        Returns {"box", "score", "scale"} for the best match across scales,
+        with box as (x1, y1, x2, y2) in image coordinates, or None when the
+        best score is below the threshold.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        haystack = img if isinstance(img, np.ndarray) else to_gray_array(img)
+        best = None
+        for scale, template in self.pyramid(template_path, scales):
+            h, w = template.shape[:2]
+            if h > haystack.shape[0] or w > haystack.shape[1]:
+                continue
+            result = cv2.matchTemplate(haystack, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (x, y) = cv2.minMaxLoc(result)
+            if best is None or score > best["score"]:
+                best = {"box": (x, y, x + w, y + h), "score": float(score), "scale": scale}
+        if best is None or best["score"] < threshold:
+            logging.debug(f"Template {template_path} below threshold: "
+                          f"{best['score'] if best else 0.0:.2f} < {threshold}")
+            return None
+        return best
+
+
+# Shared template matcher, created on first use
+_template_matcher = None
+
+def get_template_matcher():
+    """Return the shared template matcher"""
+    global _template_matcher
+    if _template_matcher is None:
+        _template_matcher = TemplateMatcher()
+    return _template_matcher
+
+def image_find(template, region=None, fallback_text=None, threshold=None, scales=None,
+               fuzzy=True, preprocess=None, backend=None, ocr_engine=None):
+    """Locate a UI element on screen by template, falling back to OCR
+
+    The region is captured once; template matching runs first and OCR only
+    runs on that same capture when the match confidence is too low and
+    fallback_text is given. Returns the element's (x1, y1, x2, y2) box in
+    screen coordinates, or None.
+    """
+    region = as_bbox(region)
+    img = (backend or get_backend()).capture(region)
+    match = None
+    if template:
         try:
-            # Click patient search field
-            self.click_position(250, 100)  # Adjust coordinates
-            time.sleep(0.5)
-            
-            # Clear existing text
-            pyautogui.hotkey('ctrl', 'a')
-            pyautogui.press('backspace')
-            
-            # Type patient ID
-            pyautogui.write(patient_id)
-            pyautogui.press('enter')
-            time.sleep(2)  # Wait for search results
-            
-            # Verify patient found
-            if self.find_text_in_region("patient_search", patient_id):
-                logging.info(f"Patient {patient_id} found")
+            match = get_template_matcher().find(img, template, threshold, scales)
+        except FileNotFoundError as e:
+            logging.warning(str(e))
+    if match is None and fallback_text:
+        logging.debug(f"Falling back to OCR for '{fallback_text}'")
+        match = find_text_in_image(img, fallback_text, fuzzy=fuzzy, preprocess=preprocess,
+                                   ocr_engine=ocr_engine)
+    if match is None:
+        return None
+    x1, y1, x2, y2 = match["box"]
+    ox, oy = (region[0], region[1]) if region else (0, 0)
+    return (ox + x1, oy + y1, ox + x2, oy + y2)
+
+# Text detection limits (pixels) and the Tesseract mode used for detected
+# crops, which are mostly single lines
+DETECT_MIN_HEIGHT = 6
+DETECT_MAX_HEIGHT = 120
+DETECT_OCR_CONFIG = '--psm 7'
+
+def detect_text_regions(img, min_height=DETECT_MIN_HEIGHT, max_height=DETECT_MAX_HEIGHT, pad=4):
+    """Propose boxes likely to contain text using a morphological gradient
+
+    Character edges are found with a gradient, binarised, and closed with a
+    wide kernel so letters merge into word and line blobs; each blob's
+    bounding box (plus padding) is a candidate. Returns (x1, y1, x2, y2)
+    boxes in reading order.
+    """
+    gray = to_gray_array(img)
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT,
+                                cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE,
+                              cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    # CCOMP keeps text drawn inside panel outlines as separate outer contours
+    contours, hierarchy = cv2.findContours(closed, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+
+    height, width = gray.shape[:2]
+    boxes = []
+    for i, contour in enumerate(contours):
+        if hierarchy[0][i][3] != -1:
+            continue
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < min_height or h > max_height or w < min_height:
+            continue
+        # Skip blobs that are mostly empty, e.g. outlines of boxes and panels
+        if cv2.countNonZero(binary[y:y + h, x:x + w]) < 0.1 * w * h:
+            continue
+        boxes.append((max(0, x - pad), max(0, y - pad), min(width, x + w + pad), min(height, y + h + pad)))
+    boxes.sort(key=lambda b: (b[1], b[0]))
+    return boxes
+
+def rank_regions_for_text(boxes, target):
+    """Order candidate boxes by how well their width fits the target text
+
+    Expected width assumes glyphs about 0.55 times as wide as the line is
+    tall, so crops of roughly the right length are OCR'd first.
+    """
+    chars = max(1, len(target))
+
+    def misfit(box):
+        w, h = box[2] - box[0], box[3] - box[1]
+        expected = chars * 0.55 * h
+        return abs(w - expected) / expected
+
+    return sorted(boxes, key=misfit)
+
+def map_ocr_boxes(data, scale=1.0, offset_x=0, offset_y=0):
+    """Map image_to_data boxes from a scaled, offset image back to the original"""
+    if scale == 1.0 and offset_x == 0 and offset_y == 0:
+        return data
+    data = dict(data)
+    data['left'] = [offset_x + int(v / scale) for v in data['left']]
+    data['top'] = [offset_y + int(v / scale) for v in data['top']]
+    data['width'] = [int(v / scale) for v in data['width']]
+    data['height'] = [int(v / scale) for v in data['height']]
+    return data
+
+def iter_region_ocr(img, boxes, method="image_to_data", preprocess=None, config=DETECT_OCR_CONFIG,
+                    ocr_engine=None):
+    """OCR crops of an image in parallel, yielding (box, result) in box order
+
+    Up to the engine's worker count of crops are in flight at once, so a
+    caller that stops early (e.g. once a click target is found) leaves the
+    remaining crops un-OCR'd. image_to_data results are mapped to the full
+    image's coordinates.
+    """
+    engine = ocr_engine or get_ocr_engine()
+    boxes = iter(boxes)
+    pending = deque()
+
+    def submit(box):
+        processed, transform = preprocess_image(img.crop(box), preprocess)
+        return box, transform, engine.submit(method, processed, config)
+
+    for box in boxes:
+        pending.append(submit(box))
+        if len(pending) >= engine.workers:
+            break
+    try:
+        while pending:
+            box, (scale, offset_x, offset_y), future = pending.popleft()
+            next_box = next(boxes, None)
+            if next_box is not None:
+                pending.append(submit(next_box))
+            result = future.result()
+            if method == "image_to_data":
+                result = map_ocr_boxes(result, scale, box[0] + offset_x, box[1] + offset_y)
+            yield box, result
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+def ocr_detected_text(img, preprocess=None, ocr_engine=None):
+    """Extract text from only the detected text areas of an image, in reading order"""
+    boxes = detect_text_regions(img)
+    lines = [text.strip() for _, text in
+             iter_region_ocr(img, boxes, "image_to_string", preprocess, ocr_engine=ocr_engine)]
+    return '\n'.join(line for line in lines if line)
+
+def ocr_detected_data(img, preprocess=None, ocr_engine=None):
+    """image_to_data for only the detected text areas of an image, merged in reading order
+
+    Each area becomes its own block so its lines stay separate in data_text.
+    """
+    keys = ('text', 'left', 'top', 'width', 'height', 'conf', 'par_num', 'line_num')
+    merged = {key: [] for key in keys + ('block_num',)}
+    boxes = detect_text_regions(img)
+    for number, (_, data) in enumerate(iter_region_ocr(img, boxes, "image_to_data", preprocess,
+                                                       ocr_engine=ocr_engine)):
+        count = len(data['text'])
+        for key in keys:
+            merged[key].extend(data.get(key) or [0] * count)
+        merged['block_num'].extend([number] * count)
+    return merged
+
+# Polling defaults for wait_for; a frame counts as changed when its mean
+# grayscale difference exceeds WAIT_DIFF_THRESHOLD (0-255 scale)
+WAIT_TIMEOUT = 10.0
+WAIT_INTERVAL = 0.1
+WAIT_STABLE_TIME = 0.3
+WAIT_DIFF_THRESHOLD = 1.0
+
+def _gray(img):
+    """Grayscale numpy array of a PIL image or an RGB array"""
+    if isinstance(img, np.ndarray):
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+    return np.asarray(img.convert('L'))
+
+def frame_signature(img, size=(64, 36)):
+    """Return a small grayscale array of an image (PIL or RGB array) for cheap frame comparisons
+
+    Both input kinds go through the same grayscale and area-averaging
+    steps, so signatures of grabbed buffers and captured images compare.
+    """
+    return cv2.resize(_gray(img), size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+def frame_diff(a, b):
+    """Mean absolute difference between two frame signatures"""
+    if a is None or b is None or a.shape != b.shape:
+        return 255.0
+    return float(np.abs(a - b).mean())
+
+def frame_hash(img, size=8):
+    """Return a difference hash of an image: size*size booleans, one per adjacent-pixel gradient"""
+    gray = cv2.resize(_gray(img), (size + 1, size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return gray[:, 1:] > gray[:, :-1]
+
+def hash_distance(a, b):
+    """Number of differing bits between two frame hashes"""
+    if a is None or b is None or a.shape != b.shape:
+        return 64 if a is None else a.size
+    return int(np.count_nonzero(a != b))
+
+def frame_digest(img):
+    """Exact content hash of a frame (PIL image or array); any pixel change gives a new digest
+
+    OCR results are only reused on a matching digest: two patient screens
+    can differ by a few digits of an MRN, far below any signature threshold.
+    """
+    if isinstance(img, Image.Image):
+        digest = hashlib.blake2b(img.tobytes(), digest_size=16)
+        digest.update(f"{img.mode}{img.size}".encode())
+    else:
+        digest = hashlib.blake2b(np.ascontiguousarray(img).data, digest_size=16)
+        digest.update(f"{img.dtype}{img.shape}".encode())
+    return digest.digest()
+
+def text_in(haystack, needle):
+    """Case- and whitespace-insensitive containment test for OCR text"""
+    return ' '.join(needle.lower().split()) in ' '.join(haystack.lower().split())
+
+# Differing hash bits above which a region counts as changed when watching with frame hashes
+HASH_DIFF_THRESHOLD = 2
+
+
+class RegionWatcher:
+    """Remembers the last frame of each screen region so OCR only runs when pixels moved
+
+    Frames are kept as downsampled grayscale arrays (frame_signature) or,
+    with use_hash, as difference hashes that ignore small brightness
+    shifts; comparing two costs microseconds rather than an OCR pass.
+    Regions are capture boxes, None being the full screen. A region's
+    reference frame only moves when the region changes, so slow drift is
+    still noticed. The coarse comparison only drives the waits: results
+    stored with reuse() are keyed on the exact pixels (frame_digest).
+    """
+
+    def __init__(self, backend=None, threshold=WAIT_DIFF_THRESHOLD, use_hash=False,
+                 hash_threshold=HASH_DIFF_THRESHOLD):
+        self.backend = backend
+        self.use_hash = use_hash
+        self.threshold = hash_threshold if use_hash else threshold
+        self.frames = {}
+        self.results = {}
+        self.reused = 0
+        self.computed = 0
+        self._lock = threading.Lock()
+
+    def signature(self, frame):
+        return frame_hash(frame) if self.use_hash else frame_signature(frame)
+
+    def diff(self, a, b):
+        return hash_distance(a, b) if self.use_hash else frame_diff(a, b)
+
+    def grab(self, region=None):
+        return (self.backend or get_backend()).grab(region)
+
+    def _update(self, region, signature):
+        """Compare a signature with the region's reference, replacing it if the region moved"""
+        region = tuple(region) if region is not None else None
+        with self._lock:
+            moved = self.diff(signature, self.frames.get(region)) > self.threshold
+            if moved:
+                self.frames[region] = signature
+            return moved, self.frames[region]
+
+    def changed(self, region=None, frame=None):
+        """Return True if the region moved since it was last seen (or was never seen)
+
+        frame, if given, is used instead of capturing the region.
+        """
+        if frame is None:
+            frame = self.grab(region)
+        return self._update(region, self.signature(frame))[0]
+
+    def wait_until_changed(self, region=None, timeout=WAIT_TIMEOUT, interval=WAIT_INTERVAL):
+        """Poll until the region differs from its last seen frame; False on timeout"""
+        deadline = time.monotonic() + timeout
+        if (tuple(region) if region is not None else None) not in self.frames:
+            self.changed(region)
+        while True:
+            if self.changed(region):
                 return True
-            else:
-                logging.warning(f"Patient {patient_id} not found")
+            if time.monotonic() >= deadline:
                 return False
-        except Exception as e:
-            logging.error(f"Error searching patient {patient_id}: {str(e)}")
-            return False
+            time.sleep(max(0.0, min(interval, deadline - time.monotonic())))
 
-    def navigate_to_insurance(self):
-        """Navigate to insurance section"""
-        try:
-            # Look for insurance tab
-            if self.find_text_in_region("insurance_tab", "Insurance"):
-                self.click_position(350, 175)  # Adjust coordinates
-                time.sleep(1)
+    def wait_until_stable(self, region=None, ms=WAIT_STABLE_TIME * 1000, timeout=WAIT_TIMEOUT,
+                          interval=WAIT_INTERVAL):
+        """Poll until the region stops changing for ms milliseconds; False on timeout"""
+        deadline = time.monotonic() + timeout
+        previous = None
+        stable_since = None
+        while True:
+            now = time.monotonic()
+            signature = self.signature(self.grab(region))
+            if self.diff(signature, previous) > self.threshold:
+                stable_since = now
+                previous = signature
+            elif now - stable_since >= ms / 1000:
+                self._update(region, signature)
                 return True
-            return False
-        except Exception as e:
-            logging.error(f"Error navigating to insurance: {str(e)}")
-            return False
-
-    def process_insurance_claim(self, patient_id):
-        """Process insurance claim for a patient"""
-        try:
-            # Search for patient
-            if not self.search_patient(patient_id):
-                self.results.append([patient_id, "Failed", datetime.now(), "Patient not found"])
+            if now >= deadline:
                 return False
+            time.sleep(max(0.0, min(interval, deadline - time.monotonic())))
 
-            # Navigate to insurance section
-            if not self.navigate_to_insurance():
-                self.results.append([patient_id, "Failed", datetime.now(), "Insurance section not found"])
-                return False
+    def reuse(self, region, frame, key, compute):
+        """Return compute() for this region and key, re-running it unless the pixels are identical
 
-            # Look for claim button
-            if self.find_text_in_region("claim_button", "Submit Claim"):
-                self.click_position(450, 325)  # Adjust coordinates
-                time.sleep(1)
+        key names what is being computed (method, target, preprocessing).
+        Results are kept for the region's last frame only and reused when a
+        frame hashes exactly the same; any pixel change runs compute() again.
+        """
+        digest = frame_digest(frame)
+        region = tuple(region) if region is not None else None
+        with self._lock:
+            stored = self.results.get(region)
+            if stored is not None and stored[0] == digest and key in stored[1]:
+                self.reused += 1
+                trace_add("ocr_skipped")
+                return stored[1][key]
+        result = compute()
+        with self._lock:
+            self.computed += 1
+            stored = self.results.get(region)
+            if stored is None or stored[0] != digest:
+                stored = self.results[region] = (digest, {})
+            stored[1][key] = result
+        return result
 
-                # Verify confirmation
-                if self.find_text_in_region("confirmation", "Claim Submitted"):
-                    self.results.append([patient_id, "Success", datetime.now(), "Claim submitted"])
-                    return True
-                else:
-                    self.results.append([patient_id, "Failed", datetime.now(), "No confirmation received"])
-                    return False
+    def forget(self, region=None):
+        """Drop the remembered frame and results for one region, or for all regions"""
+        with self._lock:
+            if region is None:
+                self.frames.clear()
+                self.results.clear()
             else:
-                self.results.append([patient_id, "Failed", datetime.now(), "Claim button not found"])
-                return False
+                self.frames.pop(tuple(region), None)
+                self.results.pop(tuple(region), None)
 
-        except Exception as e:
-            logging.error(f"Error processing claim for patient {patient_id}: {str(e)}")
-            self.results.append([patient_id, "Error", datetime.now(), str(e)])
-            return False
+    def stats(self):
+        with self._lock:
+            return {"regions": len(self.frames), "reused": self.reused, "computed": self.computed}
 
-    def process_batch(self, patient_ids):
-        """Process a batch of patient IDs"""
-        total = len(patient_ids)
-        successful = 0
 
-        for i, patient_id in enumerate(patient_ids, 1):
-            logging.info(f"Processing patient {i}/{total}: {patient_id}")
-            
-            if self.process_insurance_claim(patient_id):
-                successful += 1
-            
-            # Wait between patients
-            time.sleep(2)
+class WaitCondition:
+    """Frame-by-frame state for wait_for and wait_for_async
 
-        return successful, total
+    check() is fed each polled frame's signature (for "text" waits, its
+    frame_digest) and returns True once the condition holds, False to keep
+    polling, or "ocr" when a "text" wait needs the frame OCR'd (whenever
+    any pixel changed since the last OCR).
+    """
 
-def load_sequence(json_file):
-    """Load automation sequence from JSON file"""
-    try:
-        with open(json_file, 'r') as f:
-            sequence = json.load(f)
-        return sequence
-    except Exception as e:
-        print(f"Error loading sequence file: {str(e)}")
-        return None
+    def __init__(self, condition, text=None, stable_time=WAIT_STABLE_TIME,
+                 threshold=WAIT_DIFF_THRESHOLD, baseline=None):
+        if condition not in ("text", "change", "stable"):
+            raise ValueError(f"Unknown wait condition: {condition}")
+        if condition == "text" and not text:
+            raise ValueError("wait_for('text') needs the text to look for")
+        self.condition = condition
+        self.text = text
+        self.stable_time = stable_time
+        self.threshold = threshold
+        self.previous = baseline
+        self.last_ocr = None
+        self.stable_since = None
 
-def save_sequence(sequence, json_file):
-    """Save automation sequence to JSON file"""
-    try:
-        with open(json_file, 'w') as f:
-            json.dump(sequence, f, indent=2)
-        print(f"Sequence saved to {json_file}")
-        return True
-    except Exception as e:
-        print(f"Error saving sequence file: {str(e)}")
+    def check(self, signature, now):
+        if self.condition == "text":
+            if signature != self.last_ocr:
+                self.last_ocr = signature
+                return "ocr"
+        elif self.condition == "change":
+            if self.previous is None:
+                self.previous = signature
+            elif frame_diff(signature, self.previous) > self.threshold:
+                return True
+        else:
+            if frame_diff(signature, self.previous) > self.threshold:
+                self.stable_since = now
+            elif self.stable_since is not None and now - self.stable_since >= self.stable_time:
+                return True
+            self.previous = signature
         return False
 
-def take_screenshot(filename=None, region=None):
-    """Take a screenshot and save it to file if filename is provided"""
-    if filename is None:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"screenshot_{timestamp}.png"
-    
+    def text_found(self, ocr_result):
+        return text_in(ocr_result, self.text)
+
+
+def wait_for(condition, region=None, text=None, timeout=WAIT_TIMEOUT, interval=WAIT_INTERVAL,
+             stable_time=WAIT_STABLE_TIME, threshold=WAIT_DIFF_THRESHOLD, baseline=None,
+             preprocess=None, backend=None, ocr_engine=None, watcher=None):
+    """Poll a screen region until a condition holds or the timeout expires
+
+    condition is "text" (text appears in the region), "change" (the region
+    differs from baseline, or from the first poll) or "stable" (the region
+    stops changing for stable_time seconds). OCR only runs for "text", and
+    only when the region's pixels changed since the last OCR pass; with a
+    RegionWatcher identical frames also skip OCR across calls.
+    Returns True as soon as the condition holds, False on timeout.
+    """
+    state = WaitCondition(condition, text, stable_time, threshold, baseline)
+    region = as_bbox(region)
+    backend = backend or get_backend()
+    started = time.monotonic()
+    deadline = started + timeout
     try:
-        # Use PIL's ImageGrab directly - works on both Mac and Windows
-        if region:
-            screenshot = ImageGrab.grab(bbox=region)
+        return _poll_until(state, region, deadline, interval, preprocess, backend, ocr_engine, watcher)
+    finally:
+        trace_add("wait_time", time.monotonic() - started)
+
+def _poll_until(state, region, deadline, interval, preprocess, backend, ocr_engine, watcher):
+    while True:
+        now = time.monotonic()
+        # Only text waits need a frame of their own to OCR
+        if state.condition == "text":
+            frame = backend.capture(region)
+            result = state.check(frame_digest(frame), now)
         else:
-            screenshot = ImageGrab.grab()
-        
-        # Convert and save
-        screenshot = screenshot.convert('RGB')
-        screenshot.save(filename)
-        print(f"Screenshot saved to {filename}")
-        return filename
-        
-    except Exception as e:
-        print(f"Error taking screenshot: {str(e)}")
-        # Try pyautogui as fallback
-        try:
-            if region:
-                screenshot = pyautogui.screenshot(region=region)
+            result = state.check(frame_signature(backend.grab(region)), now)
+        if result == "ocr":
+            if watcher is not None:
+                found = watcher.reuse(region, frame, ("image_to_string", repr(preprocess)),
+                                      lambda: ocr_text(frame, preprocess, ocr_engine=ocr_engine))
             else:
-                screenshot = pyautogui.screenshot()
-            screenshot.save(filename)
-            print(f"Screenshot saved using fallback method to {filename}")
-            return filename
-        except Exception as e2:
-            print(f"Error in fallback screenshot: {str(e2)}")
-            return None
+                found = ocr_text(frame, preprocess, ocr_engine=ocr_engine)
+            result = state.text_found(found)
+        if result:
+            return True
+
+        if now >= deadline:
+            return False
+        time.sleep(max(0.0, min(interval, deadline - time.monotonic())))
 
-def extract_text_from_screenshot(screenshot_path):
-    """Extract text from a screenshot using OCR"""
+async def wait_for_async(condition, region=None, text=None, timeout=WAIT_TIMEOUT, interval=WAIT_INTERVAL,
+                         stable_time=WAIT_STABLE_TIME, threshold=WAIT_DIFF_THRESHOLD, baseline=None,
+                         preprocess=None, backend=None, ocr_engine=None, watcher=None):
+    """Awaitable wait_for: polls with asyncio.sleep and OCRs on the engine's workers"""
+    state = WaitCondition(condition, text, stable_time, threshold, baseline)
+    region = as_bbox(region)
+    backend = backend or get_backend()
+    engine = ocr_engine or get_ocr_engine()
+    started = time.monotonic()
+    deadline = started + timeout
     try:
-        img = Image.open(screenshot_path)
-        text = pytesseract.image_to_string(img)
-        return text.strip()
-    except Exception as e:
-        print(f"Error extracting text: {str(e)}")
-        return ""
+        return await _poll_until_async(state, region, deadline, interval, preprocess, backend,
+                                       engine, watcher)
+    finally:
+        trace_add("wait_time", time.monotonic() - started)
+
+async def _poll_until_async(state, region, deadline, interval, preprocess, backend, engine, watcher):
+    while True:
+        now = time.monotonic()
+        if state.condition == "text":
+            frame = await asyncio.to_thread(backend.capture, region)
+            signature = frame_digest(frame)
+        else:
+            # Grab buffers belong to the worker thread, so sign the frame there
+            signature = await asyncio.to_thread(lambda: frame_signature(backend.grab(region)))
+        result = state.check(signature, now)
+        if result == "ocr":
+            if watcher is not None:
+                found = await asyncio.to_thread(
+                    watcher.reuse, region, frame, ("image_to_string", repr(preprocess)),
+                    lambda: ocr_text(frame, preprocess, ocr_engine=engine))
+            else:
+                processed, _ = preprocess_image(frame, preprocess)
+                found = await asyncio.wrap_future(engine.submit("image_to_string", processed))
+            result = state.text_found(found)
+        if result:
+            return True
+
+        if now >= deadline:
+            return False
+        await asyncio.sleep(max(0.0, min(interval, deadline - time.monotonic())))
 
 def record_new_sequence():
     """Interactive tool to record a new automation sequence"""
-    sequence = {"name": "New Automation Sequence", "steps": []}
+    sequence = {"name": "New Automation Sequence", "region_format": "bbox", "steps": []}
     
     print("=== Recording New Automation Sequence ===")
     sequence["name"] = input("Enter a name for this sequence: ")
@@ -266,9 +3632,7 @@ def record_new_sequence():
             if region_input:
                 try:
                     x1, y1, x2, y2 = map(int, region_input.split(','))
-                    width = x2 - x1
-                    height = y2 - y1
-                    step["region"] = [x1, y1, width, height]
+                    step["region"] = list(Region.from_bbox((x1, y1, x2, y2)).bbox)
                 except:
                     print("Invalid region format. Using full screen.")
             
@@ -292,7 +3656,7 @@ def record_new_sequence():
                 
                 step = {
                     "type": "ocr_click",
-                    "region": [x1, y1, x2-x1, y2-y1],
+                    "region": list(Region.from_bbox((x1, y1, x2, y2)).bbox),
                     "target_word": target_word,
                     "fuzzy": fuzzy_match
                 }
@@ -348,151 +3712,1369 @@ def record_new_sequence():
     save_sequence(sequence, filename)
     return sequence
 
-def run_sequence(sequence, debug=False, csv_file=None, csv_row=0):
-    """Run an automation sequence"""
+class SequenceError(ValueError):
+    """Raised when a sequence contains an unsupported or malformed step"""
+
+
+# Distinguishes runs started within the same second
+_run_ids = itertools.count(1)
+
+def new_run_id():
+    """Return an ID for one run of a sequence, or one pass over a CSV file"""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{next(_run_ids)}"
+
+
+class RunContext:
+    """Per-run state handed to each compiled step"""
+    __slots__ = ("backend", "ocr_engine", "debug", "csv_value", "csv_columns", "region", "baseline",
+                 "watcher", "anchors", "screen", "run_id", "row", "sequence")
+
+    def __init__(self, backend, ocr_engine, debug=False, csv_value=None, csv_columns=None,
+                 sequence=None, run_id=None, row=None):
+        self.backend = backend
+        self.ocr_engine = ocr_engine
+        # Skips OCR of regions whose pixels have not moved since they were last read
+        self.watcher = RegionWatcher(backend)
+        # Anchor positions found so far this run, and the screen size for clipping
+        self.anchors = {}
+        self.screen = None
+        # Identify this run and CSV row in the screenshot archive and OCR results store
+        self.run_id = run_id or new_run_id()
+        self.row = row
+        self.sequence = sequence
+        self.debug = debug
+        self.csv_value = csv_value
+        self.csv_columns = csv_columns
+        self.region = None
+        self.baseline = None
+
+    def bbox(self, region):
+        """Resolve a step's Region to the (x1, y1, x2, y2) box to capture, or None
+
+        Anchored regions are moved onto their anchor (found once per run),
+        and every region is clipped to the screen so captures never include
+        off-screen pixels. Raises SequenceError if the anchor is missing or
+        the region is off screen.
+        """
+        if region is None:
+            return None
+        if region.anchor is not None:
+            key = json.dumps(region.anchor, sort_keys=True)
+            if key not in self.anchors:
+                try:
+                    self.anchors[key] = find_anchor(region.anchor, self.backend, self.ocr_engine)
+                except LookupError as e:
+                    raise SequenceError(str(e))
+            region = region.offset(*self.anchors[key])
+        if self.screen is None:
+            self.screen = self.backend.screen_size()
+        try:
+            return region.clip(self.screen).bbox
+        except ValueError as e:
+            raise SequenceError(str(e))
+
+    def format(self, template):
+        """Substitute {column} fields from the current CSV row into template"""
+        if self.csv_columns is None:
+            raise SequenceError(f"'{template}' uses CSV columns but the CSV has no header row")
+        try:
+            return template.format_map(self.csv_columns)
+        except KeyError as e:
+            raise SequenceError(f"CSV has no column {e}")
+
+
+def _number(step, key, default=None, minimum=None):
+    """Read a numeric step field, raising SequenceError if it is malformed"""
+    value = step.get(key, default)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise SequenceError(f"'{key}' must be a number, got {value!r}")
+    if minimum is not None and value < minimum:
+        raise SequenceError(f"'{key}' must be at least {minimum}, got {value}")
+    return value
+
+def _region(step, key="region"):
+    """Read an optional region field as a Region
+
+    Lists are [x1, y1, x2, y2]; dicts use left/top/width/height. A step
+    "anchor" ({"window"}, {"template"} or {"text"}, see find_anchor) makes
+    the coordinates relative to that window or landmark.
+    """
+    value = step.get(key)
+    if value is None:
+        return None
+    try:
+        region = Region.coerce(value)
+    except (KeyError, TypeError, ValueError) as e:
+        raise SequenceError(f"'{key}' must be [x1, y1, x2, y2] or a left/top/width/height "
+                            f"object, got {value!r} ({e})")
+    anchor = step.get("anchor")
+    if anchor is not None:
+        if not isinstance(anchor, dict) or not any(k in anchor for k in ("window", "template", "text")):
+            raise SequenceError("'anchor' must be an object with a window, template or text")
+        region = Region(region.left, region.top, region.width, region.height, anchor)
+    return region
+
+def _text(step, key, required=True):
+    """Read a string step field"""
+    value = step.get(key)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or not value:
+        raise SequenceError(f"'{key}' must be a non-empty string")
+    return value
+
+def _csv_fields(text):
+    """Return the {column} names referenced in text
+
+    As with str.format, literal braces are written doubled: {{ and }}.
+    """
+    try:
+        fields = {field for _, field, _, _ in string.Formatter().parse(text) if field is not None}
+    except ValueError as e:
+        raise SequenceError(f"Invalid placeholder in {text!r}: {e} (write literal braces as {{{{ and }}}})")
+    if any(not field or field.isdigit() for field in fields):
+        raise SequenceError(f"Placeholders in {text!r} must name a CSV column "
+                            f"(write literal braces as {{{{ and }}}})")
+    return fields
+
+def _preprocess(step):
+    """Read and validate a step's preprocessing setting"""
+    value = step.get("preprocess")
+    try:
+        resolve_preprocess(value)
+    except ValueError as e:
+        raise SequenceError(str(e))
+    return value
+
+
+class Step:
+    """A validated sequence step; subclasses implement run()"""
+    __slots__ = ("index", "baseline_for")
+    type_name = None
+    # CSV column names the step reads
+    csv_fields = frozenset()
+
+    def __init__(self, index):
+        self.index = index
+        # Wait step whose region is snapshotted before this step runs
+        self.baseline_for = None
+
+    @classmethod
+    def from_dict(cls, step, index):
+        raise NotImplementedError
+
+    def run(self, ctx):
+        """Execute the step; return False to stop the sequence"""
+        raise NotImplementedError
+
+    async def run_async(self, ctx):
+        """Awaitable run(); blocking input and OCR run on a worker thread"""
+        return await run_in_session(ctx.backend, self.run, ctx)
+
+    def ocr_targets(self, ctx, region=None):
+        """Return the (capture box, OCR method, preprocess) reads this step will make
+
+        ctx resolves the step's own region; region is the region of interest
+        (ctx.region when the step runs) used by steps without one.
+        """
+        return []
+
+    def describe(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{self.type_name} ({fields})"
+
+
+class WaitStep(Step):
+    __slots__ = ("duration",)
+    type_name = "wait"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.duration = _number(step, "duration", 1, minimum=0)
+        return self
+
+    def run(self, ctx):
+        if ctx.debug:
+            print(f"Waiting for {self.duration} seconds...")
+        time.sleep(self.duration)
+        trace_add("wait_time", self.duration)
+        return True
+
+    async def run_async(self, ctx):
+        if ctx.debug:
+            print(f"Waiting for {self.duration} seconds...")
+        await asyncio.sleep(self.duration)
+        trace_add("wait_time", self.duration)
+        return True
+
+
+class ClickStep(Step):
+    __slots__ = ("x", "y", "click_type")
+    type_name = "click"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.x = _number(step, "x", 0)
+        self.y = _number(step, "y", 0)
+        self.click_type = step.get("click_type", "single")
+        if self.click_type not in ("single", "double", "right", "move"):
+            raise SequenceError(f"Unknown click_type: {self.click_type!r}")
+        return self
+
+    def run(self, ctx):
+        if ctx.debug:
+            print(f"Moving to {self.x},{self.y} for {self.click_type} click...")
+        # Move mouse to position and perform the click based on type
+        ctx.backend.click(self.x, self.y, self.click_type, duration=0.5)
+        return True
+
+
+class OcrClickStep(Step):
+    __slots__ = ("region", "target_word", "fuzzy", "preprocess", "detect_text", "capture_region")
+    type_name = "ocr_click"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.region = _region(step)
+        self.target_word = _text(step, "target_word")
+        self.fuzzy = bool(step.get("fuzzy", False))
+        self.preprocess = _preprocess(step)
+        self.detect_text = step.get("detect_text")
+        # Shared capture box when neighbouring ocr_click regions overlap (see merge_ocr_regions)
+        self.capture_region = None
+        return self
+
+    def run(self, ctx):
+        region = ctx.bbox(self.region) or ctx.region
+        if ctx.debug:
+            print(f"Looking for text '{self.target_word}' in region {region}")
+        detect_text = self.detect_text if self.detect_text is not None else not region
+        match = click_on_word(self.target_word, region, self.fuzzy, backend=ctx.backend,
+                              ocr_engine=ctx.ocr_engine, preprocess=self.preprocess,
+                              detect_text=detect_text, watcher=ctx.watcher,
+                              capture_region=ctx.bbox(self.capture_region))
+        if not match:
+            print(f"Warning: Could not find text '{self.target_word}' in specified region")
+        elif ctx.debug:
+            print(f"Clicked '{match['text']}' (score {match['score']:.2f})")
+        return True
+
+    def ocr_targets(self, ctx, region=None):
+        if self.region:
+            if self.region.anchor:
+                return []
+            region = ctx.bbox(self.capture_region or self.region)
+        if region and not self.detect_text:
+            return [(region, "image_to_data", self.preprocess)]
+        return []
+
+
+class ScreenshotStep(Step):
+    __slots__ = ("region", "ocr", "save", "preprocess", "detect_text")
+    type_name = "screenshot"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.region = _region(step)
+        self.ocr = bool(step.get("ocr", False))
+        self.save = bool(step.get("save", True))
+        self.preprocess = _preprocess(step)
+        self.detect_text = step.get("detect_text")
+        return self
+
+    def run(self, ctx):
+        region = ctx.bbox(self.region) or ctx.region
+
+        screenshot = capture_screen(region, backend=ctx.backend)
+        if screenshot is None:
+            return True
+
+        # Archiving is optional and happens off the automation thread
+        if self.save:
+            get_screenshot_archive().save(screenshot, patient=ctx.csv_value, step=self.index,
+                                          run=ctx.run_id, sequence=ctx.sequence, region=region)
+            if ctx.debug:
+                print("Screenshot queued for the archive")
+
+        # If OCR is requested, extract text from the in-memory capture
+        if self.ocr:
+            # Full-screen captures only OCR the detected text areas
+            detect_text = self.detect_text if self.detect_text is not None else region is None
+            read = ocr_detected_data if detect_text else ocr_data
+            try:
+                data = ctx.watcher.reuse(
+                    region, screenshot, ("ocr_data", repr(self.preprocess), bool(detect_text)),
+                    lambda: read(screenshot, self.preprocess, ocr_engine=ctx.ocr_engine))
+            except Exception as e:
+                print(f"Error extracting text: {str(e)}")
+                return True
+            text = data_text(data)
+
+            # Store the text and word boxes, in screen coordinates, with the run's other results
+            if region:
+                data = map_ocr_boxes(data, 1.0, region[0], region[1])
+            get_ocr_store().record(text, data, run=ctx.run_id, row=ctx.row, step=self.index,
+                                   patient=ctx.csv_value, sequence=ctx.sequence, region=region)
+
+            if ctx.debug:
+                print("OCR results queued for the results store")
+                print(f"Extracted text: {text[:100]}..." if len(text) > 100 else text)
+        return True
+
+    def ocr_targets(self, ctx, region=None):
+        if self.region:
+            if self.region.anchor:
+                return []
+            region = ctx.bbox(self.region)
+        if self.ocr and region and not self.detect_text:
+            return [(region, "image_to_data", self.preprocess)]
+        return []
+
+
+class CsvInputStep(Step):
+    __slots__ = ("delay", "column", "format", "csv_fields")
+    type_name = "csv_input"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.delay = _number(step, "delay", 0, minimum=0)
+        # Type one named column, a "{col} {other}" format, or the whole line
+        self.column = _text(step, "column", required=False)
+        self.format = _text(step, "format", required=False)
+        if self.format:
+            self.csv_fields = frozenset(_csv_fields(self.format))
+        elif self.column:
+            self.csv_fields = frozenset([self.column])
+        else:
+            self.csv_fields = frozenset()
+        return self
+
+    def run(self, ctx):
+        if ctx.csv_value is None:
+            print("Error: CSV file not provided for csv_input step")
+            return False
+        try:
+            if self.format:
+                value = ctx.format(self.format)
+            elif self.column:
+                value = ctx.format("{" + self.column + "}")
+            else:
+                value = ctx.csv_value
+        except SequenceError as e:
+            print(f"Error: {str(e)}")
+            return False
+        if ctx.debug:
+            print(f"Inputting ID from CSV: {value}")
+        # Type the value
+        ctx.backend.type_text(str(value))
+        if self.delay:
+            time.sleep(self.delay)
+        return True
+
+
+class TypeStep(Step):
+    __slots__ = ("text", "csv_fields", "literal")
+    type_name = "type"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.text = _text(step, "text")
+        self.literal = False
+        try:
+            self.csv_fields = frozenset(_csv_fields(self.text))
+        except SequenceError as e:
+            # Older sequences type text like "a{b" as is; keep running them
+            logging.warning(f"Step {index}: {e}; typing the text as written")
+            self.csv_fields = frozenset()
+            self.literal = True
+        return self
+
+    def run(self, ctx):
+        if self.literal:
+            text = self.text
+        elif self.csv_fields:
+            try:
+                text = ctx.format(self.text)
+            except SequenceError as e:
+                print(f"Error: {str(e)}")
+                return False
+        else:
+            # Only turns {{ and }} back into single braces
+            text = self.text.format()
+        if ctx.debug:
+            print(f"Typing '{text}'")
+        ctx.backend.type_text(text)
+        return True
+
+
+class RegionStep(Step):
+    __slots__ = ("region",)
+    type_name = "region"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.region = _region(step, "coordinates")
+        if self.region is None:
+            raise SequenceError("'coordinates' is required")
+        return self
+
+    def run(self, ctx):
+        # Later steps without their own region work inside this one
+        if ctx.debug:
+            print(f"Region of interest set to {self.region}")
+        ctx.region = ctx.bbox(self.region)
+        return True
+
+
+class ImageStep(Step):
+    __slots__ = ("click", "template", "region", "fallback_text", "threshold", "scales", "fuzzy",
+                 "preprocess", "required", "click_type")
+    type_name = "image_find"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.click = step["type"] == "image_click"
+        self.template = _text(step, "template")
+        self.region = _region(step)
+        self.fallback_text = _text(step, "fallback_text", required=False)
+        self.threshold = _number(step, "threshold")
+        self.scales = step.get("scales")
+        if self.scales is not None:
+            if not isinstance(self.scales, list) or not all(isinstance(s, (int, float)) and s > 0
+                                                             for s in self.scales):
+                raise SequenceError("'scales' must be a list of positive numbers")
+            self.scales = tuple(self.scales)
+        self.fuzzy = bool(step.get("fuzzy", True))
+        self.preprocess = _preprocess(step)
+        self.required = bool(step.get("required", False))
+        self.click_type = step.get("click_type", "single")
+        # Load the template pyramid now so a missing file fails at load time
+        try:
+            get_template_matcher().pyramid(self.template, self.scales)
+        except FileNotFoundError as e:
+            raise SequenceError(str(e))
+        return self
+
+    def run(self, ctx):
+        region = ctx.bbox(self.region) or ctx.region
+        if ctx.debug:
+            print(f"Looking for template {self.template} in region {region}")
+        box = image_find(self.template, region, fallback_text=self.fallback_text,
+                         threshold=self.threshold, scales=self.scales, fuzzy=self.fuzzy,
+                         preprocess=self.preprocess, backend=ctx.backend, ocr_engine=ctx.ocr_engine)
+        if box is None:
+            print(f"Warning: Could not find template {self.template} in specified region")
+            return not self.required
+        if self.click:
+            ctx.backend.click((box[0] + box[2]) // 2, (box[1] + box[3]) // 2,
+                              self.click_type, duration=0.3)
+        return True
+
+
+class WaitForStep(Step):
+    __slots__ = ("condition", "region", "text", "timeout", "interval", "stable_time", "threshold",
+                 "preprocess", "required")
+    type_name = "wait_for"
+
+    @classmethod
+    def from_dict(cls, step, index):
+        self = cls(index)
+        self.condition = step["type"][len("wait_for_"):]
+        self.region = _region(step)
+        self.text = _text(step, "text", required=self.condition == "text")
+        self.timeout = _number(step, "timeout", WAIT_TIMEOUT, minimum=0)
+        self.interval = _number(step, "interval", WAIT_INTERVAL, minimum=0)
+        self.stable_time = _number(step, "stable_time", WAIT_STABLE_TIME, minimum=0)
+        self.threshold = _number(step, "threshold", WAIT_DIFF_THRESHOLD, minimum=0)
+        self.preprocess = _preprocess(step)
+        self.required = bool(step.get("required", False))
+        return self
+
+    def run(self, ctx):
+        region = ctx.bbox(self.region) or ctx.region
+        if ctx.debug:
+            print(f"Waiting for {self.condition} in region {region}...")
+        baseline, ctx.baseline = ctx.baseline, None
+        met = wait_for(self.condition, region, text=self.text, timeout=self.timeout,
+                       interval=self.interval, stable_time=self.stable_time,
+                       threshold=self.threshold, baseline=baseline, preprocess=self.preprocess,
+                       backend=ctx.backend, ocr_engine=ctx.ocr_engine, watcher=ctx.watcher)
+        if not met:
+            print(f"Warning: Timed out waiting for {self.condition} in region {region}")
+            return not self.required
+        return True
+
+    async def run_async(self, ctx):
+        region = ctx.bbox(self.region) or ctx.region
+        if ctx.debug:
+            print(f"Waiting for {self.condition} in region {region}...")
+        baseline, ctx.baseline = ctx.baseline, None
+        met = await wait_for_async(self.condition, region, text=self.text, timeout=self.timeout,
+                                   interval=self.interval, stable_time=self.stable_time,
+                                   threshold=self.threshold, baseline=baseline,
+                                   preprocess=self.preprocess, backend=ctx.backend,
+                                   ocr_engine=ctx.ocr_engine, watcher=ctx.watcher)
+        if not met:
+            print(f"Warning: Timed out waiting for {self.condition} in region {region}")
+            return not self.required
+        return True
+
+    def ocr_targets(self, ctx, region=None):
+        if self.region:
+            if self.region.anchor:
+                return []
+            region = ctx.bbox(self.region)
+        if self.condition == "text" and region:
+            return [(region, "image_to_string", self.preprocess)]
+        return []
+
+
+# Sequence step types and the classes that compile them
+STEP_TYPES = {
+    "wait": WaitStep,
+    "click": ClickStep,
+    "ocr_click": OcrClickStep,
+    "screenshot": ScreenshotStep,
+    "csv_input": CsvInputStep,
+    "type": TypeStep,
+    "region": RegionStep,
+    "image_find": ImageStep,
+    "image_click": ImageStep,
+    "wait_for_text": WaitForStep,
+    "wait_for_change": WaitForStep,
+    "wait_for_stable": WaitForStep,
+}
+
+
+class SequencePlan:
+    """A compiled sequence: validated step objects ready to run for every row"""
+    __slots__ = ("name", "steps", "uses_csv", "csv_columns")
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = steps
+        self.uses_csv = any(isinstance(s, CsvInputStep) or s.csv_fields for s in steps)
+        # Named columns referenced by the steps; if any, the CSV needs a header row
+        self.csv_columns = frozenset().union(*(s.csv_fields for s in steps))
+
+    def run(self, backend=None, ocr_engine=None, debug=False, csv_value=None, csv_columns=None,
+            on_step=None, run_id=None, row=None):
+        """Execute the plan once; returns False if a step stopped the run
+
+        on_step, if given, is called with each step's position and the run
+        context before the step runs.
+        run_id and row label what the steps store; rows of one CSV pass
+        share a run_id.
+        """
+        ctx = RunContext(backend or get_backend(), ocr_engine or get_ocr_engine(), debug,
+                         csv_value, csv_columns, self.name, run_id, row)
+        with trace_span(self.name, "sequence"):
+            for position, step in enumerate(self.steps):
+                if on_step is not None:
+                    on_step(position, ctx)
+                if debug:
+                    print(f"Step {step.index}: {step.describe()}")
+                with trace_span(f"step {step.index}: {step.type_name}", "step"):
+                    try:
+                        # Snapshot the region a following wait_for_change step watches, so
+                        # the change this step causes is measured against the screen before it
+                        if step.baseline_for is not None:
+                            watched = ctx.bbox(step.baseline_for.region) or ctx.region
+                            ctx.baseline = frame_signature(ctx.backend.grab(watched))
+                        completed = step.run(ctx)
+                    except SequenceError as e:
+                        print(f"Error: Step {step.index} ({step.type_name}): {e}")
+                        completed = False
+                    if not completed:
+                        trace_attrs(stopped=True)
+                        return False
+        return True
+
+    async def run_async(self, backend=None, ocr_engine=None, debug=False, csv_value=None,
+                        csv_columns=None, run_id=None, row=None):
+        """Awaitable run(); waits yield to the event loop instead of sleeping
+
+        The backend is wrapped in a CancellableBackend, so cancelling the run
+        (e.g. run_sequence_async's timeout) also stops the input of a step
+        that is still running on its worker thread.
+        """
+        backend = CancellableBackend(backend or get_backend())
+        ctx = RunContext(backend, ocr_engine or get_ocr_engine(), debug,
+                         csv_value, csv_columns, self.name, run_id, row)
+        with trace_span(self.name, "sequence"):
+            for step in self.steps:
+                if debug:
+                    print(f"Step {step.index}: {step.describe()}")
+                with trace_span(f"step {step.index}: {step.type_name}", "step"):
+                    try:
+                        if step.baseline_for is not None:
+                            watched = ctx.bbox(step.baseline_for.region) or ctx.region
+                            ctx.baseline = await run_in_session(
+                                ctx.backend, lambda: frame_signature(ctx.backend.grab(watched)))
+                        completed = await step.run_async(ctx)
+                    except SequenceError as e:
+                        print(f"Error: Step {step.index} ({step.type_name}): {e}")
+                        completed = False
+                    if not completed:
+                        trace_attrs(stopped=True)
+                        return False
+        return True
+
+
+# Step types whose regions the recorder used to save as [x, y, width, height]
+LEGACY_XYWH_STEPS = ("screenshot", "ocr_click")
+
+def merge_ocr_regions(steps):
+    """Give runs of consecutive ocr_click steps with overlapping regions one capture box
+
+    Each step in a run captures the union of the run's regions, so while
+    the screen stays unchanged the run's lookups share one capture and one
+    WordIndex (through the run's RegionWatcher) instead of OCRing each
+    region separately.
+    """
+    def mergeable(step):
+        return isinstance(step, OcrClickStep) and step.region and not step.region.anchor \
+            and not step.detect_text
+
+    run, union = [], None
+    for step in steps + [None]:
+        if step is not None and mergeable(step) and run and \
+                step.preprocess == run[0].preprocess and step.region.intersects(union):
+            run.append(step)
+            union = union.union(step.region)
+            continue
+        if len(run) > 1:
+            for member in run:
+                member.capture_region = union
+        run, union = ([step], step.region) if step is not None and mergeable(step) else ([], None)
+
+def compile_sequence(sequence):
+    """Validate a sequence dict and compile it into a SequencePlan
+
+    Raises SequenceError naming the first unsupported or malformed step.
+    Output directories are created here, once, rather than on every run.
+    """
+    if not isinstance(sequence, dict) or not isinstance(sequence.get("steps", []), list):
+        raise SequenceError("A sequence must be an object with a list of steps")
+    # Sequences recorded before region_format existed saved screenshot and
+    # ocr_click regions as [x, y, width, height]
+    legacy_regions = sequence.get("region_format", "legacy") != "bbox"
+
+    steps = []
+    for index, raw in enumerate(sequence.get("steps", []), 1):
+        if not isinstance(raw, dict):
+            raise SequenceError(f"Step {index}: expected an object, got {raw!r}")
+        step_type = raw.get("type")
+        step_class = STEP_TYPES.get(step_type)
+        if step_class is None:
+            raise SequenceError(f"Step {index}: unsupported step type {step_type!r}")
+        try:
+            if legacy_regions and step_type in LEGACY_XYWH_STEPS and \
+                    isinstance(raw.get("region"), (list, tuple)):
+                try:
+                    raw = dict(raw, region=Region.coerce(raw["region"], "xywh"))
+                except (TypeError, ValueError) as e:
+                    raise SequenceError(f"'region' must be [x, y, width, height], "
+                                        f"got {raw['region']!r} ({e})")
+            steps.append(step_class.from_dict(raw, index))
+        except SequenceError as e:
+            raise SequenceError(f"Step {index} ({step_type}): {e}")
+
+    for step, following in zip(steps, steps[1:]):
+        if isinstance(following, WaitForStep) and following.condition == "change":
+            step.baseline_for = following
+    merge_ocr_regions(steps)
+
+    return SequencePlan(sequence.get("name", "Unnamed Sequence"), steps)
+
+def run_sequence(sequence, debug=False, csv_file=None, csv_row=0, backend=None, ocr_engine=None):
+    """Run an automation sequence (a sequence dict or a compiled SequencePlan)"""
     if not sequence:
         print("No sequence provided")
         return False
     
-    print(f"Running sequence: {sequence.get('name', 'Unnamed Sequence')}")
-    
-    # Create screenshots directory if needed
-    screenshots_dir = "screenshots"
-    if not os.path.exists(screenshots_dir):
-        os.makedirs(screenshots_dir)
+    if not isinstance(sequence, SequencePlan):
+        try:
+            sequence = compile_sequence(sequence)
+        except SequenceError as e:
+            print(f"Invalid sequence: {str(e)}")
+            return False
     
-    # Create results directory if OCR is used
-    results_dir = "ocr_results"
-    if not os.path.exists(results_dir):
-        os.makedirs(results_dir)
+    print(f"Running sequence: {sequence.name}")
     
-    # Load CSV data if provided
-    csv_data = None
+    # Read just the requested CSV row if provided
+    csv_value = csv_columns = None
     if csv_file:
         try:
-            with open(csv_file, 'r') as f:
-                # Read all lines and strip whitespace
-                csv_data = [line.strip() for line in f if line.strip()]
-                if csv_row >= len(csv_data):
-                    print("CSV row index out of range")
-                    return False
+            rows = iter_csv_rows(csv_file, header=bool(sequence.csv_columns))
+            row = next(itertools.islice(rows, csv_row, None), None)
+            rows.close()
+            if row is None:
+                print("CSV row index out of range")
+                return False
+            csv_value, csv_columns = row
         except Exception as e:
             print(f"Error loading CSV file: {str(e)}")
             return False
     
-    step_num = 1
-    for step in sequence.get("steps", []):
-        step_type = step.get("type", "")
-        
-        if debug:
-            print(f"Step {step_num}: {step_type} - {step}")
-        
-        if step_type == "wait":
-            duration = step.get("duration", 1)
-            if debug:
-                print(f"Waiting for {duration} seconds...")
-            time.sleep(duration)
-            
-        elif step_type == "click":
-            x, y = step.get("x", 0), step.get("y", 0)
-            click_type = step.get("click_type", "single")
-            
-            if debug:
-                print(f"Moving to {x},{y} for {click_type} click...")
-            
-            # Move mouse to position
-            pyautogui.moveTo(x, y, duration=0.5)
-            
-            # Perform the click based on type
-            if click_type == "single":
-                pyautogui.click()
-            elif click_type == "double":
-                pyautogui.doubleClick()
-            elif click_type == "right":
-                pyautogui.rightClick()
-            
-        elif step_type == "ocr_click":
-            region = step.get("region")
-            target_word = step.get("target_word")
-            fuzzy = step.get("fuzzy", False)
-            
-            if debug:
-                print(f"Looking for text '{target_word}' in region {region}")
-            
-            if not click_on_word(target_word, region, fuzzy):
-                print(f"Warning: Could not find text '{target_word}' in specified region")
-            
-        elif step_type == "screenshot":
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = os.path.join(screenshots_dir, f"screenshot_{timestamp}.png")
-            
-            region = None
-            if "region" in step:
-                region = tuple(step["region"])
-            
-            screenshot_path = take_screenshot(filename, region)
-            
-            # If OCR is requested, extract text
-            if step.get("ocr", False) and screenshot_path:
-                text = extract_text_from_screenshot(screenshot_path)
-                
-                # Save the extracted text
-                text_filename = os.path.join(results_dir, f"ocr_{timestamp}.json")
-                with open(text_filename, 'w', encoding='utf-8') as f:
-                    json.dump({"extracted_text": text}, f, indent=2)
-                
-                if debug:
-                    print(f"OCR results saved to {text_filename}")
-                    print(f"Extracted text: {text[:100]}..." if len(text) > 100 else text)
-        
-        elif step_type == "csv_input":
-            if not csv_data:
-                print("Error: CSV file not provided for csv_input step")
-                return False
-                
-            value = csv_data[csv_row]
-            if debug:
-                print(f"Inputting ID from CSV: {value}")
-                
-            # Type the value
-            pyautogui.write(str(value))
-            time.sleep(0.5)  # Small delay after typing
-        
-        step_num += 1
+    # csv_row counts from 0; stored results number rows from 1, as run_sequence_csv does
+    if not sequence.run(backend, ocr_engine, debug, csv_value, csv_columns,
+                        row=csv_row + 1 if csv_file else None):
+        return False
     
     print("Sequence completed")
     return True
 
+async def run_sequence_async(sequence, debug=False, csv_value=None, csv_columns=None,
+                             backend=None, ocr_engine=None, timeout=None):
+    """Awaitable run_sequence for use inside an asyncio event loop
+
+    Takes the CSV row directly (see iter_csv_rows) rather than a file, so an
+    orchestrator can hand rows out to many concurrent sessions. Waits use
+    asyncio.sleep and OCR runs on the engine's worker threads, so cancelling
+    the task stops the run at the next step boundary or poll; a step still
+    running on a worker thread has its remaining input refused and is waited
+    for. With timeout, a run that takes longer is cancelled and reported as
+    failed.
+    """
+    if not sequence:
+        print("No sequence provided")
+        return False
+
+    if not isinstance(sequence, SequencePlan):
+        try:
+            sequence = compile_sequence(sequence)
+        except SequenceError as e:
+            print(f"Invalid sequence: {str(e)}")
+            return False
+
+    print(f"Running sequence: {sequence.name}")
+    try:
+        completed = await asyncio.wait_for(
+            sequence.run_async(backend, ocr_engine, debug, csv_value, csv_columns), timeout)
+    except asyncio.TimeoutError:
+        print(f"Sequence timed out after {timeout} seconds")
+        return False
+    if not completed:
+        return False
+
+    print("Sequence completed")
+    return True
+
+def iter_csv_rows(csv_file, header=False):
+    """Stream (value, columns) pairs from a CSV file, one row at a time
+
+    Without a header every non-empty line is a row: value is the stripped
+    line, as typed by a plain csv_input step, and columns is None. With a
+    header, columns maps the header names to the row's values and value is
+    the first column.
+    """
+    with open(csv_file, 'r', newline='') as f:
+        if not header:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line, None
+            return
+        
+        reader = csv.reader(f)
+        names = [name.strip() for name in next(reader, [])]
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            values = [cell.strip() for cell in row]
+            yield (values[0] if values else ''), dict(zip(names, values))
+
+def run_sequence_csv(sequence, csv_file, debug=False, backend=None, ocr_engine=None,
+                     start_row=0, row_delay=0, journal=None, resume=False):
+    """Run a sequence once per CSV row, streaming the file
+
+    Only the current row is held in memory. Sequences that reference named
+    columns read the first line as the header. A CheckpointJournal, if
+    given, records each row's outcome by row number; with resume, rows it
+    records as successful are skipped (and counted as successful), and
+    without it the previous journal is rotated aside.
+    Returns (succeeded, rows run).
+    """
+    if not isinstance(sequence, SequencePlan):
+        sequence = compile_sequence(sequence)
+    if sequence.csv_columns:
+        # Check the header once instead of failing on every row
+        with open(csv_file, 'r', newline='') as f:
+            header = {name.strip() for name in next(csv.reader(f), [])}
+        missing = sequence.csv_columns - header
+        if missing:
+            raise SequenceError(f"CSV is missing column(s): {', '.join(sorted(missing))}")
+    
+    succeeded = total = 0
+    completed = journal.completed_ids() if journal is not None and resume else set()
+    if journal is not None:
+        journal.start(resume)
+    run_id = new_run_id()
+    rows = iter_csv_rows(csv_file, header=bool(sequence.csv_columns))
+    for row_num, (value, columns) in enumerate(rows, 1):
+        if row_num <= start_row:
+            continue
+        total += 1
+        if str(row_num) in completed:
+            succeeded += 1
+            continue
+        print(f"\nProcessing row {row_num}")
+        if sequence.run(backend, ocr_engine, debug, value, columns, run_id=run_id, row=row_num):
+            succeeded += 1
+            status = "Success"
+        else:
+            print(f"Row {row_num} did not complete")
+            status = "Failed"
+        if journal is not None:
+            journal.record(str(row_num), status, value)
+        if row_delay:
+            time.sleep(row_delay)
+    if get_tracer() is not None:
+        get_tracer().log_summary()
+    return succeeded, total
+
+class PipelineCancelled(Exception):
+    """Raised inside a pipelined run after PipelinedExecutor.cancel()"""
+
+
+class FrameRing:
+    """Ring buffer of the most recent captured frames for each watched region"""
+
+    def __init__(self, size=4):
+        self.size = size
+        self.frames = {}
+        self.cond = threading.Condition()
+
+    def put(self, region, frame, signature):
+        with self.cond:
+            ring = self.frames.setdefault(region, deque(maxlen=self.size))
+            ring.append((time.monotonic(), frame, signature))
+            self.cond.notify_all()
+
+    def latest(self, region):
+        """Return the newest (timestamp, frame, signature) for a region, or None"""
+        with self.cond:
+            ring = self.frames.get(region)
+            return ring[-1] if ring else None
+
+    def wait_newer(self, region, after, timeout):
+        """Wait for a frame of region captured after a monotonic timestamp"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                ring = self.frames.get(region)
+                if ring and ring[-1][0] > after:
+                    return ring[-1]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    def drop(self, region):
+        with self.cond:
+            self.frames.pop(region, None)
+
+
+class PipelinedBackend(ScreenBackend):
+    """Backend proxy that queues input on the executor's input thread
+
+    Input calls return immediately. A capture first waits for queued input
+    to finish, then serves a ring-buffer frame taken after that input when
+    the region is being watched, or captures directly otherwise.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.backend = executor.backend
+
+    def capture(self, region=None):
+        executor = self.executor
+        executor.barrier()
+        if region in executor.watched:
+            entry = executor.ring.wait_newer(region, executor.last_input_done,
+                                             executor.capture_interval * 4)
+            if entry is not None:
+                return entry[1].copy()
+        return self.backend.capture(region)
+
+    def move_to(self, x, y, duration=0.0):
+        self.executor.submit_input(self.backend.move_to, x, y, duration)
+
+    def click(self, x=None, y=None, click_type="single", duration=0.0):
+        self.executor.submit_input(self.backend.click, x, y, click_type, duration)
+
+    def type_text(self, text):
+        self.executor.submit_input(self.backend.type_text, text)
+
+    def press(self, key):
+        self.executor.submit_input(self.backend.press, key)
+
+    def hotkey(self, *keys):
+        self.executor.submit_input(self.backend.hotkey, *keys)
+
+    def position(self):
+        return self.backend.position()
+
+    def screen_size(self):
+        return self.backend.screen_size()
+
+
+class PipelinedExecutor:
+    """Run compiled sequences with capture, OCR and input overlapped
+
+    A capture thread keeps a ring buffer of frames for the regions the next
+    steps will read. Once a region's frame stops changing its OCR is run
+    ahead of time on the engine's workers, filling the OCR cache, so the
+    step itself usually gets a cache hit. Input actions run in order on an
+    input thread behind a bounded queue. cancel() stops all three stages.
+
+    Prefetched results go to the executor's own OCRCache (cache, or a new
+    one), which OCR calls made during run() use instead of the engine's, so
+    the shared engine's cache settings are left alone.
+    """
+
+    def __init__(self, backend=None, ocr_engine=None, capture_interval=0.05, ring_size=4,
+                 max_pending_inputs=8, lookahead=2, stable_threshold=WAIT_DIFF_THRESHOLD,
+                 cache=None):
+        self.backend = backend or get_backend()
+        self.ocr_engine = ocr_engine or get_ocr_engine()
+        # Prefetched OCR results are handed to steps through this cache
+        self.cache = cache or OCRCache()
+        self.capture_interval = capture_interval
+        self.lookahead = lookahead
+        self.stable_threshold = stable_threshold
+        self.ring = FrameRing(ring_size)
+        self.inputs = queue.Queue(maxsize=max_pending_inputs)
+        self.watched = {}
+        self.prefetched = set()
+        self.pending_ocr = set()
+        self.last_input_done = 0.0
+        self.cancelled = threading.Event()
+        self.proxy = PipelinedBackend(self)
+        self._outstanding = 0
+        self._idle = threading.Condition()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Start the capture and input threads"""
+        if self._threads:
+            return
+        self.cancelled.clear()
+        for target, name in ((self._capture_loop, "pipeline-capture"), (self._input_loop, "pipeline-input")):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Finish queued input and stop the threads"""
+        if not self._threads:
+            return
+        if not self.cancelled.is_set():
+            self.barrier()
+        self.cancelled.set()
+        self.inputs.put(None)
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+    def cancel(self):
+        """Cancel the run: queued input is dropped and pending OCR prefetches cancelled"""
+        self.cancelled.set()
+        with self._lock:
+            for future in self.pending_ocr:
+                future.cancel()
+        with self._idle:
+            self._idle.notify_all()
+
+    def submit_input(self, fn, *args):
+        """Queue an input action; blocks only when the input queue is full"""
+        if self.cancelled.is_set():
+            raise PipelineCancelled()
+        with self._idle:
+            self._outstanding += 1
+        self.inputs.put((fn, args))
+
+    def barrier(self):
+        """Wait until all queued input has been delivered"""
+        with self._idle:
+            while self._outstanding and not self.cancelled.is_set():
+                self._idle.wait(0.1)
+        if self.cancelled.is_set():
+            raise PipelineCancelled()
+
+    def watch(self, region, method=None, preprocess=None):
+        """Keep capturing a region, and prefetch its OCR if method is given"""
+        with self._lock:
+            targets = self.watched.setdefault(region, [])
+            if method and (method, preprocess) not in targets:
+                targets.append((method, preprocess))
+
+    def unwatch_all(self):
+        with self._lock:
+            for region in self.watched:
+                self.ring.drop(region)
+            self.watched = {}
+
+    def _input_loop(self):
+        while True:
+            item = self.inputs.get()
+            if item is None:
+                break
+            fn, args = item
+            try:
+                if not self.cancelled.is_set():
+                    fn(*args)
+            except Exception as e:
+                logging.error(f"Input action failed: {str(e)}")
+                self.cancel()
+            finally:
+                self.last_input_done = time.monotonic()
+                with self._idle:
+                    self._outstanding -= 1
+                    self._idle.notify_all()
+
+    def _capture_loop(self):
+        # Prefetches are submitted from this thread's context
+        _scoped_ocr_cache.set(self.cache)
+        while not self.cancelled.is_set():
+            with self._lock:
+                watched = list(self.watched.items())
+            for region, targets in watched:
+                try:
+                    frame = self.backend.capture(region)
+                except Exception as e:
+                    logging.warning(f"Pipeline capture failed: {str(e)}")
+                    continue
+                signature = frame_signature(frame)
+                previous = self.ring.latest(region)
+                self.ring.put(region, frame, signature)
+                # Pre-OCR once the region has stopped changing and no input is pending
+                if targets and previous is not None and not self._outstanding \
+                        and frame_diff(signature, previous[2]) <= self.stable_threshold:
+                    self._prefetch(region, frame, signature, targets)
+            self.cancelled.wait(self.capture_interval)
+
+    def _prefetch(self, region, frame, signature, targets):
+        digest = hashlib.blake2b(signature.tobytes(), digest_size=8).digest()
+        for method, preprocess in targets:
+            key = (region, method, json.dumps(preprocess, sort_keys=True), digest)
+            with self._lock:
+                if key in self.prefetched or len(self.pending_ocr) >= self.ocr_engine.workers:
+                    continue
+                self.prefetched.add(key)
+            processed, _ = preprocess_image(frame, preprocess)
+            future = self.ocr_engine.submit(method, processed)
+            with self._lock:
+                self.pending_ocr.add(future)
+            future.add_done_callback(self._prefetch_done)
+
+    def _prefetch_done(self, future):
+        with self._lock:
+            self.pending_ocr.discard(future)
+
+    def _watch_ahead(self, plan, position, ctx):
+        """Watch the regions read by the next few steps
+
+        Regions the upcoming steps still read keep their ring frames, so
+        their stability is not measured from scratch; only regions no
+        longer read are dropped.
+        """
+        wanted = {}
+        region = ctx.region
+        for step in plan.steps[position:position + 1 + self.lookahead]:
+            try:
+                if isinstance(step, RegionStep):
+                    region = None if step.region.anchor else ctx.bbox(step.region)
+                    continue
+                targets = step.ocr_targets(ctx, region)
+            except SequenceError:
+                continue
+            for bbox, method, preprocess in targets:
+                reads = wanted.setdefault(bbox, [])
+                if (method, preprocess) not in reads:
+                    reads.append((method, preprocess))
+        with self._lock:
+            for bbox in self.watched.keys() - wanted.keys():
+                self.ring.drop(bbox)
+            self.watched = wanted
+
+    def run(self, sequence, debug=False, csv_value=None, csv_columns=None):
+        """Run a sequence (dict or SequencePlan) once through the pipeline"""
+        plan = sequence if isinstance(sequence, SequencePlan) else compile_sequence(sequence)
+        self.start()
+        token = _scoped_ocr_cache.set(self.cache)
+        try:
+            return plan.run(self.proxy, self.ocr_engine, debug, csv_value, csv_columns,
+                            on_step=lambda position, ctx: self._watch_ahead(plan, position, ctx))
+        except PipelineCancelled:
+            print("Sequence cancelled")
+            return False
+        finally:
+            _scoped_ocr_cache.reset(token)
+            self.stop()
+            self.unwatch_all()
+            self.prefetched.clear()
+
 def get_current_mouse_position():
     """Get and display the current mouse position"""
     print("Press Ctrl+C to stop")
     try:
         while True:
-            x, y = pyautogui.position()
+            x, y = get_backend().position()
             position_str = f'Current mouse position: X: {x}, Y: {y}'
             print(position_str, end='\r')
             time.sleep(0.1)
     except KeyboardInterrupt:
         print("\nDone recording mouse position")
 
-def click_on_word(word, region=None, fuzzy=False):
-    """Click on a word found via OCR in the specified region"""
-    screenshot = ImageGrab.grab(bbox=region) if region else ImageGrab.grab()
-    data = pytesseract.image_to_data(screenshot, output_type=Output.DICT)
+def find_word_in_data(data, word, fuzzy=False):
+    """Return the centre (x, y) of the best OCR'd match for a word or phrase, or None"""
+    match = WordIndex(data).find(word, fuzzy)
+    return box_center(match["box"]) if match else None
+
+def click_on_word(word, region=None, fuzzy=False, backend=None, ocr_engine=None, preprocess=None,
+                  detect_text=False, watcher=None, capture_region=None):
+    """Click on a word or phrase found via OCR in the specified region
+
+    Exact matches win; with fuzzy, a word containing the target comes next,
+    then the best scoring phrase candidate at or above FUZZY_MIN_SCORE. Returns the clicked match
+    ({"text", "score", "conf", "box"}, box in screen coordinates) or None.
+
+    The capture is OCR'd once into a WordIndex; with a RegionWatcher the
+    index is reused for every lookup while the region's pixels have not
+    moved. capture_region, a box enclosing region, is captured and indexed
+    instead of region so lookups in overlapping regions share one OCR pass;
+    only matches inside region count.
+
+    With detect_text the capture is split into detected text areas, which
+    are OCR'd in parallel, closest to the word's expected width first,
+    stopping at the first match.
+    """
+    region = as_bbox(region)
+    with trace_span("click_on_word", "ocr", word=word, region=region):
+        backend = backend or get_backend()
+        if detect_text or not region:
+            capture_region = None
+        capture = capture_region or region
+        screenshot = backend.capture(capture)
+
+        if detect_text:
+            def locate():
+                boxes = rank_regions_for_text(detect_text_regions(screenshot), word)
+                for _, data in iter_region_ocr(screenshot, boxes, preprocess=preprocess,
+                                               ocr_engine=ocr_engine):
+                    match = WordIndex(data).find(word, fuzzy)
+                    if match:
+                        return match
+                return None
+
+            if watcher is not None:
+                match = watcher.reuse(capture, screenshot,
+                                      ("click_on_word", word, fuzzy, repr(preprocess)), locate)
+            else:
+                match = locate()
+        else:
+            build = lambda: WordIndex.from_image(screenshot, preprocess, ocr_engine=ocr_engine)
+            if watcher is not None:
+                index = watcher.reuse(capture, screenshot, ("word_index", repr(preprocess)), build)
+            else:
+                index = build()
+            within = None
+            if capture_region:
+                within = (region[0] - capture[0], region[1] - capture[1],
+                          region[2] - capture[0], region[3] - capture[1])
+            match = index.find(word, fuzzy, within=within)
+
+        if match is None:
+            return None
+        if capture:
+            x1, y1, x2, y2 = match["box"]
+            match = dict(match, box=(capture[0] + x1, capture[1] + y1, capture[0] + x2, capture[1] + y2))
+        trace_attrs(match=match["text"], score=round(match["score"], 3))
+        x, y = box_center(match["box"])
+        backend.click(x, y, duration=0.3)
+        return match
+
+# Default OCR configurations compared by run_benchmark
+BENCHMARK_CONFIGS = [
+    {"name": "default", "config": "", "preprocess": None, "cache": False},
+    {"name": "psm6_fast", "config": "--psm 6", "preprocess": "fast", "cache": False},
+    {"name": "default_cached", "config": "", "preprocess": None, "cache": True},
+]
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values by linear interpolation"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+def summarize_timings(values):
+    """Summarise a list of durations in seconds"""
+    return {
+        "n": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": max(values) if values else 0.0,
+    }
+
+def git_revision():
+    """Return the current git commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmark(corpus_dir, sequence=None, words=None, configs=None, repeat=3, output=None):
+    """Benchmark the OCR and sequence hot paths against stored screenshots
+
+    Each configuration ({"name", "config", "preprocess", "cache", "workers"})
+    gets a fresh OCREngine and a ReplayBackend over the corpus PNGs, then
+    times take_screenshot, extract_text_from_screenshot and click_on_word
+    for every frame, and the whole sequence (if given) repeat times.
+    Screenshots and OCR results the sequence stores go to a scratch
+    directory that is deleted afterwards, and are written out between
+    runs rather than during the next one. Returns the report and writes it
+    as JSON to output if given.
+    """
+    global _screenshot_archive, _ocr_store
+    configs = configs or BENCHMARK_CONFIGS
+    if words is None:
+        words_path = os.path.join(corpus_dir, 'words.txt')
+        if os.path.exists(words_path):
+            with open(words_path, 'r', encoding='utf-8') as f:
+                words = [line.strip() for line in f if line.strip()]
+        else:
+            words = ["Insurance", "Submit", "Claim"]
+    frame_count = len([f for f in os.listdir(corpus_dir) if f.lower().endswith('.png')])
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "corpus": os.path.abspath(corpus_dir),
+        "frames": frame_count,
+        "repeat": repeat,
+        "results": [],
+    }
+    previous_backend = _backend
+    previous_stores = (_screenshot_archive, _ocr_store)
+    scratch_dir = tempfile.mkdtemp(prefix="ocr_bench_")
+    try:
+        if sequence:
+            _screenshot_archive = ScreenshotArchive(os.path.join(scratch_dir, "screenshots"))
+            _ocr_store = OCRResultStore(os.path.join(scratch_dir, "ocr_results.db"))
+        for cfg in configs:
+            cache = OCRCache() if cfg.get("cache") else None
+            engine = OCREngine(workers=cfg.get("workers", OCR_WORKERS), cache=cache,
+                               config=cfg.get("config", ""))
+            preprocess = cfg.get("preprocess")
+            timings = {"take_screenshot": [], "extract_text_from_screenshot": [], "click_on_word": []}
+            tracemalloc.start()
+            try:
+                backend = ReplayBackend(corpus_dir, advance_on_input=False)
+                for _ in range(repeat):
+                    for index in range(frame_count):
+                        backend.frame_index = index
+                        start = time.perf_counter()
+                        take_screenshot(os.path.join(scratch_dir, "bench.png"), backend=backend)
+                        timings["take_screenshot"].append(time.perf_counter() - start)
+
+                        frame = backend.capture()
+                        start = time.perf_counter()
+                        extract_text_from_screenshot(frame, ocr_engine=engine, preprocess=preprocess)
+                        timings["extract_text_from_screenshot"].append(time.perf_counter() - start)
+
+                        for word in words:
+                            start = time.perf_counter()
+                            click_on_word(word, fuzzy=True, backend=backend, ocr_engine=engine,
+                                          preprocess=preprocess)
+                            timings["click_on_word"].append(time.perf_counter() - start)
+
+                result = {"name": cfg.get("name", json.dumps(cfg, sort_keys=True)), "settings": cfg}
+                for name, values in timings.items():
+                    result[name] = summarize_timings(values)
+
+                if sequence:
+                    if not isinstance(sequence, SequencePlan):
+                        sequence = compile_sequence(sequence)
+                    steps = len(sequence.steps) or 1
+                    runs = []
+                    calls_before = engine.calls
+                    for _ in range(repeat):
+                        backend = set_backend(ReplayBackend(corpus_dir))
+                        start = time.perf_counter()
+                        run_sequence(sequence, backend=backend, ocr_engine=engine)
+                        runs.append(time.perf_counter() - start)
+                        _screenshot_archive.flush()
+                        _ocr_store.flush()
+                    result["run_sequence"] = summarize_timings(runs)
+                    result["run_sequence"]["per_minute"] = 60.0 / result["run_sequence"]["mean"] \
+                        if result["run_sequence"]["mean"] else 0.0
+                    result["run_sequence"]["ocr_calls_per_step"] = \
+                        (engine.calls - calls_before) / (steps * repeat)
 
-    for i, text in enumerate(data['text']):
-        if not text.strip():
+                result["ocr"] = engine.stats()
+                result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                engine.close()
+            report["results"].append(result)
+            logging.info(f"Benchmark {result['name']}: extract p50 "
+                         f"{result['extract_text_from_screenshot']['p50'] * 1000:.1f}ms, click_on_word p50 "
+                         f"{result['click_on_word']['p50'] * 1000:.1f}ms")
+    finally:
+        for store in (_screenshot_archive, _ocr_store):
+            if store is not None and store not in previous_stores:
+                store.close()
+        _screenshot_archive, _ocr_store = previous_stores
+        set_backend(previous_backend)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Benchmark results saved to {output}")
+    return report
+
+def compare_benchmarks(baseline_path, current_path, metric="p50"):
+    """Print the per-config change in each timing between two benchmark reports"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)["results"]
+
+    rows = []
+    for result in current:
+        before = baseline.get(result["name"])
+        if not before:
             continue
-        match = text.strip().lower()
-        if (match == word.lower()) or (fuzzy and word.lower() in match):
-            x = data['left'][i] + data['width'][i] // 2
-            y = data['top'][i] + data['height'][i] // 2
-            screen_x = region[0] + x if region else x
-            screen_y = region[1] + y if region else y
-            pyautogui.moveTo(screen_x, screen_y, duration=0.3)
-            pyautogui.click()
-            return True
-    return False
+        for name in ("take_screenshot", "extract_text_from_screenshot", "click_on_word", "run_sequence"):
+            if name in result and name in before:
+                old, new = before[name][metric], result[name][metric]
+                change = (new - old) / old * 100 if old else 0.0
+                rows.append((result["name"], name, old, new, change))
+                print(f"{result['name']:<20} {name:<30} {old * 1000:9.1f}ms -> {new * 1000:9.1f}ms "
+                      f"({change:+.1f}%)")
+    return rows
 
 # Global variable for mouse position display thread
 mouse_position_thread = None
@@ -503,7 +5085,7 @@ def display_mouse_position():
     global stop_mouse_thread
     last_pos = None
     while not stop_mouse_thread:
-        x, y = pyautogui.position()
+        x, y = get_backend().position()
         current_pos = (x, y)
         
         # Only update if position changed
@@ -532,7 +5114,7 @@ def print_header(title):
     print("=" * 60)
     print(f"{title:^60}")
     print("=" * 60)
-    print(f"Mouse position: {pyautogui.position()}")
+    print(f"Mouse position: {get_backend().position()}")
     print("-" * 60)
     # Add an extra line for mouse position updates
     print()
@@ -568,7 +5150,7 @@ def get_menu_choice(options, show_back=True):
 
 def record_sequence_menu():
     """Handle sequence recording menu"""
-    sequence = {"name": "New Automation Sequence", "steps": []}
+    sequence = {"name": "New Automation Sequence", "region_format": "bbox", "steps": []}
     step_num = 1
     
     while True:
@@ -576,9 +5158,11 @@ def record_sequence_menu():
         print("Available Commands:")
         print("- x,y          : Click at specific coordinates")
         print("- wait N       : Wait for N seconds")
+        print("- wait_for_text / wait_for_change / wait_for_stable : Wait for the screen")
         print("- screenshot   : Capture screen region")
         print("- ocr_click    : Click on text using OCR")
-        print("- type         : Type text")
+        print("- image_click  : Click on a UI element by its captured image")
+        print("- type         : Type text ({column} inserts a CSV value, {{ and }} type a brace)")
         print("- csv_input    : Input ID from CSV file")
         print("- region       : Define region of interest")
         print("- done        : Finish recording")
@@ -628,12 +5212,40 @@ def record_sequence_menu():
             return
             
         elif command == 'csv_input':
-            sequence["steps"].append({
-                "type": "csv_input"
-            })
+            step = {"type": "csv_input"}
+            column = get_user_input("CSV column to type (or press Enter for the whole row): ").strip()
+            if column:
+                step["column"] = column
+            sequence["steps"].append(step)
             print("Added CSV input step")
             step_num += 1
             
+        elif command in ('wait_for_text', 'wait_for_change', 'wait_for_stable'):
+            step = {"type": command}
+            try:
+                region_input = get_user_input("Enter region (x1,y1,x2,y2) or press Enter for full screen: ").strip()
+                if region_input:
+                    x1, y1, x2, y2 = map(int, region_input.split(','))
+                    step["region"] = [x1, y1, x2, y2]
+                
+                if command == 'wait_for_text':
+                    step["text"] = get_user_input("Enter the text to wait for: ").strip()
+                    if not step["text"]:
+                        print("Text cannot be empty!")
+                        get_user_input("Press Enter to continue...")
+                        continue
+                
+                timeout_input = get_user_input(f"Timeout in seconds (or press Enter for {WAIT_TIMEOUT:g}): ").strip()
+                if timeout_input:
+                    step["timeout"] = float(timeout_input)
+                
+                sequence["steps"].append(step)
+                print(f"Added {command} step")
+                step_num += 1
+            except ValueError:
+                print("Invalid input. Use 'x1,y1,x2,y2' for the region and a number for the timeout")
+                get_user_input("Press Enter to continue...")
+            
         elif command.startswith('wait'):
             try:
                 parts = command.split()
@@ -657,9 +5269,7 @@ def record_sequence_menu():
             if region_input:
                 try:
                     x1, y1, x2, y2 = map(int, region_input.split(','))
-                    width = x2 - x1
-                    height = y2 - y1
-                    step["region"] = [x1, y1, width, height]
+                    step["region"] = list(Region.from_bbox((x1, y1, x2, y2)).bbox)
                 except:
                     print("Invalid region format. Using full screen.")
                     get_user_input("Press Enter to continue...")
@@ -667,6 +5277,9 @@ def record_sequence_menu():
             ocr_input = get_user_input("Extract text with OCR? (y/n): ").strip().lower()
             if ocr_input == 'y':
                 step["ocr"] = True
+                save_input = get_user_input("Also save the image to disk? (y/n): ").strip().lower()
+                if save_input == 'n':
+                    step["save"] = False
             
             sequence["steps"].append(step)
             print("Added screenshot step")
@@ -689,7 +5302,7 @@ def record_sequence_menu():
                 
                 step = {
                     "type": "ocr_click",
-                    "region": [x1, y1, x2-x1, y2-y1],
+                    "region": list(Region.from_bbox((x1, y1, x2, y2)).bbox),
                     "target_word": target_word,
                     "fuzzy": fuzzy_match
                 }
@@ -700,8 +5313,41 @@ def record_sequence_menu():
                 print("Invalid region format. Use 'x1,y1,x2,y2'")
                 get_user_input("Press Enter to continue...")
                 
+        elif command in ('image_click', 'image_find'):
+            print("\nCapture the UI element to match:")
+            try:
+                element_input = get_user_input("Enter the element's bounds (x1,y1,x2,y2): ").strip()
+                x1, y1, x2, y2 = map(int, element_input.split(','))
+                name = get_user_input("Enter a name for this element: ").strip() or f"element_{step_num}"
+                
+                templates_dir = "templates"
+                if not os.path.exists(templates_dir):
+                    os.makedirs(templates_dir)
+                template_path = os.path.join(templates_dir, f"{name.lower().replace(' ', '_')}.png")
+                get_backend().capture((x1, y1, x2, y2)).save(template_path)
+                
+                step = {"type": command, "template": template_path}
+                region_input = get_user_input("Search region (x1,y1,x2,y2) or press Enter for full screen: ").strip()
+                if region_input:
+                    step["region"] = list(map(int, region_input.split(',')))
+                fallback = get_user_input("Text to look for via OCR if the image is not found (optional): ").strip()
+                if fallback:
+                    step["fallback_text"] = fallback
+                
+                sequence["steps"].append(step)
+                print(f"Added {command} step for {template_path}")
+                step_num += 1
+            except ValueError:
+                print("Invalid region format. Use 'x1,y1,x2,y2'")
+                get_user_input("Press Enter to continue...")
+            
         elif command == 'type':
+            print("Use {column} to type a value from the CSV row; write literal braces as {{ and }}")
             text = get_user_input("Enter text to type: ").strip()
+            try:
+                _csv_fields(text)
+            except SequenceError as e:
+                print(f"Warning: {str(e)}; the text will be typed as written")
             if text:
                 sequence["steps"].append({
                     "type": "type",
@@ -800,11 +5446,20 @@ def view_sequences_menu():
         sequence_file = os.path.join(sequences_dir, choice)
         sequence = load_sequence(sequence_file)
         if sequence:
+            # Validate once up front; the compiled plan is reused for every run
+            plan, plan_error = None, None
+            try:
+                plan = compile_sequence(sequence)
+            except SequenceError as e:
+                plan_error = str(e)
+            
             while True:
                 print_header(f"Sequence: {choice}")
                 print("Steps:")
                 for i, step in enumerate(sequence.get("steps", []), 1):
                     print(f"{i}. {step}")
+                if plan_error:
+                    print(f"\nThis sequence cannot be run: {plan_error}")
                 print("\n")
                 
                 action_options = {
@@ -822,6 +5477,11 @@ def view_sequences_menu():
                 elif action == 'quit':
                     return 'quit'
                 elif action in ['run', 'run_debug', 'run_csv']:
+                    if plan is None:
+                        print(f"\nInvalid sequence: {plan_error}")
+                        get_user_input("Press Enter to continue...")
+                        continue
+                    
                     print("\nPreparing to run sequence...")
                     countdown = get_user_input("Enter seconds to wait before starting (or press Enter for 5s): ").strip()
                     try:
@@ -846,19 +5506,11 @@ def view_sequences_menu():
                         print("\nRunning sequence...")
                         
                         if action == 'run_csv':
-                            # Load CSV to get row count
-                            with open(csv_file, 'r') as f:
-                                reader = csv.reader(f)
-                                csv_data = list(reader)
-                                total_rows = len(csv_data)
-                            
-                            # Run sequence for each row
-                            for row in range(total_rows):
-                                print(f"\nProcessing row {row + 1}/{total_rows}")
-                                run_sequence(sequence, debug=(action == 'run_debug'), csv_file=csv_file, csv_row=row)
-                                time.sleep(1)  # Small delay between rows
+                            # Stream the CSV, running the sequence for each row
+                            succeeded, total = run_sequence_csv(plan, csv_file, row_delay=1)
+                            print(f"\n{succeeded}/{total} rows completed")
                         else:
-                            run_sequence(sequence, debug=(action == 'run_debug'))
+                            run_sequence(plan, debug=(action == 'run_debug'))
                             
                         print("\nSequence completed successfully!")
                     except KeyboardInterrupt:
@@ -904,6 +5556,244 @@ def stop_mouse_position_display():
         sys.stdout.write('\033[F\033[K')
         sys.stdout.flush()
 
+def _queue_path(args):
+    return args.queue or f"{os.path.splitext(args.csv)[0]}_queue.db"
+
+def _load_task_ids(args):
+    """Patient IDs (claim flow) or row values (sequence) to put on the work queue"""
+    if args.sequence:
+        return [value for value, _ in iter_csv_rows(args.csv)]
+    return EpicAutomation.load_patient_ids(args.csv)
+
+def run_command(args):
+    """run: process a CSV headlessly with a sequence or the claim flow"""
+    if args.display and len(args.display) != args.workers:
+        print(f"Give one --display per worker ({args.workers} workers, "
+              f"{len(args.display)} displays)")
+        return 2
+    if args.workers > 1:
+        if not args.display:
+            print("--workers runs each worker on its own X display: pass --display once per "
+                  "worker, or start one 'run --queue FILE --worker NAME' in each session")
+            return 2
+        return spawn_workers(args)
+    if args.display:
+        # Backends and pyautogui load on first use, so this picks the display they drive
+        os.environ["DISPLAY"] = args.display[0]
+    if args.worker:
+        return queue_worker_command(args)
+
+    if args.sequence:
+        sequence = load_sequence(args.sequence)
+        if not sequence:
+            return 1
+        try:
+            plan = compile_sequence(sequence)
+        except SequenceError as e:
+            print(f"Invalid sequence: {str(e)}")
+            return 1
+        journal = CheckpointJournal(f"{os.path.splitext(args.csv)[0]}_journal.jsonl")
+        try:
+            succeeded, total = run_sequence_csv(plan, args.csv, debug=args.debug,
+                                                row_delay=args.row_delay, journal=journal,
+                                                resume=args.resume)
+        except SequenceError as e:
+            print(f"Error: {str(e)}")
+            return 1
+        finally:
+            journal.close()
+        print(f"\n{succeeded}/{total} rows completed")
+        return 0 if succeeded == total else 1
+
+    automation = EpicAutomation()
+    patient_ids = automation.load_patient_ids(args.csv)
+    if not patient_ids:
+        print("No patient IDs loaded. Please check your CSV file.")
+        return 1
+    try:
+        successful, total = automation.process_batch(patient_ids, resume=args.resume)
+    finally:
+        automation.save_results()
+    print(f"\nSuccessfully processed: {successful}/{total} patients")
+    return 0 if successful == total else 1
+
+def spawn_workers(args):
+    """Queue the CSV and run one worker process per --display against the queue"""
+    queue_path = _queue_path(args)
+    if not args.resume:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(queue_path + suffix):
+                os.remove(queue_path + suffix)
+    task_ids = _load_task_ids(args)
+    if not task_ids:
+        print("No patient IDs loaded. Please check your CSV file.")
+        return 1
+    work_queue = WorkQueue(queue_path)
+    work_queue.add(task_ids)
+
+    processes = []
+    for i, display in enumerate(args.display, 1):
+        command = [sys.executable, os.path.abspath(__file__), "run", "--csv", args.csv,
+                   "--queue", queue_path, "--worker", f"worker-{i}"]
+        if args.sequence:
+            command += ["--sequence", args.sequence]
+        if args.debug:
+            command.append("--debug")
+        processes.append(subprocess.Popen(command, env=dict(os.environ, DISPLAY=display)))
+    codes = [process.wait() for process in processes]
+
+    counts = work_queue.counts()
+    pending = counts.get('pending', 0) + counts.get('leased', 0)
+    print(f"\n{counts.get('done', 0)} done, {counts.get('failed', 0)} failed, {pending} pending")
+    return 0 if not any(codes) and not counts.get('failed') and not pending else 1
+
+def queue_worker_command(args):
+    """run --worker: process tasks from a shared work queue until it drains"""
+    if args.sequence:
+        sequence = load_sequence(args.sequence)
+        if not sequence:
+            return 1
+        try:
+            worker = SequenceWorker(sequence, debug=args.debug)
+        except SequenceError as e:
+            print(f"Invalid sequence: {str(e)}")
+            return 1
+    else:
+        worker = EpicAutomation(results_file=f"insurance_claim_results_{args.worker}.csv",
+                                journal=CheckpointJournal(f"insurance_claim_journal_{args.worker}.jsonl"))
+    work_queue = WorkQueue(_queue_path(args))
+    # Workers started on their own (e.g. by a scheduler) queue the CSV themselves; IDs already
+    # queued are ignored
+    work_queue.add(_load_task_ids(args))
+    counts = run_queue_worker(work_queue, worker, args.worker)
+    print(f"\n[{args.worker}] {counts['done']} done, {counts['retried']} retried, "
+          f"{counts['failed']} failed")
+    return 0 if not counts['failed'] else 1
+
+def bench_command(args):
+    """bench: run the OCR benchmark over a screenshot corpus"""
+    sequence = None
+    if args.sequence:
+        sequence = load_sequence(args.sequence)
+        if not sequence:
+            return 1
+    output = args.output
+    if args.compare and not output:
+        handle, output = tempfile.mkstemp(prefix="ocr_bench_", suffix=".json")
+        os.close(handle)
+    run_benchmark(args.corpus, sequence=sequence, repeat=args.repeat, output=output)
+    if args.compare:
+        compare_benchmarks(args.compare, output)
+    return 0
+
+def validate_command(args):
+    """validate: compile sequences (and check a CSV header) without touching the screen"""
+    failed = 0
+    for path in args.sequences:
+        sequence = load_sequence(path)
+        if not sequence:
+            failed += 1
+            continue
+        try:
+            plan = compile_sequence(sequence)
+            if args.csv and plan.csv_columns:
+                with open(args.csv, 'r', newline='') as f:
+                    header = {name.strip() for name in next(csv.reader(f), [])}
+                missing = plan.csv_columns - header
+                if missing:
+                    raise SequenceError(f"CSV is missing column(s): {', '.join(sorted(missing))}")
+        except (SequenceError, OSError) as e:
+            print(f"{path}: {str(e)}")
+            failed += 1
+            continue
+        columns = f", columns {', '.join(sorted(plan.csv_columns))}" if plan.csv_columns else ""
+        print(f"{path}: OK ({plan.name}, {len(plan.steps)} steps{columns})")
+    return 1 if failed else 0
+
+def ocr_search_command(args):
+    """ocr-search: search the OCR results store"""
+    if not os.path.exists(args.db):
+        print(f"No OCR results database at {args.db}")
+        return 1
+    store = OCRResultStore(args.db)
+    if args.runs:
+        for run, sequence, rows, results, first, last in store.runs():
+            print(f"{run}  {sequence or '-'}  {rows} rows  {results} results  "
+                  f"{datetime.fromtimestamp(first):%Y-%m-%d %H:%M:%S} - "
+                  f"{datetime.fromtimestamp(last):%H:%M:%S}")
+        return 0
+    since = datetime.strptime(args.since, "%Y-%m-%d").timestamp() if args.since else None
+    results = store.search(args.text, patient=args.patient, run=args.run, step=args.step,
+                           since=since, limit=args.limit, words=args.words)
+    for result in results:
+        print(f"[{datetime.fromtimestamp(result['taken']):%Y-%m-%d %H:%M:%S}] run {result['run']} "
+              f"row {result['row']} step {result['step']} patient {result['patient']}")
+        print("  " + result["text"].replace("\n", "\n  "))
+        for word, box, conf in result.get("words", ()):
+            print(f"    {word!r} {box} conf {conf:.0f}")
+    print(f"{len(results)} result(s)")
+    return 0
+
+def build_parser():
+    """Command line for headless runs; with no command main() shows the menu"""
+    parser = argparse.ArgumentParser(prog="sc.py", description="Epic insurance claim automation. "
+                                     "Run without a command for the interactive menu.")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    run = commands.add_parser("run", help="process a CSV without the menu")
+    run.add_argument("--csv", required=True, help="CSV of patient IDs or sequence rows")
+    run.add_argument("--sequence", help="sequence JSON to run once per CSV row "
+                                        "(default: the insurance claim flow)")
+    run.add_argument("--workers", type=int, default=1,
+                     help="worker processes sharing a work queue, one per --display (default 1)")
+    run.add_argument("--display", action="append",
+                     help="X display a worker drives, e.g. :1; repeat once per worker")
+    run.add_argument("--queue", help="work queue file (default: <csv>_queue.db)")
+    run.add_argument("--worker", metavar="NAME",
+                     help="run as one named worker of the --queue, e.g. one per session")
+    run.add_argument("--resume", action="store_true",
+                     help="skip rows or patients a previous run completed")
+    run.add_argument("--row-delay", type=float, default=0, help="seconds between sequence rows")
+    run.add_argument("--debug", action="store_true", help="print each step")
+    run.set_defaults(func=run_command)
+
+    bench = commands.add_parser("bench", help="benchmark OCR against a screenshot corpus")
+    bench.add_argument("corpus", help="directory of PNG screenshots (and optional words.txt)")
+    bench.add_argument("--sequence", help="sequence JSON to time against the corpus")
+    bench.add_argument("--repeat", type=int, default=3, help="sequence runs per config (default 3)")
+    bench.add_argument("--output", help="write the JSON report here")
+    bench.add_argument("--compare", metavar="BASELINE", help="compare with an earlier report")
+    bench.set_defaults(func=bench_command)
+
+    validate = commands.add_parser("validate", help="check sequence files without running them")
+    validate.add_argument("sequences", nargs="+", help="sequence JSON files")
+    validate.add_argument("--csv", help="also check this CSV has the columns the sequences use")
+    validate.set_defaults(func=validate_command)
+
+    search = commands.add_parser("ocr-search", help="search text extracted by screenshot steps")
+    search.add_argument("text", nargs="?", help="text to look for (case-insensitive)")
+    search.add_argument("--patient", help="only this patient ID / CSV value")
+    search.add_argument("--run", help="only this run ID")
+    search.add_argument("--step", type=int, help="only this sequence step")
+    search.add_argument("--since", help="only results on or after this date (YYYY-MM-DD)")
+    search.add_argument("--limit", type=int, default=50, help="maximum results (default 50)")
+    search.add_argument("--words", action="store_true", help="also print word boxes and confidences")
+    search.add_argument("--runs", action="store_true", help="list stored runs instead")
+    search.add_argument("--db", default=OCR_RESULTS_DB, help="results database path")
+    search.set_defaults(func=ocr_search_command)
+    return parser
+
+def cli(argv=None):
+    """Run one command; returns its exit status, or None when no command was given"""
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        return None
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        print("\nAutomation stopped by user")
+        return 130
+
 def main():
     try:
         # Start mouse position display thread
@@ -945,10 +5835,13 @@ def main():
                     continue
 
                 print(f"Found {len(patient_ids)} patients to process.")
+                resume = False
+                if os.path.exists(automation.journal.path):
+                    resume = input("Resume the previous run and skip completed patients? (y/n): ").strip().lower() == 'y'
                 print("Please switch to Epic Hyperspace window within 5 seconds...")
                 time.sleep(5)
                 
-                successful, total = automation.process_batch(patient_ids)
+                successful, total = automation.process_batch(patient_ids, resume=resume)
                 automation.save_results()
                 
                 print(f"\nProcessing complete!")
@@ -996,4 +5889,7 @@ def main():
         stop_mouse_position_display()
 
 if __name__ == "__main__":
+    status = cli()
+    if status is not None:
+        sys.exit(status)
     main() 
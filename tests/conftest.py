@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# sc logs to, and writes its databases in, the working directory
+os.chdir(tempfile.mkdtemp(prefix="sc_tests_"))
+
+import sc  # noqa: E402
+
+
+class FakeOCREngine(sc.OCREngine):
+    """OCREngine whose recognition is a Python callable, counting the calls that reach it
+
+    reader(method, img, config) returns what Tesseract would: a string for
+    image_to_string, an Output.DICT-style dict for image_to_data. Caching,
+    stats and tracing still go through OCREngine.
+    """
+
+    def __init__(self, reader, **kwargs):
+        kwargs.setdefault("workers", 1)
+        super().__init__(**kwargs)
+        self.reader = reader
+        self.recognized = 0
+
+    def _recognize(self, method, img, config):
+        self.recognized += 1
+        self._record(method, 0.0)
+        return self.reader(method, img, config)
+
+
+def ocr_data(words):
+    """Build an image_to_data dict from (text, (x1, y1, x2, y2)[, conf[, line]]) tuples"""
+    data = {key: [] for key in ("text", "left", "top", "width", "height", "conf",
+                                "block_num", "par_num", "line_num", "word_num")}
+    for word in words:
+        text, (x1, y1, x2, y2) = word[:2]
+        conf = word[2] if len(word) > 2 else 90
+        line = word[3] if len(word) > 3 else 1
+        for key, value in zip(data, (text, x1, y1, x2 - x1, y2 - y1, conf, 1, 1, line,
+                                     len(data["text"]) + 1)):
+            data[key].append(value)
+    return data
+
+
+def screen(size=(400, 300), marks=()):
+    """A white frame with small black rectangles at the given (x1, y1, x2, y2) boxes"""
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    for box in marks:
+        draw.rectangle(box, fill="black")
+    return img
+
+
+@pytest.fixture
+def fake_engine():
+    return FakeOCREngine
+
+
+@pytest.fixture(autouse=True)
+def restore_globals():
+    """Keep tests from leaking the shared backend and OCR engine into each other"""
+    backend, engine = sc._backend, sc._ocr_engine
+    yield
+    sc._backend, sc._ocr_engine = backend, engine
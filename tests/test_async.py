@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+import sc
+from conftest import FakeOCREngine, ocr_data, screen
+
+WORDS = [("P1", (5, 5, 30, 20)), ("Insurance", (40, 5, 120, 20)), ("Submit", (130, 5, 180, 20)),
+         ("Claim", (185, 5, 230, 20)), ("Submitted", (235, 5, 300, 20))]
+
+
+def claim_automation(tmp_path, delay=0.0):
+    """An EpicAutomation on a ReplayBackend whose screen always shows every label"""
+    def reader(method, img, config):
+        time.sleep(delay)
+        if method == "image_to_data":
+            return ocr_data(WORDS)
+        return " ".join(word for word, _ in WORDS)
+
+    backend = sc.ReplayBackend([screen((800, 600)), screen((800, 600), marks=[(0, 0, 5, 5)])],
+                               loop=True)
+    automation = sc.EpicAutomation(backend, FakeOCREngine(reader),
+                                   results_file=str(tmp_path / "results.csv"),
+                                   journal=sc.CheckpointJournal(str(tmp_path / "journal.jsonl")))
+    automation.wait_timeout = 0.5
+    automation.poll_interval = 0.01
+    return automation, backend
+
+
+def test_sync_and_async_share_the_claim_flow(tmp_path):
+    automation, backend = claim_automation(tmp_path)
+    assert automation.process_insurance_claim("P1")
+    sync_events = [(e["action"], e.get("text")) for e in backend.events]
+
+    backend.events.clear()
+    assert asyncio.run(automation.process_insurance_claim_async("P1"))
+    assert [(e["action"], e.get("text")) for e in backend.events] == sync_events
+    assert [row[1] for row in automation.results] == ["Success", "Success"]
+    automation.save_results()
+
+
+def test_timeout_waits_for_the_thread_and_refuses_its_input():
+    backend = sc.CancellableBackend(sc.ReplayBackend([screen()]))
+
+    def step():
+        backend.click(1, 1)
+        time.sleep(0.3)
+        backend.click(2, 2)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(sc.run_in_session(backend, step), 0.05)
+        return len(backend.backend.events)
+
+    assert asyncio.run(main()) == 1
+    time.sleep(0.4)
+    assert len(backend.backend.events) == 1
+
+
+def test_batch_timeout_stops_input_before_moving_on(tmp_path):
+    automation, backend = claim_automation(tmp_path, delay=0.2)
+    successful, total = asyncio.run(
+        automation.process_batch_async(["P1", "P2"], patient_timeout=0.1))
+    automation.save_results()
+    finished = time.time()
+    time.sleep(0.3)
+
+    assert (successful, total) == (0, 2)
+    assert [row[3] for row in automation.results] == ["Timed out after 0.1s"] * 2
+    # Each patient got as far as typing its ID; nothing clicked after its timeout
+    assert [e["text"] for e in backend.events if e["action"] == "type"] == ["P1", "P2"]
+    assert all(e["time"] < finished for e in backend.events)
+
+
+def test_batch_timeout_keeps_a_result_recorded_before_it(tmp_path):
+    automation, backend = claim_automation(tmp_path)
+    record_result = automation.record_result
+
+    def slow_record(patient_id, status, notes):
+        # The outcome is journaled, then the thread overruns the timeout
+        record_result(patient_id, status, notes)
+        if status == "Success":
+            time.sleep(0.6)
+
+    automation.record_result = slow_record
+    successful, total = asyncio.run(
+        automation.process_batch_async(["P1"], patient_timeout=0.4))
+    automation.save_results()
+
+    assert (successful, total) == (1, 1)
+    assert [e["status"] for e in automation.journal.entries()] == ["Success"]
+    assert automation.journal.completed_ids() == {"P1"}
@@ -0,0 +1,22 @@
+import os
+
+import sc
+from conftest import FakeOCREngine, ocr_data, screen
+
+
+def test_benchmark_sequence_runs_leave_no_stored_results(tmp_path, monkeypatch):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    screen().save(corpus / "frame.png")
+    monkeypatch.chdir(tmp_path)
+    words = ocr_data([("Claim", (10, 10, 50, 20))])
+    monkeypatch.setattr(sc, "OCREngine", lambda **kwargs: FakeOCREngine(
+        lambda method, img, config: words if method == "image_to_data" else "Claim", **kwargs))
+    archive, store = sc._screenshot_archive, sc._ocr_store
+
+    report = sc.run_benchmark(str(corpus), {"steps": [{"type": "screenshot", "ocr": True}]},
+                              words=["Claim"], configs=[{"name": "fake"}], repeat=2)
+
+    assert report["results"][0]["run_sequence"]["n"] == 2
+    assert sorted(os.listdir(tmp_path)) == ["corpus"]
+    assert (sc._screenshot_archive, sc._ocr_store) == (archive, store)
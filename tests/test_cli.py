@@ -0,0 +1,75 @@
+import json
+import os
+import subprocess
+import sys
+
+import sc
+from conftest import FakeOCREngine, screen
+
+ROOT = os.path.dirname(os.path.abspath(sc.__file__))
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_validate_checks_csv_columns(tmp_path, capsys):
+    sequence = write(tmp_path / "seq.json", json.dumps(
+        {"name": "demo", "steps": [{"type": "csv_input", "column": "MRN"}]}))
+    good = write(tmp_path / "good.csv", "MRN,Name\n1,a\n")
+    bad = write(tmp_path / "bad.csv", "ID\n1\n")
+    assert sc.cli(["validate", sequence, "--csv", good]) == 0
+    assert sc.cli(["validate", sequence, "--csv", bad]) == 1
+    assert "missing column(s): MRN" in capsys.readouterr().out
+
+
+def test_workers_need_one_display_each(tmp_path, capsys):
+    csv_file = write(tmp_path / "ids.csv", "ID\n1\n2\n")
+    assert sc.cli(["run", "--csv", csv_file, "--workers", "2"]) == 2
+    assert sc.cli(["run", "--csv", csv_file, "--workers", "2", "--display", ":1"]) == 2
+    assert "--display" in capsys.readouterr().out
+
+
+def test_queue_worker_runs_a_sequence(tmp_path):
+    sc.set_backend(sc.ReplayBackend([screen()]))
+    sc._ocr_engine = FakeOCREngine(lambda *a: "")
+    sequence = write(tmp_path / "seq.json", json.dumps(
+        {"name": "demo", "steps": [{"type": "csv_input"}]}))
+    csv_file = write(tmp_path / "ids.csv", "A\nB\n")
+    queue_path = str(tmp_path / "q.db")
+    status = sc.cli(["run", "--csv", csv_file, "--sequence", sequence, "--queue", queue_path,
+                     "--worker", "w1"])
+    assert status == 0
+    assert sc.WorkQueue(queue_path).counts() == {"done": 2}
+    typed = [e["text"] for e in sc.get_backend().events if e["action"] == "type"]
+    assert typed == ["A", "B"]
+
+
+def test_sequence_run_without_resume_rotates_the_journal(tmp_path):
+    sc.set_backend(sc.ReplayBackend([screen()]))
+    sc._ocr_engine = FakeOCREngine(lambda *a: "")
+    sequence = write(tmp_path / "seq.json", json.dumps(
+        {"name": "demo", "steps": [{"type": "csv_input"}]}))
+    csv_file = write(tmp_path / "ids.csv", "A\nB\n")
+    journal = sc.CheckpointJournal(str(tmp_path / "ids_journal.jsonl"))
+
+    for args in ([], [], ["--resume"]):
+        assert sc.cli(["run", "--csv", csv_file, "--sequence", sequence] + args) == 0
+    # The resumed run skipped both rows; the first run's records were set aside, not appended to
+    assert [e["patient_id"] for e in journal.entries()] == ["1", "2"]
+    assert len(list(tmp_path.glob("ids_journal_*.jsonl"))) == 1
+    typed = [e["text"] for e in sc.get_backend().events if e["action"] == "type"]
+    assert typed == ["A", "B", "A", "B"]
+
+
+def test_validate_starts_without_heavy_imports(tmp_path):
+    sequence = write(tmp_path / "seq.json", json.dumps(
+        {"name": "demo", "steps": [{"type": "type", "text": "hi"}]}))
+    script = ("import sys, sc; status = sc.cli(['validate', sys.argv[1]]); "
+              "print(sorted(m for m in ('cv2', 'numpy', 'pytesseract') if m in sys.modules)); "
+              "sys.exit(status)")
+    result = subprocess.run([sys.executable, "-c", script, sequence], cwd=tmp_path,
+                            env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith("[]")
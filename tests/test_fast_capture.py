@@ -0,0 +1,58 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import sc
+
+pytestmark = pytest.mark.skipif(not sc.mss, reason="needs the mss package")
+
+
+@pytest.fixture(scope="module")
+def display():
+    """The current X display, or a 320x240 Xvfb server started for these tests"""
+    if os.environ.get("DISPLAY"):
+        yield os.environ["DISPLAY"]
+        return
+    if not shutil.which("Xvfb"):
+        pytest.skip("needs an X display or Xvfb")
+    read, write = os.pipe()
+    server = subprocess.Popen(["Xvfb", "-displayfd", str(write), "-screen", "0", "320x240x24"],
+                              pass_fds=(write,), stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    os.close(write)
+    with os.fdopen(read) as f:
+        number = f.readline().strip()
+    try:
+        if not number:
+            pytest.skip("Xvfb did not start")
+        yield f":{number}"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_grab_reuses_one_buffer_per_size(display):
+    backend = sc.FastCaptureBackend("mss", display=display, input_backend=sc.ReplayBackend(
+        [sc.Image.new("RGB", (10, 10))]))
+    first = backend.grab((0, 0, 40, 30))
+    second = backend.grab((10, 10, 50, 40))
+    assert first is second
+    assert first.shape == (30, 40, 3)
+    assert backend.grab((0, 0, 20, 20)) is not first
+
+    image = backend.capture((0, 0, 40, 30))
+    assert image.size == (40, 30)
+    assert backend.capture().size == backend.screen_size()
+
+
+def test_close_releases_handles_and_later_grabs_reopen(display):
+    backend = sc.FastCaptureBackend("mss", display=display, input_backend=sc.ReplayBackend(
+        [sc.Image.new("RGB", (10, 10))]))
+    backend.grab((0, 0, 10, 10))
+    assert backend._handles
+    backend.close()
+    assert backend._handles == []
+    assert backend.grab((0, 0, 10, 10)).shape == (10, 10, 3)
+    backend.close()
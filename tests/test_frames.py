@@ -0,0 +1,56 @@
+import numpy
+
+import sc
+from conftest import FakeOCREngine, screen
+
+BLANK = screen()
+MARKED = screen(marks=[(0, 0, 200, 150)])
+
+
+def test_frame_diff_compares_signatures():
+    blank = sc.frame_signature(BLANK)
+    assert sc.frame_diff(blank, sc.frame_signature(BLANK.copy())) == 0.0
+    assert sc.frame_diff(blank, sc.frame_signature(MARKED)) > 50
+    assert sc.frame_diff(blank, None) == 255.0
+    assert sc.frame_diff(blank, sc.frame_signature(BLANK, size=(32, 18))) == 255.0
+    # Grabbed RGB buffers and captured images give the same signature
+    assert sc.frame_diff(sc.frame_signature(numpy.asarray(MARKED)), sc.frame_signature(MARKED)) == 0.0
+
+
+def test_frame_hash_and_digest():
+    assert sc.hash_distance(sc.frame_hash(BLANK), sc.frame_hash(BLANK.copy())) == 0
+    assert sc.hash_distance(sc.frame_hash(BLANK), sc.frame_hash(MARKED)) > 0
+    assert sc.hash_distance(None, sc.frame_hash(BLANK)) == 64
+
+    one_pixel = BLANK.copy()
+    one_pixel.putpixel((399, 299), (254, 255, 255))
+    assert sc.frame_digest(BLANK) == sc.frame_digest(BLANK.copy())
+    assert sc.frame_digest(BLANK) != sc.frame_digest(one_pixel)
+    assert sc.frame_digest(numpy.asarray(BLANK)) == sc.frame_digest(numpy.asarray(BLANK).copy())
+
+
+def test_change_and_stable_conditions():
+    blank, marked = sc.frame_signature(BLANK), sc.frame_signature(MARKED)
+    change = sc.WaitCondition("change", baseline=blank)
+    assert not change.check(blank, 0.0)
+    assert change.check(marked, 0.1)
+
+    stable = sc.WaitCondition("stable", stable_time=0.5)
+    assert not stable.check(marked, 0.0)
+    assert not stable.check(marked, 0.3)
+    assert not stable.check(blank, 0.4)
+    assert not stable.check(blank, 0.8)
+    assert stable.check(blank, 0.9)
+
+
+def test_wait_for_polls_without_ocr_unless_waiting_for_text():
+    backend = sc.ReplayBackend([BLANK])
+    engine = FakeOCREngine(lambda *args: "Ready")
+    assert sc.wait_for("stable", timeout=1, interval=0.01, stable_time=0.05, backend=backend,
+                       ocr_engine=engine)
+    assert not sc.wait_for("change", timeout=0.05, interval=0.01, backend=backend,
+                           ocr_engine=engine)
+    assert engine.recognized == 0
+    assert sc.wait_for("text", text="Ready", timeout=1, interval=0.01, backend=backend,
+                       ocr_engine=engine)
+    assert engine.recognized == 1
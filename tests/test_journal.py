@@ -0,0 +1,52 @@
+import sc
+
+
+def test_latest_record_wins_and_a_torn_line_is_skipped(tmp_path):
+    journal = sc.CheckpointJournal(str(tmp_path / "journal.jsonl"))
+    journal.record("A", "Failed", "Patient not found")
+    journal.record("A", "Success", "Claim submitted")
+    journal.record("B", "Success", "Claim submitted")
+    journal.record("B", "Error", "Timed out after 30s")
+    journal.close()
+    with open(journal.path, "a") as f:
+        f.write('{"patient_id": "C", "sta')
+
+    assert [e["patient_id"] for e in journal.entries()] == ["A", "A", "B", "B"]
+    assert journal.completed_ids() == {"A"}
+
+
+def test_resume_appends_and_a_fresh_start_rotates(tmp_path):
+    journal = sc.CheckpointJournal(str(tmp_path / "journal.jsonl"))
+    journal.start()
+    journal.record("A", "Success")
+    journal.start(resume=True)
+    journal.record("B", "Success")
+    assert journal.completed_ids() == {"A", "B"}
+
+    journal.start()
+    assert journal.completed_ids() == set()
+    journal.start()
+    rotated = sorted(p.name for p in tmp_path.glob("journal_*.jsonl"))
+    assert len(rotated) == 1
+    journal.close()
+
+
+def test_records_after_a_torn_tail_are_kept(tmp_path):
+    journal = sc.CheckpointJournal(str(tmp_path / "journal.jsonl"))
+    journal.record("A", "Success")
+    journal.close()
+    with open(journal.path, "a") as f:
+        f.write('{"patient_id": "B", "sta')
+
+    journal.start(resume=True)
+    journal.record("C", "Success")
+    journal.record("D", "Success")
+    journal.close()
+    assert journal.completed_ids() == {"A", "C", "D"}
+
+    # A journal that is written to without start() is repaired too
+    with open(journal.path, "a") as f:
+        f.write('{"patient_id": "E"')
+    journal.record("F", "Success")
+    journal.close()
+    assert [e["patient_id"] for e in journal.entries()] == ["A", "C", "D", "F"]
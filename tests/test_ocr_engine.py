@@ -0,0 +1,107 @@
+import queue
+import threading
+from types import SimpleNamespace
+
+import sc
+from conftest import FakeOCREngine, screen
+
+
+class FakeTessAPI:
+    """Stands in for a tesserocr PyTessBaseAPI handle; reads back its whitelist variable"""
+
+    def __init__(self):
+        self.variables = {"tessedit_char_whitelist": ""}
+
+    def GetVariableAsString(self, name):
+        return self.variables.get(name)
+
+    def SetVariable(self, name, value):
+        if name not in self.variables:
+            return False
+        self.variables[name] = value
+        return True
+
+    def SetPageSegMode(self, psm):
+        self.psm = psm
+
+    def SetImage(self, img):
+        pass
+
+    def GetUTF8Text(self):
+        return self.variables["tessedit_char_whitelist"]
+
+
+def pooled_engine():
+    engine = sc.OCREngine(workers=1)
+    engine._tesserocr = SimpleNamespace(PSM=SimpleNamespace(AUTO=3))
+    engine._handles = queue.Queue()
+    engine._handles.put(FakeTessAPI())
+    return engine
+
+
+def test_config_variables_do_not_leak_between_pooled_calls():
+    engine = pooled_engine()
+    img = screen()
+    assert engine.image_to_string(img, "--psm 7 -c tessedit_char_whitelist=0123456789") == "0123456789"
+    assert engine.image_to_string(img, "") == ""
+    assert engine._handles.get().variables == {"tessedit_char_whitelist": ""}
+
+
+def test_evaluate_preprocessing_bypasses_the_cache_per_call():
+    engine = FakeOCREngine(lambda method, img, config: "Claim 42", cache=sc.OCRCache())
+    samples = [(screen(), "Claim 42")] * 2
+    results = sc.evaluate_preprocessing(samples, presets=["none", "none"], ocr_engine=engine)
+    assert engine.recognized == 4
+    assert [r["exact"] for r in results] == [1.0, 1.0]
+    assert engine.cache.stats()["entries"] == 0
+
+    # Other callers of the same engine keep using its cache
+    engine.image_to_string(screen())
+    engine.image_to_string(screen())
+    assert engine.recognized == 5
+
+
+def test_ocr_cache_evicts_least_recently_used(tmp_path):
+    cache = sc.OCRCache(max_bytes=25, path=str(tmp_path / "cache.json"))
+    cache.put("a", "x" * 8)
+    cache.put("b", "y" * 8)
+    assert cache.get("a") == "x" * 8
+    cache.put("c", "z" * 8)
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+    cache.put("huge", "w" * 100)
+    assert cache.get("huge") is None
+
+    cache.save()
+    loaded = sc.OCRCache(max_bytes=25, path=str(tmp_path / "cache.json"))
+    assert loaded.get("a") == "x" * 8 and loaded.get("c") == "z" * 8
+
+
+def test_engine_cache_is_keyed_by_pixels_and_settings():
+    engine = FakeOCREngine(lambda method, img, config: f"{method} {config}", cache=sc.OCRCache())
+    blank, marked = screen(), screen(marks=[(0, 0, 10, 10)])
+    assert engine.image_to_string(blank) == "image_to_string "
+    assert engine.image_to_string(blank.copy()) == "image_to_string "
+    assert engine.recognized == 1
+    engine.image_to_string(marked)
+    engine.image_to_string(blank, "--psm 7")
+    assert engine.recognized == 3
+    assert engine.stats()["cache"]["hits"] == 1
+
+
+def test_concurrent_reads_of_the_same_pixels_share_one_call():
+    started, release = threading.Event(), threading.Event()
+
+    def reader(method, img, config):
+        started.set()
+        release.wait(2)
+        return "Claim"
+
+    engine = FakeOCREngine(reader, workers=2, cache=sc.OCRCache())
+    first = engine.submit("image_to_string", screen())
+    assert started.wait(2)
+    second = engine.submit("image_to_string", screen())
+    release.set()
+    assert first.result(2) == second.result(2) == "Claim"
+    assert engine.recognized == 1
+    engine.close()
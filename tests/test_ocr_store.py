@@ -0,0 +1,22 @@
+import sc
+from conftest import ocr_data
+
+
+def test_results_are_searchable_with_their_words(tmp_path):
+    store = sc.OCRResultStore(str(tmp_path / "ocr.db"), batch_size=2)
+    data = ocr_data([("MRN", (10, 10, 40, 20), 91), ("100_7", (50, 10, 90, 20), 88)])
+    store.record("MRN 100_7", data, run="r1", row=1, step=2, patient="P1", sequence="demo",
+                 region=(0, 0, 100, 30))
+    store.record("Name Ann", run="r1", row=2, step=2, patient="P2", sequence="demo")
+    store.record("MRN 1007", run="r2", row=1, step=2, patient="P3", sequence="demo")
+    store.flush()
+
+    assert [r["patient"] for r in store.search("mrn")] == ["P3", "P1"]
+    # LIKE wildcards in the search text are literal
+    assert [r["patient"] for r in store.search("100_")] == ["P1"]
+    [result] = store.search(patient="P1", words=True)
+    assert (result["run"], result["row"], result["step"]) == ("r1", 1, 2)
+    assert result["words"] == [("MRN", (10, 10, 40, 20), 91.0), ("100_7", (50, 10, 90, 20), 88.0)]
+    assert [r["patient"] for r in store.search(run="r1", row=2)] == ["P2"]
+    assert [(run, rows, results) for run, _, rows, results, _, _ in store.runs()] == [
+        ("r1", 2, 2), ("r2", 1, 1)]
@@ -0,0 +1,39 @@
+import sc
+from conftest import FakeOCREngine, screen
+
+SEQUENCE = {"name": "pipelined", "steps": [
+    {"type": "region", "coordinates": [10, 10, 110, 60]},
+    {"type": "wait_for_text", "text": "Ready", "timeout": 0.5, "interval": 0.01, "required": True},
+    {"type": "click", "x": 5, "y": 5},
+    {"type": "wait_for_text", "text": "Ready", "region": [200, 200, 300, 250], "timeout": 0.5,
+     "interval": 0.01},
+]}
+
+
+def test_prefetch_cache_leaves_the_engine_uncached():
+    engine = FakeOCREngine(lambda method, img, config: "Ready")
+    executor = sc.PipelinedExecutor(sc.ReplayBackend([screen()]), engine, capture_interval=0.01)
+    assert engine.cache is None
+    assert executor.run(SEQUENCE)
+    assert engine.cache is None
+    assert executor.cache.stats()["entries"] > 0
+
+
+def test_watch_ahead_follows_the_region_of_interest_and_keeps_frames():
+    backend = sc.ReplayBackend([screen()])
+    executor = sc.PipelinedExecutor(backend, FakeOCREngine(lambda *args: ""), lookahead=1)
+    plan = sc.compile_sequence(SEQUENCE)
+    ctx = sc.RunContext(backend, executor.ocr_engine)
+
+    # The region step ahead sets the box the following wait reads
+    executor._watch_ahead(plan, 0, ctx)
+    assert list(executor.watched) == [(10, 10, 110, 60)]
+
+    ctx.region = (10, 10, 110, 60)
+    executor.ring.put(ctx.region, screen(), None)
+    executor._watch_ahead(plan, 1, ctx)
+    assert executor.ring.latest(ctx.region) is not None
+
+    executor._watch_ahead(plan, 2, ctx)
+    assert list(executor.watched) == [(200, 200, 300, 250)]
+    assert executor.ring.latest(ctx.region) is None
@@ -0,0 +1,38 @@
+import pytest
+
+import sc
+
+
+def test_layouts_convert_to_the_same_rectangle():
+    region = sc.Region(10, 20, 30, 40)
+    assert sc.Region.from_bbox((10, 20, 40, 60)) == region
+    assert sc.Region.from_xywh((10, 20, 30, 40)) == region
+    assert sc.Region.from_dict({"left": 10, "top": 20, "width": 30, "height": 40}) == region
+    assert region.bbox == (10, 20, 40, 60)
+    assert region.xywh == (10, 20, 30, 40)
+    assert sc.Region.from_dict(region.to_dict()) == region
+    assert sc.Region.coerce([10, 20, 40, 60]) == region
+    assert sc.Region.coerce([10, 20, 30, 40], "xywh") == region
+    assert sc.as_bbox(region) == sc.as_bbox([10, 20, 40, 60]) == (10, 20, 40, 60)
+
+
+@pytest.mark.parametrize("args", [(0, 0, 0, 5), (0, 0, 5, -1), (0.5, 0, 5, 5), (True, 0, 5, 5)])
+def test_invalid_rectangles_are_rejected(args):
+    with pytest.raises(ValueError):
+        sc.Region(*args)
+
+
+def test_clip_offset_and_union():
+    region = sc.Region(-10, 90, 50, 20, anchor={"text": "Name"})
+    clipped = region.clip((100, 100))
+    assert clipped.bbox == (0, 90, 40, 100)
+    assert clipped.anchor == region.anchor
+    inside = sc.Region(0, 0, 10, 10)
+    assert inside.clip((100, 100)) is inside
+    with pytest.raises(ValueError, match="outside"):
+        sc.Region(200, 200, 10, 10).clip((100, 100))
+
+    assert region.offset(5, -5).bbox == (-5, 85, 45, 105)
+    assert inside.intersects(sc.Region(5, 5, 10, 10))
+    assert not inside.intersects(sc.Region(20, 20, 5, 5))
+    assert inside.union(sc.Region(20, 20, 5, 5)).bbox == (0, 0, 25, 25)
@@ -0,0 +1,62 @@
+import sc
+from conftest import FakeOCREngine, screen
+
+# Two patient headers that differ only in a few MRN digits
+FIRST = screen(marks=[(10, 10, 120, 20), (130, 10, 140, 20)])
+SECOND = screen(marks=[(10, 10, 120, 20), (142, 10, 152, 20)])
+
+
+def read_mrn(method, img, config):
+    # The mark's position stands in for the digits Tesseract would read
+    return "MRN 1001" if img.getpixel((135, 15)) == (0, 0, 0) else "MRN 1002"
+
+
+def test_signatures_of_patient_screens_are_within_threshold():
+    # The case reuse() must not be fooled by
+    diff = sc.frame_diff(sc.frame_signature(FIRST), sc.frame_signature(SECOND))
+    assert diff < sc.WAIT_DIFF_THRESHOLD
+
+
+def test_reuse_skips_identical_frames_only():
+    watcher = sc.RegionWatcher()
+    calls = []
+
+    def compute(frame):
+        calls.append(frame)
+        return read_mrn("image_to_string", frame, None)
+
+    assert watcher.reuse(None, FIRST, "text", lambda: compute(FIRST)) == "MRN 1001"
+    assert watcher.reuse(None, FIRST.copy(), "text", lambda: compute(FIRST)) == "MRN 1001"
+    assert len(calls) == 1
+    assert watcher.reuse(None, SECOND, "text", lambda: compute(SECOND)) == "MRN 1002"
+    assert len(calls) == 2
+    assert watcher.stats()["reused"] == 1
+
+
+def test_wait_for_text_sees_next_patient():
+    engine = FakeOCREngine(read_mrn)
+    watcher = sc.RegionWatcher()
+    first = sc.ReplayBackend([FIRST])
+    assert sc.wait_for("text", text="MRN 1001", timeout=0.5, interval=0.01, backend=first,
+                       ocr_engine=engine, watcher=watcher)
+    second = sc.ReplayBackend([SECOND])
+    assert sc.wait_for("text", text="MRN 1002", timeout=0.5, interval=0.01, backend=second,
+                       ocr_engine=engine, watcher=watcher)
+
+
+def test_wait_for_text_ocrs_small_changes_within_one_wait():
+    engine = FakeOCREngine(read_mrn)
+    backend = sc.ReplayBackend([FIRST, SECOND], advance_on_input=False)
+    seen = []
+
+    def reader(method, img, config):
+        seen.append(read_mrn(method, img, config))
+        if len(seen) == 2:
+            return seen[-1]
+        backend.advance()
+        return seen[-1]
+
+    engine.reader = reader
+    assert sc.wait_for("text", text="MRN 1002", timeout=1.0, interval=0.01, backend=backend,
+                       ocr_engine=engine)
+    assert seen == ["MRN 1001", "MRN 1002"]
@@ -0,0 +1,53 @@
+import os
+
+import sc
+from conftest import screen
+
+
+def archive(root, **kwargs):
+    kwargs.setdefault("max_bytes", 0)
+    kwargs.setdefault("max_days", 0)
+    return sc.ScreenshotArchive(root=str(root), **kwargs)
+
+
+def test_identical_frames_share_one_blob(tmp_path):
+    store = archive(tmp_path)
+    for patient in ("p1", "p2", "p3"):
+        store.save(screen(), patient=patient, step=1, run="r1", region=(0, 0, 400, 300))
+    store.save(screen(marks=[(5, 5, 9, 9)]), patient="p3", step=2, run="r1")
+    store.flush()
+    stats = store.stats()
+    assert (stats["shots"], stats["blobs"], stats["deduplicated"]) == (4, 2, 2)
+    shots = store.shots(patient="p3")
+    assert [s["step"] for s in shots] == [2, 1]
+    assert all(os.path.exists(s["path"]) for s in shots)
+    assert shots[1]["region"] == "[0, 0, 400, 300]"
+
+
+def test_blob_pruned_by_another_process_is_written_again(tmp_path):
+    first = archive(tmp_path)
+    first.save(screen(), patient="p1")
+    first.flush()
+    # A second instance on the same directory (another worker) prunes everything
+    second = archive(tmp_path, max_bytes=1)
+    assert second.stats()["blobs"] == 0
+    first.save(screen(), patient="p4")
+    first.flush()
+    shots = first.shots(patient="p4")
+    assert len(shots) == 1
+    assert os.path.exists(shots[0]["path"])
+    assert first.stats()["blobs"] == 1
+
+
+def test_age_limit_drops_old_shots_and_their_blobs(tmp_path):
+    store = archive(tmp_path)
+    store.save(screen(), patient="old")
+    store.flush()
+    path = store.shots()[0]["path"]
+    conn = store._connect()
+    conn.execute("UPDATE shots SET taken = taken - 3 * 86400")
+    conn.close()
+    store.max_days = 1
+    store.prune()
+    assert store.stats()["shots"] == 0
+    assert not os.path.exists(path)
@@ -0,0 +1,97 @@
+import pytest
+
+import sc
+from conftest import FakeOCREngine, ocr_data, screen
+
+
+def typed(steps, csv_columns=None):
+    backend = sc.ReplayBackend([screen()])
+    plan = sc.compile_sequence({"name": "typing", "steps": steps})
+    assert plan.run(backend, FakeOCREngine(lambda *args: ""), csv_value="P1", csv_columns=csv_columns)
+    return [e["text"] for e in backend.events if e["action"] == "type"]
+
+
+def test_doubled_braces_type_literal_braces():
+    plan = sc.compile_sequence({"steps": [{"type": "type", "text": "{{id}}"}]})
+    assert plan.csv_columns == frozenset()
+    assert typed([{"type": "type", "text": "{{id}}"}]) == ["{id}"]
+    assert typed([{"type": "type", "text": "{id} {{x}}"}], {"id": "P1"}) == ["P1 {x}"]
+    assert typed([{"type": "csv_input", "format": "{{{id}}}"}], {"id": "P1"}) == ["{P1}"]
+
+
+@pytest.mark.parametrize("text", ["a{b", "{}", "{0}", "b}"])
+def test_unescaped_braces_are_typed_as_written(text):
+    # Sequences written before placeholders were checked keep working
+    assert typed([{"type": "type", "text": text}]) == [text]
+    with pytest.raises(sc.SequenceError, match="literal braces"):
+        sc.compile_sequence({"steps": [{"type": "csv_input", "format": text}]})
+
+
+def test_compile_reports_the_failing_step():
+    with pytest.raises(sc.SequenceError, match="Step 2: unsupported step type 'jump'"):
+        sc.compile_sequence({"steps": [{"type": "wait", "duration": 0}, {"type": "jump"}]})
+    with pytest.raises(sc.SequenceError, match=r"Step 1 \(wait\)"):
+        sc.compile_sequence({"steps": [{"type": "wait", "duration": -1}]})
+    with pytest.raises(sc.SequenceError, match="list of steps"):
+        sc.compile_sequence({"steps": "wait"})
+
+
+def test_legacy_regions_are_read_as_xywh():
+    step = {"type": "ocr_click", "target_word": "OK", "region": [10, 20, 30, 40]}
+    legacy = sc.compile_sequence({"steps": [step]})
+    current = sc.compile_sequence({"region_format": "bbox", "steps": [step]})
+    assert legacy.steps[0].region.bbox == (10, 20, 40, 60)
+    assert current.steps[0].region.bbox == (10, 20, 30, 40)
+
+
+def test_compile_links_change_baselines_and_merges_ocr_regions():
+    plan = sc.compile_sequence({"region_format": "bbox", "steps": [
+        {"type": "ocr_click", "target_word": "Name", "region": [0, 0, 100, 20]},
+        {"type": "ocr_click", "target_word": "MRN", "region": [50, 10, 150, 30]},
+        {"type": "click", "x": 1, "y": 1},
+        {"type": "wait_for_change", "region": [0, 0, 50, 50]},
+        {"type": "type", "text": "{MRN}"},
+    ]})
+    first, second, click, wait, typing = plan.steps
+    assert first.capture_region == second.capture_region == sc.Region(0, 0, 150, 30)
+    assert click.baseline_for is wait
+    assert first.baseline_for is None
+    assert plan.csv_columns == {"MRN"}
+    assert plan.uses_csv
+
+
+def test_iter_csv_rows_streams_plain_lines_and_named_columns(tmp_path):
+    path = tmp_path / "rows.csv"
+    path.write_text("MRN, Name\n1, Ann\n\n2,Bob\n")
+    assert list(sc.iter_csv_rows(str(path))) == [
+        ("MRN, Name", None), ("1, Ann", None), ("2,Bob", None)]
+    assert list(sc.iter_csv_rows(str(path), header=True)) == [
+        ("1", {"MRN": "1", "Name": "Ann"}), ("2", {"MRN": "2", "Name": "Bob"})]
+
+
+def test_overlapping_ocr_clicks_share_one_ocr_pass():
+    backend = sc.ReplayBackend([screen()], advance_on_input=False)
+    # Boxes are relative to the merged capture (0, 0, 150, 30)
+    engine = FakeOCREngine(lambda method, img, config: ocr_data(
+        [("Name", (10, 5, 40, 15)), ("MRN", (110, 15, 140, 25))]))
+    plan = sc.compile_sequence({"region_format": "bbox", "steps": [
+        {"type": "ocr_click", "target_word": "Name", "region": [0, 0, 100, 20]},
+        {"type": "ocr_click", "target_word": "MRN", "region": [50, 10, 150, 30]},
+    ]})
+    assert plan.run(backend, engine)
+    assert engine.recognized == 1
+    assert [(e["x"], e["y"]) for e in backend.events if e["action"] == "click"] == [(25, 10), (125, 20)]
+
+
+def test_run_sequence_numbers_csv_rows_from_one(tmp_path, monkeypatch):
+    csv_file = tmp_path / "rows.csv"
+    csv_file.write_text("P1\nP2\n")
+    store = sc.OCRResultStore(str(tmp_path / "ocr.db"))
+    monkeypatch.setattr(sc, "_ocr_store", store)
+    engine = FakeOCREngine(lambda method, img, config: ocr_data([("Claim", (10, 10, 50, 20))]))
+    steps = {"steps": [{"type": "screenshot", "ocr": True, "save": False}]}
+
+    assert sc.run_sequence(steps, csv_file=str(csv_file), csv_row=1,
+                           backend=sc.ReplayBackend([screen()]), ocr_engine=engine)
+    store.close()
+    assert [(r["row"], r["patient"]) for r in store.search()] == [(2, "P2")]
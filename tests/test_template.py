@@ -0,0 +1,36 @@
+import sc
+from conftest import FakeOCREngine, ocr_data, screen
+
+BUTTON = [(100, 60, 130, 70), (104, 74, 126, 78), (112, 62, 116, 90)]
+
+
+def test_image_find_matches_the_template_in_screen_coordinates(tmp_path):
+    template = str(tmp_path / "submit.png")
+    screen(marks=BUTTON).crop((96, 56, 136, 96)).save(template)
+    backend = sc.ReplayBackend([screen(marks=BUTTON)])
+    engine = FakeOCREngine(lambda *args: {})
+
+    assert sc.image_find(template, (50, 40, 250, 200), backend=backend,
+                         ocr_engine=engine) == (96, 56, 136, 96)
+    assert engine.recognized == 0
+
+
+def test_image_find_falls_back_to_ocr_on_the_same_capture(tmp_path):
+    template = str(tmp_path / "submit.png")
+    screen(marks=BUTTON).crop((96, 56, 136, 96)).save(template)
+    backend = sc.ReplayBackend([screen(marks=[(10, 10, 20, 20)])])
+    engine = FakeOCREngine(lambda method, img, config: ocr_data([("Submit", (5, 5, 45, 20))]))
+
+    box = sc.image_find(template, (50, 40, 250, 200), fallback_text="Submit", backend=backend,
+                        ocr_engine=engine)
+    assert box == (55, 45, 95, 60)
+    assert backend.captures == 1
+    assert sc.image_find(str(tmp_path / "missing.png"), backend=backend, ocr_engine=engine) is None
+
+
+def test_detect_text_regions_boxes_text_like_blobs():
+    marks = [(20 + i * 8, 30, 24 + i * 8, 42) for i in range(6)] + [(200, 150, 380, 290)]
+    boxes = sc.detect_text_regions(screen(marks=marks))
+    assert any(x1 <= 20 and y1 <= 30 and x2 >= 64 and y2 >= 42 for x1, y1, x2, y2 in boxes)
+    # A solid block taller than max_height is not text
+    assert not any(y2 - y1 > sc.DETECT_MAX_HEIGHT for _, y1, _, y2 in boxes)
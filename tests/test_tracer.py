@@ -0,0 +1,44 @@
+import json
+import time
+
+import sc
+
+
+def traced(tracer, patients):
+    sc.set_tracer(tracer)
+    try:
+        for patient in patients:
+            with sc.trace_span("patient", "patient", patient_id=patient):
+                with sc.trace_span("search", "step"):
+                    time.sleep(0.002)
+                    sc.trace_add("ocr_calls")
+    finally:
+        sc.set_tracer(None)
+
+
+def test_jsonl_spans_are_streamed_not_buffered(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    tracer = sc.Tracer(path)
+    traced(tracer, ["A", "B", "C"])
+    assert len(tracer.spans) == 0
+    tracer.close()
+
+    with open(path) as f:
+        spans = [json.loads(line) for line in f]
+    assert [s["name"] for s in spans] == ["search", "patient"] * 3
+    rows = {row["name"]: row for row in tracer.summary()}
+    assert rows["patient"]["count"] == 3
+    assert rows["patient"]["counters"] == {"ocr_calls": 3}
+    # A parent's self time excludes its children
+    assert rows["patient"]["self"] < rows["search"]["self"]
+
+
+def test_buffered_spans_are_capped(tmp_path):
+    tracer = sc.Tracer(str(tmp_path / "trace.json"), max_spans=4)
+    traced(tracer, ["A", "B", "C", "D", "E"])
+    assert len(tracer.spans) == 4
+    assert tracer.dropped == 6
+    assert {row["name"]: row["count"] for row in tracer.summary()} == {"patient": 5, "search": 5}
+    tracer.close()
+    with open(tmp_path / "trace.json") as f:
+        assert len(json.load(f)["traceEvents"]) == 4
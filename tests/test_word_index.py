@@ -0,0 +1,60 @@
+import sc
+from conftest import FakeOCREngine, ocr_data, screen
+
+WORDS = ocr_data([
+    ("Patient", (10, 10, 60, 20)), ("ID:", (65, 10, 80, 20)),
+    ("Save/Close", (10, 40, 80, 50), 90, 2), ("[OK]", (90, 40, 110, 50), 90, 2),
+    ("Submit", (10, 70, 50, 80), 90, 3), ("Claim", (55, 70, 90, 80), 40, 3),
+    ("Insurence", (10, 100, 70, 110), 85, 4),
+])
+
+
+def test_exact_phrase_within_a_line():
+    index = sc.WordIndex(WORDS)
+    match = index.find("submit claim")
+    assert match["box"] == (10, 70, 90, 80)
+    assert match["score"] == 1.0
+    # Phrases do not run across lines
+    assert index.find("id: save/close") is None
+
+
+def test_fuzzy_finds_words_containing_the_target():
+    index = sc.WordIndex(WORDS)
+    assert index.find("ID") is None
+    assert index.find("ID", fuzzy=True)["box"] == (65, 10, 80, 20)
+    assert index.find("Save", fuzzy=True)["box"] == (10, 40, 80, 50)
+    assert index.find("OK", fuzzy=True)["box"] == (90, 40, 110, 50)
+
+
+def test_fuzzy_prefers_word_starts_and_ignores_weak_containment():
+    index = sc.WordIndex(ocr_data([
+        ("Invalid", (10, 10, 60, 20), 90, 1), ("ID:", (10, 40, 30, 50), 90, 2),
+        ("Book", (10, 70, 40, 80), 90, 3), ("[OK]", (50, 70, 70, 80), 90, 3),
+    ]))
+    assert index.find("ID", fuzzy=True)["text"] == "id:"
+    assert index.find("ID", fuzzy=True, within=(0, 0, 100, 30)) is None
+    assert index.find("OK", fuzzy=True)["text"] == "[ok]"
+
+
+def test_fuzzy_scores_misreads_when_nothing_contains_the_target():
+    index = sc.WordIndex(WORDS)
+    match = index.find("Insurance", fuzzy=True)
+    assert match["text"] == "insurence"
+    assert sc.FUZZY_MIN_SCORE <= match["score"] < 1.0
+    assert index.find("Referral", fuzzy=True) is None
+
+
+def test_within_limits_matches_to_a_box():
+    index = sc.WordIndex(WORDS)
+    assert index.find("claim", within=(0, 0, 200, 50)) is None
+    assert index.find("claim", within=(0, 60, 200, 90))["box"] == (55, 70, 90, 80)
+
+
+def test_click_on_word_clicks_in_screen_coordinates():
+    backend = sc.ReplayBackend([screen()])
+    engine = FakeOCREngine(lambda method, img, config: WORDS)
+    match = sc.click_on_word("Save", region=(100, 200, 300, 300), fuzzy=True, backend=backend,
+                             ocr_engine=engine)
+    assert match["box"] == (110, 240, 180, 250)
+    clicks = [e for e in backend.events if e["action"] == "click"]
+    assert (clicks[0]["x"], clicks[0]["y"]) == (145, 245)
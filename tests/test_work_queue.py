@@ -0,0 +1,76 @@
+import pytest
+
+import sc
+from conftest import FakeOCREngine, screen
+
+SEQUENCE = {"name": "queued", "steps": [
+    {"type": "csv_input"},
+    {"type": "wait_for_text", "text": "Saved", "timeout": 0.2, "interval": 0.01, "required": True},
+]}
+
+
+def replay_worker(fail_once=()):
+    """A SequenceWorker on its own ReplayBackend; patients in fail_once fail their first attempt"""
+    backend = sc.ReplayBackend([screen(), screen(marks=[(0, 0, 5, 5)])], loop=True)
+    failed = set()
+
+    def reader(method, img, config):
+        typed = [e["text"] for e in backend.events if e["action"] == "type"]
+        if typed and typed[-1] in fail_once and typed[-1] not in failed:
+            failed.add(typed[-1])
+            return ""
+        return "Saved"
+
+    return sc.SequenceWorker(SEQUENCE, backend=backend, ocr_engine=FakeOCREngine(reader))
+
+
+def test_lease_complete_and_retry(tmp_path):
+    queue = sc.WorkQueue(str(tmp_path / "q.db"), max_attempts=2)
+    assert queue.add(["A", "B", "A"]) == 2
+    assert queue.lease("w1") == "A"
+    assert queue.lease("w2") == "B"
+    assert queue.lease("w3") is None
+    assert queue.complete("A", "w1", False, "boom") == "pending"
+    assert queue.complete("B", "w2", True) == "done"
+    assert queue.lease("w2") == "A"
+    assert queue.complete("A", "w2", False) == "failed"
+    assert queue.counts() == {"done": 1, "failed": 1}
+    assert queue.remaining() == 0
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    queue = sc.WorkQueue(str(tmp_path / "q.db"), lease_seconds=0.1)
+    queue.add(["A"])
+    assert queue.lease("crashed") == "A"
+    # The crashed worker never completes; the live one waits for the lease to expire
+    counts = sc.run_queue_worker(queue, replay_worker(), "live", poll_interval=0.02)
+    assert counts["done"] == 1
+    assert queue.complete("A", "crashed", True) is None
+    assert queue.counts() == {"done": 1}
+
+
+def test_coordinator_retries_failures_across_replay_workers(tmp_path):
+    path = str(tmp_path / "q.db")
+    workers = [replay_worker(fail_once={"P2"}), replay_worker(fail_once={"P2"})]
+    summary = sc.BatchCoordinator(workers, path, max_attempts=3).run(["P1", "P2", "P3"])
+    assert summary["done"] == 3
+    assert summary["failed"] == 0
+    assert summary["attempts"] >= 4
+    assert sum(c["retried"] for c in summary["per_worker"].values()) >= 1
+    typed = [e["text"] for w in workers for e in w.backend.events if e["action"] == "type"]
+    assert sorted(set(typed)) == ["P1", "P2", "P3"]
+
+
+def test_resumed_run_counts_only_its_own_work(tmp_path):
+    path = str(tmp_path / "q.db")
+    sc.BatchCoordinator([replay_worker()], path).run(["P1", "P2"])
+    summary = sc.BatchCoordinator([replay_worker()], path).run(["P1", "P2", "P3"])
+    assert summary["done"] == 1
+    assert summary["attempts"] == 1
+
+
+def test_sequence_workers_reject_named_columns():
+    sequence = {"name": "cols", "steps": [{"type": "csv_input", "column": "MRN"}]}
+    with pytest.raises(sc.SequenceError):
+        sc.SequenceWorker(sequence, backend=sc.ReplayBackend([screen()]),
+                          ocr_engine=FakeOCREngine(lambda *a: ""))